@@ -0,0 +1,225 @@
+"""
+Usage Analytics for Shazam Telegram Bot
+Streaming aggregates for the admin /stats command and local dashboard
+
+Every recognition updates a handful of fixed-size structures in O(1):
+a count-min sketch with a small top-K table for popular tracks, rolling
+per-minute windows for success rates, per-hour buckets for volume and a
+per-language counter. Nothing ever scans the history, and memory stays
+bounded no matter how many events arrive.
+"""
+
+import hashlib
+import html
+import logging
+import time
+from array import array
+from typing import Dict, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+
+class CountMinSketch:
+    """Approximate frequency counts in fixed memory"""
+
+    def __init__(self, width: int = 2048, depth: int = 4):
+        self.width = width
+        self.depth = depth
+        self._rows = [array('L', [0]) * width for _ in range(depth)]
+
+    def _indexes(self, key: str):
+        """Column of key in each row, via double hashing"""
+        digest = hashlib.blake2b(key.encode('utf-8'), digest_size=16).digest()
+        h1 = int.from_bytes(digest[:8], 'little')
+        h2 = int.from_bytes(digest[8:], 'little') | 1
+        return [(h1 + i * h2) % self.width for i in range(self.depth)]
+
+    def add(self, key: str, count: int = 1) -> int:
+        """Count key and return its new estimated frequency"""
+        estimate = None
+        for row, index in zip(self._rows, self._indexes(key)):
+            row[index] += count
+            if estimate is None or row[index] < estimate:
+                estimate = row[index]
+        return estimate
+
+    def estimate(self, key: str) -> int:
+        """Estimated frequency of key (never an undercount)"""
+        return min(row[index] for row, index in zip(self._rows, self._indexes(key)))
+
+
+class TopK:
+    """The k most frequent keys, fed by count-min sketch estimates"""
+
+    def __init__(self, k: int = 10):
+        self.k = k
+        self._counts: Dict[str, int] = {}
+        self._labels: Dict[str, str] = {}
+
+    def offer(self, key: str, estimate: int, label: str):
+        """Update key's estimate, replacing the current minimum if it now ranks"""
+        if key in self._counts or len(self._counts) < self.k:
+            self._counts[key] = estimate
+            self._labels[key] = label
+            return
+
+        # k is small and fixed, so finding the minimum is constant work
+        min_key = min(self._counts, key=self._counts.get)
+        if estimate > self._counts[min_key]:
+            del self._counts[min_key]
+            del self._labels[min_key]
+            self._counts[key] = estimate
+            self._labels[key] = label
+
+    def items(self) -> List[Tuple[str, int]]:
+        """(label, count) pairs, most frequent first"""
+        ranked = sorted(self._counts.items(), key=lambda item: item[1], reverse=True)
+        return [(self._labels[key], count) for key, count in ranked]
+
+
+class RollingWindow:
+    """Event counts over a sliding window, kept in a ring of time buckets"""
+
+    def __init__(self, bucket_seconds: int, buckets: int):
+        self.bucket_seconds = bucket_seconds
+        self.buckets = buckets
+        self._counts = array('L', [0]) * buckets
+        self._bucket_ids = array('q', [-1]) * buckets
+
+    def add(self, now: Optional[float] = None, count: int = 1):
+        """Count events at time now"""
+        bucket_id = int((now or time.time()) // self.bucket_seconds)
+        index = bucket_id % self.buckets
+        if self._bucket_ids[index] != bucket_id:
+            self._bucket_ids[index] = bucket_id
+            self._counts[index] = 0
+        self._counts[index] += count
+
+    def series(self, now: Optional[float] = None) -> List[int]:
+        """Counts per bucket, oldest first, ending with the current bucket"""
+        current = int((now or time.time()) // self.bucket_seconds)
+        result = []
+        for bucket_id in range(current - self.buckets + 1, current + 1):
+            index = bucket_id % self.buckets
+            result.append(self._counts[index] if self._bucket_ids[index] == bucket_id else 0)
+        return result
+
+    def total(self, now: Optional[float] = None, last_buckets: Optional[int] = None) -> int:
+        """Events in the last `last_buckets` buckets (default: the whole window)"""
+        series = self.series(now)
+        return sum(series[-last_buckets:] if last_buckets else series)
+
+
+class Analytics:
+    """All usage aggregates, updated in O(1) per event"""
+
+    def __init__(self, top_k: int = 10):
+        self.started_at = time.time()
+        self.sketch = CountMinSketch()
+        self.top_tracks = TopK(top_k)
+        # Per-minute windows over the last 24 hours for rates
+        self.attempts = RollingWindow(60, 24 * 60)
+        self.successes = RollingWindow(60, 24 * 60)
+        # Per-hour volume over the last 24 hours
+        self.hourly = RollingWindow(3600, 24)
+        self.languages: Dict[str, int] = {}
+        self.total_attempts = 0
+        self.total_successes = 0
+
+    def record_recognition(self, success: bool, language: str, track_id: Optional[str] = None,
+                           label: Optional[str] = None):
+        """Record one recognition attempt"""
+        now = time.time()
+        self.total_attempts += 1
+        self.attempts.add(now)
+        self.hourly.add(now)
+        self.languages[language] = self.languages.get(language, 0) + 1
+
+        if success:
+            self.total_successes += 1
+            self.successes.add(now)
+            if track_id:
+                estimate = self.sketch.add(track_id)
+                self.top_tracks.offer(track_id, estimate, label or track_id)
+
+    @staticmethod
+    def _rate(successes: int, attempts: int) -> Optional[float]:
+        """Success rate, or None when there were no attempts"""
+        return successes / attempts if attempts else None
+
+    def snapshot(self) -> Dict:
+        """Current aggregates as plain data"""
+        now = time.time()
+        return {
+            'uptime_seconds': int(now - self.started_at),
+            'total_attempts': self.total_attempts,
+            'total_successes': self.total_successes,
+            'success_rate_1h': self._rate(self.successes.total(now, 60), self.attempts.total(now, 60)),
+            'success_rate_24h': self._rate(self.successes.total(now), self.attempts.total(now)),
+            'languages': dict(self.languages),
+            'hourly_volume': self.hourly.series(now),
+            'top_tracks': self.top_tracks.items(),
+        }
+
+
+def format_rate(rate: Optional[float]) -> str:
+    """Render a success rate as a percentage"""
+    return '-' if rate is None else f"{rate * 100:.1f}%"
+
+
+def render_dashboard(snapshot: Dict) -> str:
+    """HTML page for the local admin dashboard"""
+    top_rows = ''.join(
+        f"<tr><td>{rank}</td><td>{html.escape(label)}</td><td>{count}</td></tr>"
+        for rank, (label, count) in enumerate(snapshot['top_tracks'], 1)
+    )
+    language_rows = ''.join(
+        f"<tr><td>{html.escape(lang)}</td><td>{count}</td></tr>"
+        for lang, count in sorted(snapshot['languages'].items())
+    )
+    hourly = snapshot['hourly_volume']
+    peak = max(hourly) or 1
+    hourly_rows = ''.join(
+        f"<tr><td>-{len(hourly) - 1 - i}h</td><td>{count}</td>"
+        f"<td><div style=\"background:#4a90d9;height:10px;width:{int(200 * count / peak)}px\"></div></td></tr>"
+        for i, count in enumerate(hourly)
+    )
+    return f"""<!DOCTYPE html>
+<html><head><meta charset="utf-8"><meta http-equiv="refresh" content="30">
+<title>Shazam Bot Stats</title>
+<style>body{{font-family:sans-serif;margin:2em}}table{{border-collapse:collapse;margin-bottom:2em}}
+td,th{{border:1px solid #ccc;padding:4px 8px;text-align:left}}</style></head>
+<body>
+<h1>Shazam Bot Stats</h1>
+<p>Recognitions: {snapshot['total_attempts']} ({snapshot['total_successes']} identified)<br>
+Success rate: {format_rate(snapshot['success_rate_1h'])} last hour,
+{format_rate(snapshot['success_rate_24h'])} last 24h</p>
+<h2>Top songs</h2>
+<table><tr><th>#</th><th>Song</th><th>Count</th></tr>{top_rows}</table>
+<h2>Languages</h2>
+<table><tr><th>Language</th><th>Recognitions</th></tr>{language_rows}</table>
+<h2>Hourly volume</h2>
+<table><tr><th>Hour</th><th>Recognitions</th><th></th></tr>{hourly_rows}</table>
+</body></html>"""
+
+
+async def start_dashboard(analytics: Analytics, host: str, port: int):
+    """Serve the dashboard over HTTP; returns the web.AppRunner to clean up on shutdown"""
+    # aiohttp.web is only needed when the dashboard is enabled
+    from aiohttp import web
+
+    async def index(request: web.Request) -> web.Response:
+        return web.Response(text=render_dashboard(analytics.snapshot()), content_type='text/html')
+
+    async def stats_json(request: web.Request) -> web.Response:
+        return web.json_response(analytics.snapshot())
+
+    app = web.Application()
+    app.router.add_get('/', index)
+    app.router.add_get('/stats.json', stats_json)
+
+    runner = web.AppRunner(app, access_log=None)
+    await runner.setup()
+    await web.TCPSite(runner, host, port).start()
+    logger.info(f"Admin dashboard listening on http://{host}:{port}/")
+    return runner
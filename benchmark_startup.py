@@ -0,0 +1,67 @@
+#!/usr/bin/env python3
+"""
+Startup Benchmark for Shazam Telegram Bot
+Measures cold start time: importing shazam_bot and constructing ShazamBot
+
+Each run is a fresh interpreter so nothing is cached between runs. The
+bot is configured through environment variables with a throwaway token
+and temp directory; nothing connects to Telegram.
+
+Usage: python3 benchmark_startup.py [runs]
+"""
+
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+
+PROBE = """
+import time
+started = time.perf_counter()
+import shazam_bot
+imported = time.perf_counter()
+bot = shazam_bot.ShazamBot(shazam_bot.load_settings())
+constructed = time.perf_counter()
+bot.log_listener.stop()
+print(imported - started, constructed - imported)
+"""
+
+
+def run_once(env: dict) -> tuple:
+    """Start one interpreter and return (import seconds, construction seconds)"""
+    output = subprocess.run(
+        [sys.executable, '-c', PROBE],
+        cwd=os.path.dirname(os.path.abspath(__file__)),
+        env=env,
+        capture_output=True,
+        text=True,
+        check=True
+    ).stdout.split()
+    return float(output[-2]), float(output[-1])
+
+
+def main():
+    runs = int(sys.argv[1]) if len(sys.argv) > 1 else 10
+
+    with tempfile.TemporaryDirectory() as temp_dir:
+        env = dict(os.environ)
+        env.update({
+            'TELEGRAM_BOT_TOKEN': 'benchmark',
+            'TEMP_DOWNLOAD_PATH': temp_dir,
+            'LOG_FILE': 'None',
+            'LOG_LEVEL': 'WARNING',
+            'FILE_ID_REGISTRY_FILE': os.path.join(temp_dir, 'file_ids.json'),
+            'HISTORY_DB_FILE': os.path.join(temp_dir, 'history.db'),
+            'CACHE_SQLITE_FILE': os.path.join(temp_dir, 'cache.db'),
+        })
+        samples = [run_once(env) for _ in range(runs)]
+
+    for label, values in (('import', [s[0] for s in samples]), ('construct', [s[1] for s in samples]),
+                          ('total', [s[0] + s[1] for s in samples])):
+        print(f"{label:>10}: median {statistics.median(values) * 1000:7.1f} ms, "
+              f"min {min(values) * 1000:7.1f} ms, max {max(values) * 1000:7.1f} ms ({runs} runs)")
+
+
+if __name__ == "__main__":
+    main()
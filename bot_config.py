@@ -33,6 +33,15 @@ BOT_NAME = "Shazam Music Bot"
 # Example: [123456789, 987654321]
 ADMIN_USER_IDS = []
 
+# Admin dashboard
+# Admins can send /stats; the same numbers are served as a web page on
+# this address (keep it on localhost or behind a reverse proxy with auth)
+# The page has no authentication, so it is off by default; set a port
+# (e.g. 8080) to enable it. With several bot processes, give each its own
+# port (ADMIN_DASHBOARD_PORT=8081 in its environment) or enable it in one
+ADMIN_DASHBOARD_HOST = '127.0.0.1'
+ADMIN_DASHBOARD_PORT = None
+
 # ===========================================
 # FILE HANDLING SETTINGS
 # ===========================================
@@ -43,6 +52,8 @@ MAX_FILE_SIZE = 20 * 1024 * 1024
 
 # Supported audio file formats
 # Add or remove formats as needed
+# Checked against the format detected from the file's content, not its
+# name: voice messages count as '.opus', video notes as '.m4a'
 SUPPORTED_AUDIO_FORMATS = ['.mp3', '.m4a', '.ogg', '.flac', '.wav', '.opus', '.aac', '.wma']
 
 # ===========================================
@@ -66,6 +77,25 @@ ENABLE_DOWNLOAD = True
 # If recognition takes longer than this, it will be cancelled
 RECOGNITION_TIMEOUT = 30
 
+# Total time budget for one request (in seconds)
+# Covers fetching the file, downloading it, status updates and
+# recognition. Each step also gets a timeout learned from recent
+# latencies, so a stalled download is abandoned early; when time runs
+# out the user gets a timeout message
+REQUEST_TIMEOUT = 60
+
+# Tracklists for long recordings (DJ sets, mixes)
+# Files at least SEGMENTED_MIN_DURATION seconds long are recognized in
+# SEGMENT_WINDOW-second windows every SEGMENT_STEP seconds, SEGMENT_WORKERS
+# at a time, and answered with a timestamped tracklist that fills in as
+# it goes. Works for MP3, AAC and WAV files; other formats get a single
+# result as usual
+ENABLE_SEGMENTED_MODE = True
+SEGMENTED_MIN_DURATION = 600
+SEGMENT_WINDOW = 12
+SEGMENT_STEP = 30
+SEGMENT_WORKERS = 3
+
 # Maximum recognition attempts
 # How many times to try recognizing a song before giving up
 MAX_RECOGNITION_ATTEMPTS = 3
@@ -109,6 +139,23 @@ REQUEST_COOLDOWN = 5
 # Maximum concurrent recognition processes
 MAX_CONCURRENT_RECOGNITIONS = 5
 
+# Concurrent updates per priority lane
+# Inline queries and button presses are handled first, then text
+# messages and commands, then audio files. Saving an edited song and
+# re-sending one from history share the audio lane. A lane waits while a higher
+# lane has updates queued, and audio bursts can only fill their own lane
+LANE_LIMIT_INTERACTIVE = 64
+LANE_LIMIT_TEXT = 16
+LANE_LIMIT_RECOGNITION = 10
+
+# Graceful shutdown drain timeout (in seconds)
+# On SIGTERM the bot stops taking updates and gives in-flight recognitions
+# this long to finish; keep it below your service manager's stop timeout
+SHUTDOWN_DRAIN_TIMEOUT = 25
+
+# Age after which leftover temp files are removed on startup (in seconds)
+STALE_TEMP_FILE_AGE = 3600
+
 # ===========================================
 # LOGGING AND DEBUGGING
 # ===========================================
@@ -121,6 +168,12 @@ LOG_LEVEL = 'INFO'
 # Set to None to log to console only
 LOG_FILE = 'shazam_bot.log'
 
+# Log rotation
+# The log file is rotated when it reaches LOG_MAX_BYTES, keeping
+# LOG_BACKUP_COUNT old files (shazam_bot.log.1, shazam_bot.log.2, ...)
+LOG_MAX_BYTES = 10 * 1024 * 1024
+LOG_BACKUP_COUNT = 5
+
 # Enable/disable debug mode
 # Debug mode provides more detailed logging
 DEBUG_MODE = False
@@ -144,6 +197,19 @@ ENABLE_METADATA_WRITING = False
 # This adds Spotify links to song results
 ENABLE_SPOTIFY_INTEGRATION = True
 
+# Enable/disable cover art
+# Results are sent as photos with the song's cover art, which is also
+# embedded into files written by ENABLE_METADATA_WRITING
+ENABLE_COVER_ART = True
+
+# Disk budget for cached cover art (in bytes)
+# Least recently used images are removed when the cache grows past this
+COVER_ART_CACHE_BYTES = 64 * 1024 * 1024
+
+# Size of the cover art sent with results (in pixels)
+# Resizing needs Pillow; without it the original image is sent
+COVER_THUMBNAIL_SIZE = 600
+
 # ===========================================
 # CUSTOMIZATION OPTIONS
 # ===========================================
@@ -191,6 +257,41 @@ BACKUP_INTERVAL = 24
 # Backup file path
 BACKUP_FILE = 'user_preferences_backup.json'
 
+# Recognition history database path
+# Every identified song is stored here and listed by the /history command
+HISTORY_DB_FILE = 'history.db'
+
+# Songs shown per page in /history
+HISTORY_PAGE_SIZE = 8
+
+# Uploaded file registry path
+# Telegram file_ids of files the bot has uploaded (cover art, retagged
+# audio) are remembered here so they are never uploaded twice
+FILE_ID_REGISTRY_FILE = 'file_id_registry.json'
+
+# ===========================================
+# SHARED CACHE
+# ===========================================
+
+# Where recognitions, inline searches and user languages are cached
+# Each bot process keeps a small in-memory cache in front of a shared one,
+# so several processes share what any of them has looked up:
+# 'sqlite' - a database file; processes on the same machine share it
+# 'redis'  - a Redis (or Redis-compatible) server at CACHE_REDIS_URL
+# 'memory' - in-memory only, nothing is shared
+CACHE_BACKEND = 'sqlite'
+CACHE_SQLITE_FILE = 'cache.db'
+CACHE_REDIS_URL = 'redis://127.0.0.1:6379/0'
+
+# Entries kept in each process's in-memory cache
+CACHE_L1_ENTRIES = 2048
+
+# How long results are cached (in seconds)
+# "No match" and "no search results" are cached for NEGATIVE_CACHE_TTL
+RECOGNITION_CACHE_TTL = 7 * 24 * 3600
+SEARCH_CACHE_TTL = 3600
+NEGATIVE_CACHE_TTL = 600
+
 # ===========================================
 # NOTIFICATION SETTINGS
 # ===========================================
@@ -218,6 +319,28 @@ TEST_BOT_TOKEN = None
 # Enable/disable test features
 ENABLE_TEST_FEATURES = False
 
+# ===========================================
+# CONFIGURATION RELOAD
+# ===========================================
+
+# Watch this file and .env for changes while the bot is running
+# Every setting can also be set as an environment variable or in a .env
+# file with the same name (e.g. RECOGNITION_TIMEOUT=45); those win over
+# the values here. Lists are comma-separated (ADMIN_USER_IDS=1,2)
+ENABLE_CONFIG_RELOAD = True
+
+# How often to check for changes (in seconds)
+CONFIG_RELOAD_INTERVAL = 2.0
+
+# ===========================================
+# STARTUP
+# ===========================================
+
+# Load the recognition library in the background right after startup
+# The bot starts answering immediately either way; with this off the
+# library is loaded by the first recognition or inline search instead
+ENABLE_WARMUP = True
+
 # ===========================================
 # INSTRUCTIONS FOR USE
 # ===========================================
@@ -256,8 +379,16 @@ HOW TO USE THIS CONFIGURATION FILE:
 
 TO APPLY CHANGES:
 1. Save this file
-2. Restart the bot
-3. Test the new settings
+2. Changes are picked up within CONFIG_RELOAD_INTERVAL seconds; invalid
+   values are rejected (see the log) and the previous settings stay active
+3. TELEGRAM_BOT_TOKEN, TEMP_DOWNLOAD_PATH, LOG_FILE, LOG_MAX_BYTES,
+   LOG_BACKUP_COUNT, HISTORY_DB_FILE, FILE_ID_REGISTRY_FILE,
+   ADMIN_DASHBOARD_HOST/PORT, CACHE_BACKEND, CACHE_SQLITE_FILE,
+   CACHE_REDIS_URL, CACHE_L1_ENTRIES and
+   ENABLE_CONFIG_RELOAD need a restart (SIGTERM drains in-flight work;
+   updates not yet fetched are picked up after the restart, files that
+   arrive during the drain get a "send it again" reply)
+4. Test the new settings
 
 TROUBLESHOOTING:
 - If the bot doesn't start, check the token
@@ -0,0 +1,91 @@
+"""
+Callback Router for Shazam Telegram Bot
+Single dispatch point for inline keyboard callbacks
+
+callback_data is packed as "<version>:<action>[:<arg>...]". It is parsed
+once per callback and dispatched through a dict lookup on the action, so
+handlers receive their arguments already split and never re-parse
+query.data. Unversioned data from buttons sent by older releases is
+translated through exact and prefix aliases.
+"""
+
+import logging
+from typing import Awaitable, Callable, Dict, List, Optional, Tuple
+
+from telegram import Update
+from telegram.ext import ContextTypes
+
+logger = logging.getLogger(__name__)
+
+CALLBACK_VERSION = '1'
+SEPARATOR = ':'
+
+# Telegram rejects callback_data longer than this many bytes
+MAX_CALLBACK_DATA = 64
+
+CallbackHandlerFunc = Callable[..., Awaitable]
+
+
+def pack(action: str, *args) -> str:
+    """Build callback_data for an action"""
+    data = SEPARATOR.join((CALLBACK_VERSION, action) + tuple(str(arg) for arg in args))
+    if len(data.encode('utf-8')) > MAX_CALLBACK_DATA:
+        raise ValueError(f"callback_data too long: {data}")
+    return data
+
+
+class CallbackRouter:
+    """Dict-based dispatcher for versioned callback_data"""
+
+    def __init__(self):
+        self._routes: Dict[str, Tuple[CallbackHandlerFunc, int]] = {}
+        self._aliases: Dict[str, Tuple[str, Tuple[str, ...]]] = {}
+        self._prefix_aliases: List[Tuple[str, str]] = []
+
+    def route(self, action: str, handler: CallbackHandlerFunc, nargs: int = 0):
+        """Register the handler for an action taking nargs string arguments"""
+        if SEPARATOR in action:
+            raise ValueError(f"Action must not contain '{SEPARATOR}': {action}")
+        self._routes[action] = (handler, nargs)
+
+    def alias(self, legacy_data: str, action: str, *args):
+        """Map an exact legacy callback_data string to an action"""
+        self._aliases[legacy_data] = (action, tuple(str(arg) for arg in args))
+
+    def alias_prefix(self, legacy_prefix: str, action: str):
+        """Map legacy callback_data starting with a prefix to an action; the rest becomes the argument"""
+        self._prefix_aliases.append((legacy_prefix, action))
+        # Longest prefix wins, e.g. "edit_field_" before "edit_"
+        self._prefix_aliases.sort(key=lambda item: len(item[0]), reverse=True)
+
+    def parse(self, data: Optional[str]) -> Optional[Tuple[str, Tuple[str, ...]]]:
+        """Split callback_data into (action, args), or None if it is not routable"""
+        if not data:
+            return None
+
+        parts = data.split(SEPARATOR)
+        if len(parts) >= 2 and parts[0] == CALLBACK_VERSION:
+            return parts[1], tuple(parts[2:])
+
+        legacy = self._aliases.get(data)
+        if legacy:
+            return legacy
+        for prefix, action in self._prefix_aliases:
+            if data.startswith(prefix) and len(data) > len(prefix):
+                return action, (data[len(prefix):],)
+        return None
+
+    async def dispatch(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
+        """CallbackQueryHandler entry point"""
+        query = update.callback_query
+        parsed = self.parse(query.data)
+        route = self._routes.get(parsed[0]) if parsed else None
+
+        # Unknown action or wrong argument count: stale, malformed or forged data
+        if route is None or len(parsed[1]) != route[1]:
+            logger.warning(f"Unroutable callback_data: {query.data!r}")
+            await query.answer()
+            return
+
+        handler, _ = route
+        return await handler(update, context, *parsed[1])
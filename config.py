@@ -0,0 +1,346 @@
+"""
+Configuration Loader for Shazam Telegram Bot
+Typed settings read from bot_config.py and environment variables, reloadable at runtime
+
+Values come from bot_config.py, then from a .env file, then from the
+process environment (later sources win); each setting uses its
+bot_config.py name, e.g. RECOGNITION_TIMEOUT=45. Settings are validated
+before use. ConfigWatcher polls the files and hands validated new
+settings to subscribers, so most tuning takes effect without a restart.
+"""
+
+import asyncio
+import dataclasses
+import importlib.util
+import logging
+import os
+from dataclasses import dataclass, field, fields
+from typing import Callable, Dict, List, Optional, Union
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_CONFIG_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'bot_config.py')
+DEFAULT_ENV_PATH = '.env'
+
+PLACEHOLDER_TOKEN = "YOUR_TELEGRAM_BOT_TOKEN_HERE"
+SUPPORTED_LANGUAGES = ('fa', 'en')
+CACHE_BACKENDS = ('sqlite', 'redis', 'memory')
+LOG_LEVELS = ('DEBUG', 'INFO', 'WARNING', 'ERROR', 'CRITICAL')
+
+# Settings that are only read at startup; changes are reported but not applied
+RESTART_REQUIRED = frozenset({
+    'telegram_bot_token',
+    'temp_download_path',
+    'file_id_registry_file',
+    'history_db_file',
+    'cache_backend',
+    'cache_sqlite_file',
+    'cache_redis_url',
+    'cache_l1_entries',
+    'log_file',
+    'log_max_bytes',
+    'log_backup_count',
+    'admin_dashboard_host',
+    'admin_dashboard_port',
+    'enable_config_reload',
+})
+
+
+class ConfigError(ValueError):
+    """Raised when settings are missing or invalid"""
+
+
+@dataclass(frozen=True)
+class BotSettings:
+    """All bot settings; field names are the lowercase bot_config.py names"""
+
+    # Telegram
+    telegram_bot_token: str = PLACEHOLDER_TOKEN
+    bot_username: str = "ShazamMusicBot"
+    bot_name: str = "Shazam Music Bot"
+
+    # Administration
+    admin_user_ids: List[int] = field(default_factory=list)
+    admin_dashboard_host: str = '127.0.0.1'
+    admin_dashboard_port: Optional[int] = None
+
+    # Files
+    max_file_size: int = 20 * 1024 * 1024
+    supported_audio_formats: List[str] = field(
+        default_factory=lambda: ['.mp3', '.m4a', '.ogg', '.flac', '.wav', '.opus', '.aac', '.wma']
+    )
+    temp_download_path: str = "/tmp/shazam_bot"
+    enable_download: bool = True
+
+    # Recognition
+    recognition_timeout: float = 30
+    request_timeout: float = 60
+    max_recognition_attempts: int = 3
+
+    # Tracklists for long recordings
+    enable_segmented_mode: bool = True
+    segmented_min_duration: float = 600
+    segment_window: float = 12
+    segment_step: float = 30
+    segment_workers: int = 3
+
+    # Language
+    default_language: str = 'fa'
+    auto_detect_language: bool = True
+
+    # Rate limiting and concurrency
+    max_requests_per_minute: int = 10
+    request_cooldown: float = 5
+    max_concurrent_recognitions: int = 5
+    lane_limit_interactive: int = 64
+    lane_limit_text: int = 16
+    lane_limit_recognition: int = 10
+
+    # Shutdown
+    shutdown_drain_timeout: float = 25
+    stale_temp_file_age: int = 3600
+
+    # Logging
+    log_level: str = 'INFO'
+    log_file: Optional[str] = 'shazam_bot.log'
+    log_max_bytes: int = 10 * 1024 * 1024
+    log_backup_count: int = 5
+    debug_mode: bool = False
+
+    # Features
+    enable_inline_mode: bool = True
+    enable_song_editing: bool = True
+    enable_metadata_writing: bool = False
+    enable_spotify_integration: bool = True
+    enable_cover_art: bool = True
+    cover_art_cache_bytes: int = 64 * 1024 * 1024
+    cover_thumbnail_size: int = 600
+
+    # Storage
+    file_id_registry_file: str = 'file_id_registry.json'
+    history_db_file: str = 'history.db'
+    history_page_size: int = 8
+
+    # Shared cache
+    cache_backend: str = 'sqlite'
+    cache_sqlite_file: str = 'cache.db'
+    cache_redis_url: str = 'redis://127.0.0.1:6379/0'
+    cache_l1_entries: int = 2048
+    recognition_cache_ttl: float = 7 * 24 * 3600
+    search_cache_ttl: float = 3600
+    negative_cache_ttl: float = 600
+
+    # Hot reload
+    enable_config_reload: bool = True
+    config_reload_interval: float = 2.0
+
+    # Startup
+    enable_warmup: bool = True
+
+    @property
+    def effective_log_level(self) -> str:
+        """LOG_LEVEL, or DEBUG when DEBUG_MODE is on"""
+        return 'DEBUG' if self.debug_mode else self.log_level.upper()
+
+    def validate(self):
+        """Raise ConfigError listing every invalid setting"""
+        errors = []
+
+        for f in fields(self):
+            value = getattr(self, f.name)
+            if not _matches_type(value, f.type):
+                errors.append(f"{f.name.upper()} has invalid type {type(value).__name__}")
+        if errors:
+            raise ConfigError('; '.join(errors))
+
+        if not self.telegram_bot_token or self.telegram_bot_token == PLACEHOLDER_TOKEN:
+            errors.append("TELEGRAM_BOT_TOKEN is not set")
+        if self.default_language not in SUPPORTED_LANGUAGES:
+            errors.append(f"DEFAULT_LANGUAGE must be one of {SUPPORTED_LANGUAGES}")
+        if self.log_level.upper() not in LOG_LEVELS:
+            errors.append(f"LOG_LEVEL must be one of {LOG_LEVELS}")
+        if any(not ext.startswith('.') for ext in self.supported_audio_formats):
+            errors.append("SUPPORTED_AUDIO_FORMATS entries must start with '.'")
+        if self.admin_dashboard_port is not None and not 0 < self.admin_dashboard_port < 65536:
+            errors.append("ADMIN_DASHBOARD_PORT must be between 1 and 65535 or None")
+        if self.cache_backend not in CACHE_BACKENDS:
+            errors.append(f"CACHE_BACKEND must be one of {CACHE_BACKENDS}")
+        if self.cache_backend == 'redis' and not self.cache_redis_url.startswith('redis://'):
+            errors.append("CACHE_REDIS_URL must start with redis://")
+
+        for name in ('max_file_size', 'recognition_timeout', 'request_timeout', 'max_recognition_attempts',
+                     'max_requests_per_minute', 'max_concurrent_recognitions', 'lane_limit_interactive',
+                     'lane_limit_text', 'lane_limit_recognition', 'log_max_bytes',
+                     'cover_art_cache_bytes', 'cover_thumbnail_size', 'history_page_size',
+                     'config_reload_interval', 'segmented_min_duration', 'segment_window',
+                     'segment_step', 'segment_workers', 'cache_l1_entries', 'recognition_cache_ttl',
+                     'search_cache_ttl', 'negative_cache_ttl'):
+            if getattr(self, name) <= 0:
+                errors.append(f"{name.upper()} must be positive")
+        for name in ('request_cooldown', 'shutdown_drain_timeout', 'stale_temp_file_age', 'log_backup_count'):
+            if getattr(self, name) < 0:
+                errors.append(f"{name.upper()} must not be negative")
+
+        if errors:
+            raise ConfigError('; '.join(errors))
+
+
+def _matches_type(value, field_type) -> bool:
+    """Loose isinstance check for the annotation types used in BotSettings"""
+    origin = getattr(field_type, '__origin__', None)
+    args = getattr(field_type, '__args__', ())
+    if origin is Union:
+        return any(_matches_type(value, arg) for arg in args)
+    if origin in (list, List):
+        return isinstance(value, (list, tuple)) and all(_matches_type(item, args[0]) for item in value)
+    if field_type is type(None):
+        return value is None
+    if field_type is float:
+        return isinstance(value, (int, float)) and not isinstance(value, bool)
+    if field_type is int:
+        return isinstance(value, int) and not isinstance(value, bool)
+    return isinstance(value, field_type)
+
+
+def _parse_env(raw: str, field_type):
+    """Convert an environment variable string to a setting value"""
+    origin = getattr(field_type, '__origin__', None)
+    args = getattr(field_type, '__args__', ())
+    if origin is Union:
+        if raw.strip().lower() in ('', 'none', 'null'):
+            return None
+        return _parse_env(raw, next(arg for arg in args if arg is not type(None)))
+    if origin in (list, List):
+        return [_parse_env(item.strip(), args[0]) for item in raw.split(',') if item.strip()]
+    if field_type is bool:
+        lowered = raw.strip().lower()
+        if lowered in ('1', 'true', 'yes', 'on'):
+            return True
+        if lowered in ('0', 'false', 'no', 'off'):
+            return False
+        raise ValueError(f"not a boolean: {raw!r}")
+    return field_type(raw.strip())
+
+
+def _load_module_values(config_path: str) -> Dict:
+    """Execute bot_config.py as a fresh module and return its settings"""
+    spec = importlib.util.spec_from_file_location('_bot_config_snapshot', config_path)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+
+    values = {}
+    for f in fields(BotSettings):
+        name = f.name.upper()
+        if hasattr(module, name):
+            values[f.name] = getattr(module, name)
+    return values
+
+
+def _load_environment(env_path: str) -> Dict[str, str]:
+    """Variables from the .env file overlaid with the process environment"""
+    environ = {}
+    if env_path and os.path.exists(env_path):
+        from dotenv import dotenv_values
+        environ.update({key: value for key, value in dotenv_values(env_path).items() if value is not None})
+    environ.update(os.environ)
+    return environ
+
+
+def load_settings(config_path: str = DEFAULT_CONFIG_PATH, env_path: str = DEFAULT_ENV_PATH) -> BotSettings:
+    """Load and validate settings"""
+    try:
+        values = _load_module_values(config_path) if os.path.exists(config_path) else {}
+    except Exception as e:
+        raise ConfigError(f"Could not load {config_path}: {e}") from e
+
+    environ = _load_environment(env_path)
+    for f in fields(BotSettings):
+        name = f.name.upper()
+        if name in environ:
+            try:
+                values[f.name] = _parse_env(environ[name], f.type)
+            except (TypeError, ValueError) as e:
+                raise ConfigError(f"Invalid value for {name}: {e}") from e
+
+    settings = BotSettings(**values)
+    settings.validate()
+    return settings
+
+
+class ConfigWatcher:
+    """Polls the config files and publishes validated changes"""
+
+    def __init__(self, settings: BotSettings, config_path: str = DEFAULT_CONFIG_PATH,
+                 env_path: str = DEFAULT_ENV_PATH):
+        self.settings = settings
+        self.config_path = config_path
+        self.env_path = env_path
+        self._subscribers: List[Callable[[BotSettings, BotSettings], None]] = []
+        self._mtimes = self._stat()
+        self._task: Optional[asyncio.Task] = None
+
+    def subscribe(self, callback: Callable[[BotSettings, BotSettings], None]):
+        """Call callback(old, new) whenever settings change"""
+        self._subscribers.append(callback)
+
+    def _stat(self):
+        """Modification times of the watched files"""
+        mtimes = []
+        for path in (self.config_path, self.env_path):
+            try:
+                mtimes.append(os.stat(path).st_mtime_ns)
+            except OSError:
+                mtimes.append(None)
+        return mtimes
+
+    def reload(self) -> bool:
+        """Load settings now; returns True if anything was applied"""
+        try:
+            new = load_settings(self.config_path, self.env_path)
+        except ConfigError as e:
+            logger.error(f"Config reload rejected, keeping current settings: {e}")
+            return False
+
+        old = self.settings
+        changed = {f.name for f in fields(BotSettings) if getattr(old, f.name) != getattr(new, f.name)}
+        pending_restart = changed & RESTART_REQUIRED
+        if pending_restart:
+            logger.warning(f"Restart required to apply: {', '.join(sorted(n.upper() for n in pending_restart))}")
+            new = dataclasses.replace(new, **{name: getattr(old, name) for name in pending_restart})
+
+        applied = changed - RESTART_REQUIRED
+        if not applied:
+            return False
+
+        self.settings = new
+        logger.info(f"Config reloaded: {', '.join(sorted(n.upper() for n in applied))}")
+        for callback in self._subscribers:
+            try:
+                callback(old, new)
+            except Exception as e:
+                logger.error(f"Error applying config change: {e}")
+        return True
+
+    async def _poll(self):
+        """Reload whenever a watched file's mtime changes"""
+        while True:
+            await asyncio.sleep(self.settings.config_reload_interval)
+            mtimes = self._stat()
+            if mtimes != self._mtimes:
+                self._mtimes = mtimes
+                self.reload()
+
+    def start(self):
+        """Start watching in the background"""
+        if self._task is None:
+            self._task = asyncio.create_task(self._poll())
+
+    async def stop(self):
+        """Stop watching"""
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
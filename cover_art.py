@@ -0,0 +1,239 @@
+"""
+Cover Art Service for Shazam Telegram Bot
+Downloads cover art once, stores it content-addressed on disk and serves resized thumbnails
+
+Originals are stored as <sha256>.<ext> so the same artwork reached through
+different URLs is only kept once. Thumbnails are produced in a small thread
+pool; Pillow releases the GIL while resizing and encoding, and threads are
+safe to start from this multi-threaded process where forking is not
+(Pillow is optional; without it the original image is used). The whole
+store, url index included, is bounded by a byte budget with
+least-recently-used eviction.
+"""
+
+import asyncio
+import hashlib
+import json
+import logging
+import os
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, Optional
+
+from single_flight import SingleFlight
+
+logger = logging.getLogger(__name__)
+
+INDEX_FILE = 'index.json'
+
+
+def _image_extension(data: bytes) -> str:
+    """File extension for image bytes"""
+    if data[:8] == b'\x89PNG\r\n\x1a\n':
+        return '.png'
+    return '.jpg'
+
+
+def _make_thumbnail(source_path: str, target_path: str, size: int) -> bool:
+    """Resize an image to fit in size x size; runs in a worker thread"""
+    try:
+        from PIL import Image
+    except ImportError:
+        return False
+
+    with Image.open(source_path) as image:
+        image = image.convert('RGB')
+        image.thumbnail((size, size))
+        tmp_path = target_path + '.tmp'
+        image.save(tmp_path, 'JPEG', quality=85, optimize=True)
+    os.replace(tmp_path, target_path)
+    return True
+
+
+class CoverArtService:
+    """Content-addressed, byte-budgeted cover art store"""
+
+    def __init__(self, directory: str, max_bytes: int = 64 * 1024 * 1024, workers: int = 2,
+                 download_timeout: int = 10):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.download_timeout = download_timeout
+        self._pool = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='cover-art')
+        self._session = None  # aiohttp.ClientSession, created on first download
+
+        # url -> content hash
+        self._url_index: Dict[str, str] = {}
+        # file path -> size, in LRU order
+        self._files: "OrderedDict[str, int]" = OrderedDict()
+        self._total_bytes = 0
+        # In-flight downloads and resizes, so concurrent callers share one
+        self._flights = SingleFlight()
+
+        os.makedirs(directory, exist_ok=True)
+        self._load()
+
+    def _load(self):
+        """Rebuild the LRU from disk and restore the url index"""
+        entries = []
+        for name in os.listdir(self.directory):
+            path = os.path.join(self.directory, name)
+            if name == INDEX_FILE or not os.path.isfile(path):
+                continue
+            stat = os.stat(path)
+            entries.append((stat.st_atime, path, stat.st_size))
+        for _, path, size in sorted(entries):
+            self._files[path] = size
+            self._total_bytes += size
+
+        try:
+            with open(os.path.join(self.directory, INDEX_FILE), 'r', encoding='utf-8') as f:
+                self._url_index = json.load(f)
+        except (OSError, ValueError):
+            self._url_index = {}
+        # Forget urls whose art was evicted before the last shutdown
+        self._prune_index()
+
+    def _prune_index(self, evicted: Optional[set] = None):
+        """Drop url index entries whose original is gone (or, if given, in evicted)"""
+        if evicted is None:
+            stored = {os.path.splitext(os.path.basename(path))[0] for path in self._files}
+            self._url_index = {url: h for url, h in self._url_index.items() if h in stored}
+        elif evicted:
+            self._url_index = {url: h for url, h in self._url_index.items() if h not in evicted}
+
+    def save_index(self):
+        """Persist the url index so restarts don't re-download art"""
+        path = os.path.join(self.directory, INDEX_FILE)
+        tmp_path = path + '.tmp'
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(self._url_index, f)
+        os.replace(tmp_path, path)
+
+    async def close(self):
+        """Release the HTTP session and worker pool"""
+        if self._session and not self._session.closed:
+            await self._session.close()
+        self._pool.shutdown(wait=False)
+
+    def _touch(self, path: str):
+        """Mark a stored file as recently used"""
+        if path in self._files:
+            self._files.move_to_end(path)
+
+    def _add_file(self, path: str):
+        """Account for a new file and evict until under budget"""
+        size = os.path.getsize(path)
+        self._total_bytes += size - self._files.pop(path, 0)
+        self._files[path] = size
+        self._evict()
+
+    def _evict(self):
+        """Remove least recently used files until under budget"""
+        evicted = set()
+        while self._total_bytes > self.max_bytes and len(self._files) > 1:
+            old_path, old_size = self._files.popitem(last=False)
+            self._total_bytes -= old_size
+            name = os.path.splitext(os.path.basename(old_path))[0]
+            if '_' not in name:
+                # An original (thumbnails are <hash>_<size>)
+                evicted.add(name)
+            try:
+                os.unlink(old_path)
+            except OSError:
+                pass
+        self._prune_index(evicted)
+
+    def resize(self, max_bytes: int):
+        """Change the disk budget, evicting immediately if it shrank"""
+        self.max_bytes = max_bytes
+        self._evict()
+
+    def _original_path(self, content_hash: str) -> Optional[str]:
+        """Path of the stored original for a hash, if present"""
+        for ext in ('.jpg', '.png'):
+            path = os.path.join(self.directory, content_hash + ext)
+            if path in self._files and os.path.exists(path):
+                return path
+        return None
+
+    async def _download(self, url: str) -> Optional[str]:
+        """Fetch a url and store it under its content hash"""
+        if self._session is None or self._session.closed:
+            import aiohttp
+
+            timeout = aiohttp.ClientTimeout(total=self.download_timeout)
+            self._session = aiohttp.ClientSession(timeout=timeout)
+
+        async with self._session.get(url) as response:
+            if response.status != 200:
+                logger.warning(f"Cover art returned HTTP {response.status}: {url}")
+                return None
+            data = await response.read()
+
+        content_hash = hashlib.sha256(data).hexdigest()
+        path = os.path.join(self.directory, content_hash + _image_extension(data))
+        if not os.path.exists(path):
+            tmp_path = path + '.tmp'
+            with open(tmp_path, 'wb') as f:
+                f.write(data)
+            os.replace(tmp_path, path)
+        self._add_file(path)
+        self._url_index[url] = content_hash
+        return path
+
+    async def get_original(self, url: Optional[str]) -> Optional[str]:
+        """Return the local path of the full-size art for a url"""
+        if not url:
+            return None
+
+        content_hash = self._url_index.get(url)
+        if content_hash:
+            path = self._original_path(content_hash)
+            if path:
+                self._touch(path)
+                return path
+
+        try:
+            return await self._flights.run(url, lambda: self._download(url))
+        except Exception as e:
+            logger.warning(f"Cover art download failed: {e}")
+            return None
+
+    async def get_bytes(self, url: Optional[str]) -> Optional[bytes]:
+        """Return the full-size art bytes for a url"""
+        path = await self.get_original(url)
+        if not path:
+            return None
+        with open(path, 'rb') as f:
+            return f.read()
+
+    async def get_thumbnail(self, url: Optional[str], size: int) -> Optional[str]:
+        """Return the path of a size x size thumbnail, falling back to the original"""
+        original = await self.get_original(url)
+        if not original:
+            return None
+
+        content_hash = os.path.splitext(os.path.basename(original))[0]
+        thumb_path = os.path.join(self.directory, f"{content_hash}_{size}.jpg")
+        if thumb_path in self._files and os.path.exists(thumb_path):
+            self._touch(thumb_path)
+            return thumb_path
+
+        async def resize():
+            loop = asyncio.get_running_loop()
+            created = await loop.run_in_executor(self._pool, _make_thumbnail, original, thumb_path, size)
+            if not created:
+                return original
+            self._add_file(thumb_path)
+            return thumb_path
+
+        try:
+            return await self._flights.run(thumb_path, resize)
+        except Exception as e:
+            logger.warning(f"Cover art resize failed: {e}")
+            return original
+
+    def content_key(self, url: Optional[str], size: int) -> Optional[str]:
+        """Key identifying a given rendition of the art behind a url"""
+        content_hash = self._url_index.get(url) if url else None
+        return f"cover:{content_hash}_{size}" if content_hash else None
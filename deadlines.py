@@ -0,0 +1,129 @@
+"""
+Request Deadlines for Shazam Telegram Bot
+One time budget per request, shared by every stage of the recognition pipeline
+
+A Deadline is created when an audio file arrives and passed to each
+stage (get_file, download, status edits, recognition). Each stage gets
+the smaller of the remaining budget and an adaptive timeout derived from
+recently observed latencies for that stage, so a stalled download is
+abandoned long before it can eat the whole budget. When a stage runs out
+of time it is cancelled and DeadlineExceeded is raised.
+"""
+
+import asyncio
+import math
+from collections import deque
+from typing import Awaitable, Deque, Dict, Optional
+
+# Adaptive timeout = this percentile of recent latencies times the multiplier
+TIMEOUT_PERCENTILE = 0.95
+TIMEOUT_MULTIPLIER = 3.0
+# Until this many samples exist a stage may use the whole remaining budget
+MIN_SAMPLES = 20
+# Adaptive timeouts never go below this many seconds
+MIN_STAGE_TIMEOUT = 2.0
+# Status messages sent after the budget is spent (timeout, restart) get this long
+STATUS_EDIT_TIMEOUT = 10.0
+
+
+class DeadlineExceeded(Exception):
+    """A stage ran out of time"""
+
+    def __init__(self, stage: str):
+        super().__init__(f"Deadline exceeded during {stage}")
+        self.stage = stage
+
+
+class LatencyTracker:
+    """Recent per-stage latencies and the timeouts derived from them"""
+
+    def __init__(self, window: int = 200):
+        self.window = window
+        self._samples: Dict[str, Deque[float]] = {}
+
+    def record(self, stage: str, seconds: float):
+        """Add one observed latency"""
+        samples = self._samples.get(stage)
+        if samples is None:
+            samples = self._samples[stage] = deque(maxlen=self.window)
+        samples.append(seconds)
+
+    def percentile(self, stage: str, q: float) -> Optional[float]:
+        """Nearest-rank percentile of a stage's recent latencies"""
+        samples = self._samples.get(stage)
+        if not samples:
+            return None
+        ordered = sorted(samples)
+        return ordered[min(len(ordered) - 1, max(0, math.ceil(q * len(ordered)) - 1))]
+
+    def timeout_for(self, stage: str) -> Optional[float]:
+        """Adaptive timeout for one unit of a stage, or None while there is too little data"""
+        samples = self._samples.get(stage)
+        if not samples or len(samples) < MIN_SAMPLES:
+            return None
+        return max(MIN_STAGE_TIMEOUT, self.percentile(stage, TIMEOUT_PERCENTILE) * TIMEOUT_MULTIPLIER)
+
+    def snapshot(self) -> Dict[str, Dict[str, float]]:
+        """p50/p95 per stage, for logging and stats"""
+        return {
+            stage: {'p50': self.percentile(stage, 0.5), 'p95': self.percentile(stage, 0.95)}
+            for stage in self._samples
+        }
+
+
+class Deadline:
+    """Time budget for one request"""
+
+    def __init__(self, budget: float, tracker: Optional[LatencyTracker] = None):
+        self._loop = asyncio.get_running_loop()
+        self.expires_at = self._loop.time() + budget
+        self.tracker = tracker
+
+    def remaining(self) -> float:
+        """Seconds left, never negative"""
+        return max(0.0, self.expires_at - self._loop.time())
+
+    @property
+    def expired(self) -> bool:
+        return self.remaining() <= 0
+
+    def stage_timeout(self, stage: str, scale: float = 1.0, cap: Optional[float] = None,
+                      adaptive: bool = True) -> float:
+        """Timeout for the next run of a stage"""
+        timeout = self.remaining()
+        if cap is not None:
+            timeout = min(timeout, cap)
+        learned = self.tracker.timeout_for(stage) if self.tracker and adaptive else None
+        if learned is not None:
+            timeout = min(timeout, learned * scale)
+        return timeout
+
+    async def run(self, stage: str, awaitable: Awaitable, scale: float = 1.0, cap: Optional[float] = None,
+                  adaptive: bool = True):
+        """Await a stage within its timeout and record how long it took
+
+        scale normalizes latencies that grow with the input, e.g. download
+        time per megabyte; cap is an extra upper bound for the stage.
+        Stages whose latency says nothing about health (waiting for a
+        free slot) pass adaptive=False and are bounded by the budget only.
+        """
+        timeout = self.stage_timeout(stage, scale, cap, adaptive)
+        if timeout <= 0:
+            if asyncio.iscoroutine(awaitable):
+                awaitable.close()
+            raise DeadlineExceeded(stage)
+
+        started = self._loop.time()
+        try:
+            result = await asyncio.wait_for(awaitable, timeout)
+        except asyncio.TimeoutError:
+            # Record the timeout too (a lower bound on the real latency), or a
+            # stage that got slower would keep timing out at its old p95
+            self._record(stage, started, scale, adaptive)
+            raise DeadlineExceeded(stage) from None
+        self._record(stage, started, scale, adaptive)
+        return result
+
+    def _record(self, stage: str, started: float, scale: float, adaptive: bool):
+        if self.tracker and adaptive:
+            self.tracker.record(stage, (self._loop.time() - started) / scale)
@@ -0,0 +1,147 @@
+"""
+Telegram file_id Registry for Shazam Telegram Bot
+Maps content keys to the file_id Telegram returned on first upload
+
+Once a file has been uploaded, later sends reference its file_id and
+transfer zero bytes. Entries are persisted to a JSON file so they survive
+restarts, and an entry is dropped when Telegram rejects its file_id.
+"""
+
+import asyncio
+import json
+import logging
+import os
+from collections import OrderedDict
+from typing import Any, Awaitable, Callable, Optional
+
+from telegram import Message
+from telegram.error import BadRequest
+
+logger = logging.getLogger(__name__)
+
+# Fragments of the BadRequest messages that mean a file_id itself is no
+# longer usable; any other BadRequest (caption, reply target) is not its fault
+STALE_FILE_ID_ERRORS = (
+    'wrong file identifier',
+    'file reference',
+    'wrong remote file',
+    'file_id',
+    'file identifier',
+)
+
+
+def is_stale_file_id(error: BadRequest) -> bool:
+    """Whether Telegram rejected a request because of the file_id it referenced"""
+    message = str(error).lower()
+    return any(fragment in message for fragment in STALE_FILE_ID_ERRORS)
+
+
+def message_file_id(message: Message) -> Optional[str]:
+    """Extract the file_id of the media in a sent message"""
+    if message.photo:
+        return message.photo[-1].file_id
+    for attr in ('audio', 'document', 'voice', 'video', 'animation', 'sticker'):
+        media = getattr(message, attr, None)
+        if media:
+            return media.file_id
+    return None
+
+
+class FileIdRegistry:
+    """Persistent LRU map of content key -> Telegram file_id"""
+
+    def __init__(self, path: str, max_entries: int = 10000, save_delay: float = 5.0):
+        self.path = path
+        self.max_entries = max_entries
+        self.save_delay = save_delay
+        self._entries: "OrderedDict[str, str]" = OrderedDict()
+        self._dirty = False
+        self._save_handle: Optional[asyncio.TimerHandle] = None
+        self._load()
+
+    def _load(self):
+        """Load persisted entries"""
+        try:
+            with open(self.path, 'r', encoding='utf-8') as f:
+                self._entries = OrderedDict(json.load(f))
+        except FileNotFoundError:
+            pass
+        except (OSError, ValueError) as e:
+            logger.warning(f"Could not load file_id registry {self.path}: {e}")
+
+    def save(self):
+        """Write entries to disk atomically if anything changed"""
+        if self._save_handle:
+            self._save_handle.cancel()
+            self._save_handle = None
+        if not self._dirty:
+            return
+
+        tmp_path = self.path + '.tmp'
+        try:
+            with open(tmp_path, 'w', encoding='utf-8') as f:
+                json.dump(list(self._entries.items()), f)
+            os.replace(tmp_path, self.path)
+            self._dirty = False
+        except OSError as e:
+            logger.warning(f"Could not save file_id registry {self.path}: {e}")
+
+    def _schedule_save(self):
+        """Batch writes: save once, shortly after the first change"""
+        self._dirty = True
+        if self._save_handle:
+            return
+        try:
+            loop = asyncio.get_running_loop()
+        except RuntimeError:
+            self.save()
+            return
+        self._save_handle = loop.call_later(self.save_delay, self.save)
+
+    def get(self, key: Optional[str]) -> Optional[str]:
+        """Return the file_id for a key, if known"""
+        if not key:
+            return None
+        file_id = self._entries.get(key)
+        if file_id:
+            self._entries.move_to_end(key)
+        return file_id
+
+    def put(self, key: Optional[str], file_id: Optional[str]):
+        """Record the file_id Telegram assigned to a key"""
+        if not key or not file_id or self._entries.get(key) == file_id:
+            return
+        self._entries[key] = file_id
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+        self._schedule_save()
+
+    def invalidate(self, key: Optional[str]):
+        """Forget a key whose file_id Telegram no longer accepts"""
+        if key and self._entries.pop(key, None) is not None:
+            self._schedule_save()
+
+    async def send(self, key: Optional[str], send: Callable[[Any], Awaitable[Message]],
+                   open_upload: Callable[[], Awaitable[Any]]) -> Message:
+        """
+        Send media by file_id when possible, uploading it otherwise
+
+        `send` is called with either a file_id string or an open file object;
+        `open_upload` is a coroutine function returning the file object to
+        upload on a miss.
+        """
+        file_id = self.get(key)
+        if file_id:
+            try:
+                return await send(file_id)
+            except BadRequest as e:
+                if not is_stale_file_id(e):
+                    raise
+                logger.info(f"Stale file_id for {key}, re-uploading: {e}")
+                self.invalidate(key)
+
+        with await open_upload() as upload:
+            message = await send(upload)
+        self.put(key, message_file_id(message))
+        return message
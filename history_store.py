@@ -0,0 +1,183 @@
+"""
+Recognition History for Shazam Telegram Bot
+Append-only, indexed store of every song a user has identified
+
+Entries live in SQLite (WAL mode) with an index on (user_id, id), so a
+user's history is paged with keyset pagination ("id < cursor") instead of
+OFFSET scans. Writes are queued and flushed in batches by a background
+task; recording an entry never waits for the disk.
+"""
+
+import asyncio
+import json
+import logging
+import sqlite3
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS history (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    user_id INTEGER NOT NULL,
+    ts INTEGER NOT NULL,
+    track_id TEXT,
+    song TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_history_user ON history (user_id, id);
+"""
+
+
+class HistoryStore:
+    """Batched writer and keyset-paginated reader for recognition history"""
+
+    def __init__(self, db_path: str, batch_size: int = 200, flush_interval: float = 1.0,
+                 max_queue: int = 10000):
+        self.db_path = db_path
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        # One worker thread owns the connection, so all SQL is serialized
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='history')
+        self.max_queue = max_queue
+        self._queue: Optional[asyncio.Queue] = None
+        self._writer_task: Optional[asyncio.Task] = None
+        self._conn: Optional[sqlite3.Connection] = None
+
+    def _open(self):
+        """Open the database and create the schema (worker thread)"""
+        self._conn = sqlite3.connect(self.db_path, check_same_thread=False)
+        self._conn.execute('PRAGMA journal_mode=WAL')
+        self._conn.execute('PRAGMA synchronous=NORMAL')
+        self._conn.executescript(SCHEMA)
+        self._conn.commit()
+
+    def _insert_many(self, rows: List[Tuple]):
+        """Insert a batch of rows in one transaction (worker thread)"""
+        with self._conn:
+            self._conn.executemany(
+                'INSERT INTO history (user_id, ts, track_id, song) VALUES (?, ?, ?, ?)',
+                rows
+            )
+
+    def _select_page(self, user_id: int, before_id: Optional[int], limit: int) -> List[Tuple]:
+        """Fetch one page of a user's history, newest first (worker thread)"""
+        if before_id is None:
+            cursor = self._conn.execute(
+                'SELECT id, ts, track_id, song FROM history WHERE user_id = ? ORDER BY id DESC LIMIT ?',
+                (user_id, limit)
+            )
+        else:
+            cursor = self._conn.execute(
+                'SELECT id, ts, track_id, song FROM history WHERE user_id = ? AND id < ? ORDER BY id DESC LIMIT ?',
+                (user_id, before_id, limit)
+            )
+        return cursor.fetchall()
+
+    def _select_one(self, user_id: int, entry_id: int) -> Optional[Tuple]:
+        """Fetch a single entry belonging to a user (worker thread)"""
+        cursor = self._conn.execute(
+            'SELECT id, ts, track_id, song FROM history WHERE user_id = ? AND id = ?',
+            (user_id, entry_id)
+        )
+        return cursor.fetchone()
+
+    async def _run(self, func, *args):
+        """Run a database function on the worker thread"""
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._executor, func, *args)
+
+    async def start(self):
+        """Open the database and start the background writer"""
+        await self._run(self._open)
+        self._queue = asyncio.Queue(maxsize=self.max_queue)
+        self._writer_task = asyncio.create_task(self._writer())
+
+    async def close(self):
+        """Flush queued entries and close the database"""
+        if self._writer_task:
+            self._writer_task.cancel()
+            try:
+                await self._writer_task
+            except asyncio.CancelledError:
+                pass
+            self._writer_task = None
+        await self._flush(self._drain_queue())
+        if self._conn:
+            await self._run(self._conn.close)
+            self._conn = None
+        self._executor.shutdown(wait=True)
+
+    def record(self, user_id: int, track_id: Optional[str], song: Dict):
+        """Queue a history entry; never blocks the caller"""
+        if self._queue is None:
+            return
+        row = (user_id, int(time.time()), track_id, json.dumps(song, ensure_ascii=False))
+        try:
+            self._queue.put_nowait(row)
+        except asyncio.QueueFull:
+            logger.warning("History queue full, dropping entry")
+
+    def _drain_queue(self) -> List[Tuple]:
+        """Take everything currently queued"""
+        rows = []
+        while self._queue is not None and not self._queue.empty():
+            rows.append(self._queue.get_nowait())
+        return rows
+
+    async def _flush(self, rows: List[Tuple]):
+        """Write a batch, logging instead of raising"""
+        if not rows or not self._conn:
+            return
+        try:
+            await self._run(self._insert_many, rows)
+        except Exception as e:
+            logger.error(f"Failed to write {len(rows)} history entries: {e}")
+
+    async def _writer(self):
+        """Collect entries for up to flush_interval or batch_size, then write them together"""
+        loop = asyncio.get_running_loop()
+        while True:
+            rows = []
+            try:
+                rows.append(await self._queue.get())
+                deadline = loop.time() + self.flush_interval
+                while len(rows) < self.batch_size:
+                    remaining = deadline - loop.time()
+                    if remaining <= 0:
+                        break
+                    try:
+                        rows.append(await asyncio.wait_for(self._queue.get(), remaining))
+                    except asyncio.TimeoutError:
+                        break
+            except asyncio.CancelledError:
+                # Closing: don't lose the batch being collected
+                await self._flush(rows)
+                raise
+            # A write already handed to the worker thread completes even if we are cancelled
+            await self._flush(rows)
+
+    @staticmethod
+    def _to_entry(row: Tuple) -> Dict:
+        """Convert a database row to an entry dict"""
+        entry_id, ts, track_id, song = row
+        return {'id': entry_id, 'ts': ts, 'track_id': track_id, 'song': json.loads(song)}
+
+    async def page(self, user_id: int, before_id: Optional[int] = None,
+                   limit: int = 10) -> Tuple[List[Dict], Optional[int]]:
+        """Return (entries, next_cursor) for a user, newest first"""
+        if not self._conn:
+            return [], None
+        # Fetch one extra row to know whether another page exists
+        rows = await self._run(self._select_page, user_id, before_id, limit + 1)
+        entries = [self._to_entry(row) for row in rows[:limit]]
+        next_cursor = entries[-1]['id'] if len(rows) > limit else None
+        return entries, next_cursor
+
+    async def get(self, user_id: int, entry_id: int) -> Optional[Dict]:
+        """Return one of the user's entries by id"""
+        if not self._conn:
+            return None
+        row = await self._run(self._select_one, user_id, entry_id)
+        return self._to_entry(row) if row else None
@@ -0,0 +1,136 @@
+"""
+Lifecycle Manager for Shazam Telegram Bot
+Graceful shutdown: stop taking updates, drain in-flight work, flush state, exit
+
+On SIGTERM/SIGINT the bot stops polling, gives in-flight recognitions up to
+a deadline to finish, cancels whatever is left and flushes persistent state.
+Updates not yet fetched stay on Telegram's side and are picked up by the
+next process. Audio that was already fetched but not started is dropped
+with a "send it again" reply, and temp files orphaned by a crash are
+swept on startup.
+"""
+
+import asyncio
+import inspect
+import logging
+import os
+import signal
+import time
+from contextlib import asynccontextmanager
+from typing import Callable, List, Set
+
+logger = logging.getLogger(__name__)
+
+
+class ShuttingDown(Exception):
+    """Raised by track() once shutdown has started; the work must not begin"""
+
+
+class LifecycleManager:
+    """Tracks in-flight work and coordinates a graceful shutdown"""
+
+    def __init__(self, temp_dirs: List[str], stale_temp_age: int = 3600, drain_timeout: float = 25.0):
+        self.temp_dirs = temp_dirs
+        self.stale_temp_age = stale_temp_age
+        self.drain_timeout = drain_timeout
+        self.draining = False
+        self._tasks: Set[asyncio.Task] = set()
+        self._flush_callbacks: List[Callable] = []
+        self._shutdown_task = None
+
+    @asynccontextmanager
+    async def track(self):
+        """Register the current task as in-flight work for the duration of the block
+
+        Raises ShuttingDown instead of running the block once draining has
+        started. Registering and checking happen without yielding to the
+        event loop, so drain() always either sees this task or refuses it.
+        """
+        task = asyncio.current_task()
+        self._tasks.add(task)
+        try:
+            if self.draining:
+                raise ShuttingDown()
+            yield
+        finally:
+            self._tasks.discard(task)
+
+    @property
+    def in_flight(self) -> int:
+        """Number of tracked tasks still running"""
+        return len(self._tasks)
+
+    def on_flush(self, callback: Callable):
+        """Register a function (sync or async) to run when state is flushed"""
+        self._flush_callbacks.append(callback)
+
+    def sweep_stale_temp_files(self) -> int:
+        """Delete temp files left behind by a previous process"""
+        cutoff = time.time() - self.stale_temp_age
+        removed = 0
+        for directory in self.temp_dirs:
+            try:
+                entries = list(os.scandir(directory))
+            except FileNotFoundError:
+                continue
+            for entry in entries:
+                try:
+                    if entry.is_file() and entry.stat().st_mtime < cutoff:
+                        os.unlink(entry.path)
+                        removed += 1
+                except OSError:
+                    pass
+        if removed:
+            logger.info(f"Removed {removed} stale temp files")
+        return removed
+
+    async def drain(self, timeout: float) -> int:
+        """Wait for in-flight work up to timeout, then cancel the rest; returns the number cancelled"""
+        self.draining = True
+        pending = {task for task in self._tasks if not task.done()}
+        if pending:
+            logger.info(f"Draining {len(pending)} in-flight tasks (up to {timeout}s)")
+            _, pending = await asyncio.wait(pending, timeout=timeout)
+
+        for task in pending:
+            task.cancel()
+        if pending:
+            logger.warning(f"Cancelled {len(pending)} tasks still running after drain deadline")
+            await asyncio.wait(pending)
+        return len(pending)
+
+    async def flush(self):
+        """Run all registered flush callbacks"""
+        for callback in self._flush_callbacks:
+            try:
+                result = callback()
+                if inspect.isawaitable(result):
+                    await result
+            except Exception as e:
+                logger.error(f"Error flushing state: {e}")
+
+    def install_signal_handlers(self, application):
+        """Replace the default stop signals with a draining shutdown"""
+        loop = asyncio.get_running_loop()
+        for sig in (signal.SIGINT, signal.SIGTERM):
+            try:
+                loop.add_signal_handler(sig, self.request_shutdown, application)
+            except NotImplementedError:
+                # Windows: fall back to the default KeyboardInterrupt handling
+                pass
+
+    def request_shutdown(self, application):
+        """Start the graceful shutdown sequence once"""
+        if self._shutdown_task is None:
+            logger.info("Shutdown requested, no longer accepting updates")
+            self.draining = True
+            self._shutdown_task = asyncio.ensure_future(self._shutdown(application))
+
+    async def _shutdown(self, application):
+        """Stop polling, drain, then let run_polling stop the application"""
+        try:
+            if application.updater and application.updater.running:
+                await application.updater.stop()
+            await self.drain(self.drain_timeout)
+        finally:
+            application.stop_running()
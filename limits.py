@@ -0,0 +1,122 @@
+"""
+Request Limits for Shazam Telegram Bot
+Per-user rate limiting and a concurrency cap that can be changed at runtime
+
+RateLimiter enforces MAX_REQUESTS_PER_MINUTE and REQUEST_COOLDOWN per
+user. ResizableSemaphore caps concurrent recognitions; unlike
+asyncio.Semaphore its limit can be raised or lowered while tasks hold or
+wait for slots, so a config reload takes effect without dropping work.
+"""
+
+import asyncio
+import time
+from collections import deque
+from typing import Deque, Dict
+
+
+class ResizableSemaphore:
+    """FIFO semaphore whose limit can change while in use"""
+
+    def __init__(self, limit: int):
+        self.limit = limit
+        self._active = 0
+        self._waiters: Deque[asyncio.Future] = deque()
+
+    @property
+    def in_use(self) -> int:
+        """Slots currently held"""
+        return self._active
+
+    @property
+    def waiting(self) -> int:
+        """Tasks waiting for a slot"""
+        return len(self._waiters)
+
+    def _wake(self):
+        """Hand free slots to waiters in arrival order"""
+        while self._waiters and self._active < self.limit:
+            waiter = self._waiters.popleft()
+            if not waiter.done():
+                self._active += 1
+                waiter.set_result(None)
+
+    async def acquire(self):
+        """Wait for a free slot"""
+        if self._active < self.limit and not self._waiters:
+            self._active += 1
+            return
+
+        waiter = asyncio.get_running_loop().create_future()
+        self._waiters.append(waiter)
+        try:
+            await waiter
+        except asyncio.CancelledError:
+            if waiter.done() and not waiter.cancelled():
+                # The slot was handed over just as we were cancelled
+                self.release()
+            else:
+                try:
+                    self._waiters.remove(waiter)
+                except ValueError:
+                    pass
+            raise
+
+    def release(self):
+        """Give a slot back"""
+        self._active -= 1
+        self._wake()
+
+    def resize(self, limit: int):
+        """Change the limit; held slots above a lowered limit drain naturally"""
+        self.limit = limit
+        self._wake()
+
+    async def __aenter__(self):
+        await self.acquire()
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb):
+        self.release()
+
+
+class RateLimiter:
+    """Sliding one-minute request window plus a cooldown between requests, per user"""
+
+    def __init__(self, max_per_minute: int, cooldown: float, max_users: int = 10000):
+        self.max_per_minute = max_per_minute
+        self.cooldown = cooldown
+        self.max_users = max_users
+        self._requests: Dict[int, Deque[float]] = {}
+
+    def configure(self, max_per_minute: int, cooldown: float):
+        """Apply new limits; existing request history is kept"""
+        self.max_per_minute = max_per_minute
+        self.cooldown = cooldown
+
+    def _prune(self, now: float):
+        """Forget users with no requests in the last minute"""
+        for user_id in [uid for uid, times in self._requests.items() if not times or now - times[-1] >= 60]:
+            del self._requests[user_id]
+
+    def check(self, user_id: int) -> float:
+        """Record a request and return 0, or return the seconds to wait if it is over the limit"""
+        now = time.monotonic()
+        times = self._requests.get(user_id)
+        if times is None:
+            if len(self._requests) >= self.max_users:
+                self._prune(now)
+            times = self._requests[user_id] = deque()
+
+        while times and now - times[0] >= 60:
+            times.popleft()
+
+        wait = 0.0
+        if times and now - times[-1] < self.cooldown:
+            wait = self.cooldown - (now - times[-1])
+        if len(times) >= self.max_per_minute:
+            wait = max(wait, 60 - (now - times[0]))
+        if wait > 0:
+            return wait
+
+        times.append(now)
+        return 0.0
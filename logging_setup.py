@@ -0,0 +1,143 @@
+"""
+Logging Pipeline for Shazam Telegram Bot
+Non-blocking, structured logging with per-update request ids
+
+Handlers on the event loop only put records on a bounded in-memory queue
+(dropping, never blocking, if it is full). A QueueListener thread formats
+them as JSON lines and writes to stdout and a rotating log file, so a slow
+disk or terminal can't stall update processing. Warnings and errors
+repeated from the same call site are rate limited.
+"""
+
+import contextvars
+import copy
+import json
+import logging
+import queue
+import sys
+import time
+from collections import OrderedDict
+from datetime import datetime, timezone
+from logging.handlers import QueueHandler, QueueListener, RotatingFileHandler
+from typing import Optional
+
+# Id of the update being processed, attached to every record
+request_id_var: contextvars.ContextVar = contextvars.ContextVar('request_id', default='-')
+
+
+class RequestIdFilter(logging.Filter):
+    """Copy the current request id onto the record (runs in the caller's context)"""
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        record.request_id = request_id_var.get()
+        return True
+
+
+class SamplingFilter(logging.Filter):
+    """Let at most `burst` records per call site through every `window` seconds"""
+
+    def __init__(self, burst: int = 5, window: float = 60.0, min_level: int = logging.WARNING,
+                 max_sites: int = 1024):
+        super().__init__()
+        self.burst = burst
+        self.window = window
+        self.min_level = min_level
+        self.max_sites = max_sites
+        # call site -> [window start, records seen in window]
+        self._sites: "OrderedDict[tuple, list]" = OrderedDict()
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        if record.levelno < self.min_level:
+            return True
+
+        site = (record.name, record.levelno, record.pathname, record.lineno)
+        now = time.monotonic()
+        state = self._sites.get(site)
+
+        if state is None or now - state[0] >= self.window:
+            suppressed = state[1] - self.burst if state and state[1] > self.burst else 0
+            self._sites[site] = [now, 1]
+            self._sites.move_to_end(site)
+            while len(self._sites) > self.max_sites:
+                self._sites.popitem(last=False)
+            if suppressed:
+                record.msg = f"{record.getMessage()} (suppressed {suppressed} similar messages)"
+                record.args = None
+            return True
+
+        state[1] += 1
+        return state[1] <= self.burst
+
+
+class DroppingQueueHandler(QueueHandler):
+    """QueueHandler that drops records instead of blocking when the queue is full"""
+
+    def __init__(self, log_queue: queue.Queue):
+        super().__init__(log_queue)
+        self.dropped = 0
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        """Resolve the message and traceback now; keep the rest for the JSON formatter"""
+        record = copy.copy(record)
+        record.msg = record.getMessage()
+        record.args = None
+        if record.exc_info:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+    def enqueue(self, record: logging.LogRecord):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+
+class JsonFormatter(logging.Formatter):
+    """One JSON object per line"""
+
+    def format(self, record: logging.LogRecord) -> str:
+        entry = {
+            'ts': datetime.fromtimestamp(record.created, timezone.utc).isoformat(timespec='milliseconds'),
+            'level': record.levelname,
+            'logger': record.name,
+            'request_id': getattr(record, 'request_id', '-'),
+            'msg': record.getMessage(),
+        }
+        if record.exc_text:
+            entry['exc'] = record.exc_text
+        return json.dumps(entry, ensure_ascii=False)
+
+
+def setup_logging(level: str = 'INFO', log_file: Optional[str] = None, max_bytes: int = 10 * 1024 * 1024,
+                  backup_count: int = 5, queue_size: int = 10000) -> QueueListener:
+    """Route all logging through a background listener; returns it so it can be stopped on exit"""
+    formatter = JsonFormatter()
+
+    handlers = []
+    stream_handler = logging.StreamHandler(sys.stdout)
+    stream_handler.setFormatter(formatter)
+    handlers.append(stream_handler)
+
+    if log_file:
+        file_handler = RotatingFileHandler(log_file, maxBytes=max_bytes, backupCount=backup_count, encoding='utf-8')
+        file_handler.setFormatter(formatter)
+        handlers.append(file_handler)
+
+    log_queue: queue.Queue = queue.Queue(maxsize=queue_size)
+    queue_handler = DroppingQueueHandler(log_queue)
+    queue_handler.addFilter(RequestIdFilter())
+    queue_handler.addFilter(SamplingFilter())
+
+    root = logging.getLogger()
+    for handler in list(root.handlers):
+        root.removeHandler(handler)
+    root.addHandler(queue_handler)
+    root.setLevel(getattr(logging, str(level).upper(), logging.INFO))
+
+    # httpx logs every Telegram API request at INFO
+    logging.getLogger('httpx').setLevel(logging.WARNING)
+
+    listener = QueueListener(log_queue, *handlers, respect_handler_level=True)
+    listener.start()
+    return listener
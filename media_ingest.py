@@ -0,0 +1,439 @@
+"""
+Media Ingest for Shazam Telegram Bot
+Works out what a downloaded file is from its first bytes and turns it into something Shazam can decode
+
+Voice notes and video notes have no file name, so the container is
+detected from magic bytes instead. Most formats go to Shazam unchanged.
+Ogg Opus voice notes are decoded in-process with libopus (through
+opuslib) into 16 kHz mono WAV, the rate Shazam fingerprints at. MP4
+video notes have their AAC track copied sample by sample into an ADTS
+stream, leaving the video behind. Both read and write the file in small
+pieces, and neither starts an ffmpeg process. If opuslib is missing or a
+file can't be converted, the original is passed on as before.
+"""
+
+import logging
+import os
+import struct
+import threading
+from typing import Dict, Iterator, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+CONTAINER_MP3 = 'mp3'
+CONTAINER_AAC = 'aac'
+CONTAINER_WAV = 'wav'
+CONTAINER_FLAC = 'flac'
+CONTAINER_OGG_OPUS = 'ogg_opus'
+CONTAINER_OGG_VORBIS = 'ogg_vorbis'
+CONTAINER_MP4 = 'mp4'
+CONTAINER_ASF = 'asf'
+
+# Extension of each container, matched against SUPPORTED_AUDIO_FORMATS
+CONTAINER_EXTENSIONS = {
+    CONTAINER_MP3: '.mp3',
+    CONTAINER_AAC: '.aac',
+    CONTAINER_WAV: '.wav',
+    CONTAINER_FLAC: '.flac',
+    CONTAINER_OGG_OPUS: '.opus',
+    CONTAINER_OGG_VORBIS: '.ogg',
+    CONTAINER_MP4: '.m4a',
+    CONTAINER_ASF: '.wma',
+}
+
+# Bytes read to detect the container
+SNIFF_BYTES = 4096
+# Opus voice notes are decoded straight to Shazam's sample rate, mono
+DECODE_SAMPLE_RATE = 16000
+# Longest Opus frame is 120 ms
+MAX_OPUS_FRAME_MS = 120
+# The moov box holds sample tables only; anything larger isn't a video note
+MAX_MOOV_BYTES = 16 * 1024 * 1024
+
+ASF_GUID = bytes.fromhex('3026b2758e66cf11a6d900aa0062ce6c')
+
+# ADTS sampling frequency indexes
+AAC_SAMPLE_RATES = (96000, 88200, 64000, 48000, 44100, 32000, 24000, 22050, 16000, 12000, 11025, 8000, 7350)
+
+
+def is_mp3_frame(header: bytes) -> bool:
+    """Whether 4 bytes form a plausible MPEG audio frame header"""
+    if len(header) < 4 or header[0] != 0xFF or (header[1] & 0xE0) != 0xE0:
+        return False
+    version = (header[1] >> 3) & 0x03
+    layer = (header[1] >> 1) & 0x03
+    bitrate = header[2] >> 4
+    sample_rate = (header[2] >> 2) & 0x03
+    return version != 1 and layer != 0 and bitrate not in (0, 15) and sample_rate != 3
+
+
+def adts_frame_length(header: bytes) -> int:
+    """Length of an ADTS frame from its header, or 0 if it isn't one"""
+    if len(header) < 7 or header[0] != 0xFF or (header[1] & 0xF6) != 0xF0:
+        return 0
+    if ((header[2] >> 2) & 0x0F) >= 13:
+        return 0
+    length = ((header[3] & 0x03) << 11) | (header[4] << 3) | (header[5] >> 5)
+    return length if length >= 7 else 0
+
+
+def id3_size(header: bytes) -> int:
+    """Size of a leading ID3v2 tag, including header and footer"""
+    if header[:3] != b'ID3' or len(header) < 10:
+        return 0
+    size = (header[6] << 21) | (header[7] << 14) | (header[8] << 7) | header[9]
+    return size + (20 if header[5] & 0x10 else 10)
+
+
+def sniff(header: bytes) -> Optional[str]:
+    """Container of a file from its first bytes (after any ID3 tag), or None"""
+    if header[:4] == b'RIFF' and header[8:12] == b'WAVE':
+        return CONTAINER_WAV
+    if header[:4] == b'fLaC':
+        return CONTAINER_FLAC
+    if header[:4] == b'OggS':
+        # The first page carries the codec's identification header
+        first_packet = header[27 + header[26]:] if len(header) > 27 else b''
+        if first_packet.startswith(b'OpusHead'):
+            return CONTAINER_OGG_OPUS
+        if first_packet.startswith(b'\x01vorbis'):
+            return CONTAINER_OGG_VORBIS
+        return None
+    if header[4:8] == b'ftyp':
+        return CONTAINER_MP4
+    if header[:16] == ASF_GUID:
+        return CONTAINER_ASF
+    if adts_frame_length(header[:7]):
+        return CONTAINER_AAC
+    if is_mp3_frame(header[:4]):
+        return CONTAINER_MP3
+    return None
+
+
+def detect_container(file_path: str) -> Optional[str]:
+    """Container of a file, detected from its first chunk"""
+    with open(file_path, 'rb') as f:
+        header = f.read(SNIFF_BYTES)
+        tag_size = id3_size(header)
+        if tag_size:
+            # MP3 (or ADTS) behind an ID3 tag, which may hold cover art
+            f.seek(tag_size)
+            header = f.read(SNIFF_BYTES)
+    return sniff(header)
+
+
+def _wav_header(data_size: int, sample_rate: int, channels: int = 1) -> bytes:
+    """44-byte header of a 16-bit PCM WAV file"""
+    block_align = channels * 2
+    return (
+        b'RIFF' + struct.pack('<I', 36 + data_size) + b'WAVE'
+        + b'fmt ' + struct.pack('<IHHIIHH', 16, 1, channels, sample_rate, sample_rate * block_align, block_align, 16)
+        + b'data' + struct.pack('<I', data_size)
+    )
+
+
+def _ogg_packets(f) -> Iterator[bytes]:
+    """Packets of the first logical stream in an Ogg file, read page by page"""
+    serial = None
+    parts: List[bytes] = []
+    while True:
+        header = f.read(27)
+        if len(header) < 27:
+            return
+        if header[:4] != b'OggS':
+            raise ValueError("Lost Ogg page sync")
+        lacing = f.read(header[26])
+        data = f.read(sum(lacing))
+        if serial is None:
+            serial = header[14:18]
+        elif header[14:18] != serial:
+            continue
+
+        position = 0
+        for size in lacing:
+            parts.append(data[position:position + size])
+            position += size
+            # A lacing value below 255 ends the packet; 255 continues it
+            if size < 255:
+                yield b''.join(parts)
+                parts = []
+
+
+def decode_opus(source_path: str, target_path: str, sample_rate: int = DECODE_SAMPLE_RATE):
+    """Decode an Ogg Opus file to mono 16-bit WAV, one packet at a time"""
+    import opuslib
+
+    with open(source_path, 'rb') as src, open(target_path, 'wb') as dst:
+        packets = _ogg_packets(src)
+        head = next(packets, b'')
+        if not head.startswith(b'OpusHead') or len(head) < 19:
+            raise ValueError("Missing OpusHead")
+        if head[18] != 0:
+            raise ValueError(f"Unsupported Opus channel mapping family {head[18]}")
+        # Pre-skip is given at 48 kHz; that many decoded samples are encoder delay
+        skip_bytes = struct.unpack('<H', head[10:12])[0] * sample_rate // 48000 * 2
+        next(packets, None)  # OpusTags
+
+        # libopus resamples and downmixes itself when asked for mono at 16 kHz
+        decoder = opuslib.Decoder(sample_rate, 1)
+        max_frame = sample_rate * MAX_OPUS_FRAME_MS // 1000
+
+        dst.write(_wav_header(0, sample_rate))
+        data_size = 0
+        for packet in packets:
+            if not packet:
+                continue
+            pcm = decoder.decode(packet, max_frame)
+            if skip_bytes:
+                skipped = min(skip_bytes, len(pcm))
+                pcm = pcm[skipped:]
+                skip_bytes -= skipped
+            dst.write(pcm)
+            data_size += len(pcm)
+
+        dst.seek(0)
+        dst.write(_wav_header(data_size, sample_rate))
+
+
+def _iter_boxes(data: bytes, start: int = 0, end: Optional[int] = None) -> Iterator[Tuple[bytes, int, int]]:
+    """(type, payload start, payload end) of the MP4 boxes in data[start:end]"""
+    end = len(data) if end is None else end
+    position = start
+    while position + 8 <= end:
+        size, box_type = struct.unpack('>I4s', data[position:position + 8])
+        header_size = 8
+        if size == 1:
+            size = struct.unpack('>Q', data[position + 8:position + 16])[0]
+            header_size = 16
+        elif size == 0:
+            size = end - position
+        if size < header_size or position + size > end:
+            return
+        yield box_type, position + header_size, position + size
+        position += size
+
+
+def _find_box(data: bytes, path: List[bytes], start: int = 0, end: Optional[int] = None) -> Optional[Tuple[int, int]]:
+    """Payload bounds of the first box along a path of nested box types"""
+    for box_type, payload_start, payload_end in _iter_boxes(data, start, end):
+        if box_type == path[0]:
+            if len(path) == 1:
+                return payload_start, payload_end
+            found = _find_box(data, path[1:], payload_start, payload_end)
+            if found:
+                return found
+    return None
+
+
+def _read_moov(f) -> bytes:
+    """The moov box, wherever it is in the file, without reading mdat"""
+    f.seek(0, os.SEEK_END)
+    file_size = f.tell()
+    position = 0
+    while position + 8 <= file_size:
+        f.seek(position)
+        header = f.read(16)
+        size, box_type = struct.unpack('>I4s', header[:8])
+        if size == 1:
+            size = struct.unpack('>Q', header[8:16])[0]
+        elif size == 0:
+            size = file_size - position
+        if size < 8:
+            break
+        if box_type == b'moov':
+            if size > MAX_MOOV_BYTES:
+                raise ValueError("moov box too large")
+            f.seek(position)
+            return f.read(size)
+        position += size
+    raise ValueError("No moov box")
+
+
+def _descriptor(data: bytes, position: int) -> Tuple[int, int, int]:
+    """(tag, payload start, payload end) of an MPEG-4 descriptor"""
+    tag = data[position]
+    position += 1
+    length = 0
+    for _ in range(4):
+        byte = data[position]
+        position += 1
+        length = (length << 7) | (byte & 0x7F)
+        if not byte & 0x80:
+            break
+    return tag, position, position + length
+
+
+def _audio_specific_config(esds: bytes) -> bytes:
+    """DecoderSpecificInfo (the AudioSpecificConfig) from an esds payload"""
+    tag, start, end = _descriptor(esds, 4)
+    if tag != 0x03:
+        raise ValueError("Missing ES descriptor")
+    flags = esds[start + 2]
+    position = start + 3
+    if flags & 0x80:
+        position += 2
+    if flags & 0x40:
+        position += 1 + esds[position]
+    if flags & 0x20:
+        position += 2
+
+    tag, start, end = _descriptor(esds, position)
+    if tag != 0x04:
+        raise ValueError("Missing decoder config descriptor")
+    if esds[start] != 0x40:
+        raise ValueError(f"Audio track is not AAC (object type {esds[start]:#x})")
+    tag, start, end = _descriptor(esds, start + 13)
+    if tag != 0x05:
+        raise ValueError("Missing AudioSpecificConfig")
+    return esds[start:end]
+
+
+def _adts_params(config: bytes) -> Tuple[int, int, int]:
+    """(profile, sampling frequency index, channel configuration) for ADTS headers"""
+    bits = int.from_bytes(config[:4].ljust(4, b'\x00'), 'big')
+    object_type = bits >> 27
+    frequency_index = (bits >> 23) & 0x0F
+    channels = (bits >> 19) & 0x0F
+    if object_type in (5, 29):
+        # HE-AAC: ADTS carries the core AAC LC stream, decoders find the SBR data themselves
+        object_type = 2
+    if not 1 <= object_type <= 4:
+        raise ValueError(f"AAC object type {object_type} can't be carried in ADTS")
+    if frequency_index >= len(AAC_SAMPLE_RATES):
+        raise ValueError("Explicit AAC sample rate can't be carried in ADTS")
+    if not channels:
+        raise ValueError("AAC channel layout in a PCE isn't supported")
+    return object_type - 1, frequency_index, channels
+
+
+def _adts_header(profile: int, frequency_index: int, channels: int, payload_size: int) -> bytes:
+    """7-byte ADTS header without CRC"""
+    frame_length = payload_size + 7
+    if frame_length >= 1 << 13:
+        raise ValueError("AAC frame too large for ADTS")
+    return bytes((
+        0xFF,
+        0xF1,
+        (profile << 6) | (frequency_index << 2) | (channels >> 2),
+        ((channels & 0x03) << 6) | (frame_length >> 11),
+        (frame_length >> 3) & 0xFF,
+        ((frame_length & 0x07) << 5) | 0x1F,
+        0xFC,
+    ))
+
+
+def _sample_table(moov: bytes) -> Tuple[bytes, List[int], List[Tuple[int, int]], List[int]]:
+    """AudioSpecificConfig, sample sizes, (first chunk, samples per chunk) runs and chunk offsets of the sound track"""
+    for box_type, start, end in _iter_boxes(moov, 8):
+        if box_type != b'trak':
+            continue
+        hdlr = _find_box(moov, [b'mdia', b'hdlr'], start, end)
+        if not hdlr or moov[hdlr[0] + 8:hdlr[0] + 12] != b'soun':
+            continue
+        stbl = _find_box(moov, [b'mdia', b'minf', b'stbl'], start, end)
+        if not stbl:
+            continue
+        tables: Dict[bytes, bytes] = {
+            box: moov[box_start:box_end] for box, box_start, box_end in _iter_boxes(moov, *stbl)
+        }
+
+        # stsd: one mp4a sample entry; esds follows its 28 fixed bytes (more for QuickTime versions)
+        stsd = tables.get(b'stsd', b'')
+        entry = stsd[8:]
+        if entry[4:8] != b'mp4a':
+            raise ValueError("Audio track is not mp4a")
+        esds_at = entry.find(b'esds')
+        if esds_at < 4:
+            raise ValueError("Missing esds box")
+        esds_size = struct.unpack('>I', entry[esds_at - 4:esds_at])[0]
+        config = _audio_specific_config(entry[esds_at + 4:esds_at - 4 + esds_size])
+
+        stsz = tables.get(b'stsz')
+        if not stsz:
+            raise ValueError("Missing stsz box")
+        uniform_size, count = struct.unpack('>II', stsz[4:12])
+        sizes = [uniform_size] * count if uniform_size else list(struct.unpack(f'>{count}I', stsz[12:12 + 4 * count]))
+
+        stsc = tables.get(b'stsc', b'')
+        runs = [struct.unpack('>III', stsc[8 + 12 * i:20 + 12 * i])[:2]
+                for i in range(struct.unpack('>I', stsc[4:8])[0])]
+
+        if b'stco' in tables:
+            stco = tables[b'stco']
+            count = struct.unpack('>I', stco[4:8])[0]
+            offsets = list(struct.unpack(f'>{count}I', stco[8:8 + 4 * count]))
+        elif b'co64' in tables:
+            co64 = tables[b'co64']
+            count = struct.unpack('>I', co64[4:8])[0]
+            offsets = list(struct.unpack(f'>{count}Q', co64[8:8 + 8 * count]))
+        else:
+            raise ValueError("Missing chunk offsets")
+        return config, sizes, runs, offsets
+    raise ValueError("No AAC audio track")
+
+
+def extract_mp4_audio(source_path: str, target_path: str):
+    """Copy the AAC track of an MP4 file into an ADTS stream, one chunk at a time"""
+    with open(source_path, 'rb') as src:
+        config, sizes, runs, offsets = _sample_table(_read_moov(src))
+        profile, frequency_index, channels = _adts_params(config)
+
+        with open(target_path, 'wb') as dst:
+            sample = 0
+            for run_index, (first_chunk, samples_per_chunk) in enumerate(runs):
+                last_chunk = runs[run_index + 1][0] - 1 if run_index + 1 < len(runs) else len(offsets)
+                for chunk in range(first_chunk - 1, last_chunk):
+                    chunk_sizes = sizes[sample:sample + samples_per_chunk]
+                    sample += len(chunk_sizes)
+                    # A chunk's samples are contiguous, so it is read in one go
+                    src.seek(offsets[chunk])
+                    data = src.read(sum(chunk_sizes))
+                    position = 0
+                    for size in chunk_sizes:
+                        dst.write(_adts_header(profile, frequency_index, channels, size))
+                        dst.write(data[position:position + size])
+                        position += size
+    if not sample:
+        raise ValueError("Audio track has no samples")
+
+
+# Containers converted before recognition, and the extension of the result
+_CONVERTERS = {
+    CONTAINER_OGG_OPUS: (decode_opus, '.wav'),
+    CONTAINER_MP4: (extract_mp4_audio, '.aac'),
+}
+
+
+def converted_path(file_path: str, container: str) -> Optional[str]:
+    """Where prepare_audio writes the converted copy of file_path, or None if it isn't converted"""
+    if container not in _CONVERTERS:
+        return None
+    return os.path.splitext(file_path)[0] + '_ingest' + _CONVERTERS[container][1]
+
+
+def prepare_audio(file_path: str, container: str, abandoned: Optional[threading.Event] = None) -> str:
+    """Path of a file Shazam can decode: file_path itself, or its converted_path
+
+    The caller deletes the copy. If the caller gave up (abandoned is set)
+    the copy is deleted here instead, so a conversion that outlives its
+    request leaves nothing behind. Conversion failures are logged and the
+    original is returned, for Shazam to try as is.
+    """
+    target_path = converted_path(file_path, container)
+    if target_path is None or (abandoned and abandoned.is_set()):
+        return file_path
+
+    convert = _CONVERTERS[container][0]
+    try:
+        convert(file_path, target_path)
+        if not (abandoned and abandoned.is_set()):
+            return target_path
+    except ImportError:
+        logger.warning("opuslib is not installed, Opus files are passed to Shazam undecoded")
+    except Exception as e:
+        logger.warning(f"Could not convert {container} file {file_path}: {e}")
+    try:
+        os.unlink(target_path)
+    except OSError:
+        pass
+    return file_path
@@ -0,0 +1,264 @@
+"""
+Metadata Writer for Shazam Telegram Bot
+Writes edited song information and cover art back into MP3, M4A and FLAC files
+
+Tags are rewritten in place with mutagen: ID3, MP4 and FLAC tags are all
+saved into existing padding where possible, so only the tag region of the
+file is touched instead of copying the whole audio stream. mutagen is
+imported by each writer on first use, so it costs nothing at startup.
+"""
+
+import asyncio
+import hashlib
+import logging
+import os
+from collections import OrderedDict
+from typing import Dict, Optional
+
+from media_ingest import CONTAINER_FLAC, CONTAINER_MP3, CONTAINER_MP4, detect_container
+from single_flight import SingleFlight
+
+logger = logging.getLogger(__name__)
+
+# Formats we can write tags into
+FORMAT_MP3 = 'mp3'
+FORMAT_MP4 = 'mp4'
+FORMAT_FLAC = 'flac'
+
+FORMAT_EXTENSIONS = {
+    FORMAT_MP3: '.mp3',
+    FORMAT_MP4: '.m4a',
+    FORMAT_FLAC: '.flac',
+}
+
+# Detected containers we can write tags into
+_CONTAINER_FORMATS = {
+    CONTAINER_MP3: FORMAT_MP3,
+    CONTAINER_MP4: FORMAT_MP4,
+    CONTAINER_FLAC: FORMAT_FLAC,
+}
+
+# Song fields that can be written, in display order
+TAG_FIELDS = ('title', 'artist', 'album', 'genre', 'year')
+
+
+def detect_format(file_path: str) -> Optional[str]:
+    """Detect a writable audio format from the file's leading bytes"""
+    # ADTS AAC frame syncs look like MPEG audio too; media_ingest tells them apart
+    return _CONTAINER_FORMATS.get(detect_container(file_path))
+
+
+def _cover_mime(cover: bytes) -> str:
+    """Guess the MIME type of cover art bytes"""
+    if cover[:8] == b'\x89PNG\r\n\x1a\n':
+        return 'image/png'
+    return 'image/jpeg'
+
+
+def _write_mp3(file_path: str, tags: Dict[str, str], cover: Optional[bytes]):
+    """Write ID3 tags in place"""
+    from mutagen.id3 import ID3, ID3NoHeaderError, TIT2, TPE1, TALB, TCON, TDRC, APIC
+
+    try:
+        id3 = ID3(file_path)
+    except ID3NoHeaderError:
+        id3 = ID3()
+
+    frames = {
+        'title': TIT2,
+        'artist': TPE1,
+        'album': TALB,
+        'genre': TCON,
+        'year': TDRC,
+    }
+    for field, frame in frames.items():
+        if tags.get(field):
+            id3.setall(frame.__name__, [frame(encoding=3, text=[tags[field]])])
+
+    if cover:
+        id3.delall('APIC')
+        id3.add(APIC(encoding=3, mime=_cover_mime(cover), type=3, desc='Cover', data=cover))
+
+    # ID3.save grows or shrinks only the tag header, reusing its padding
+    id3.save(file_path)
+
+
+def _write_mp4(file_path: str, tags: Dict[str, str], cover: Optional[bytes]):
+    """Write MP4/M4A atoms in place"""
+    from mutagen.mp4 import MP4, MP4Cover
+
+    audio = MP4(file_path)
+    if audio.tags is None:
+        audio.add_tags()
+
+    atoms = {
+        'title': '\xa9nam',
+        'artist': '\xa9ART',
+        'album': '\xa9alb',
+        'genre': '\xa9gen',
+        'year': '\xa9day',
+    }
+    for field, atom in atoms.items():
+        if tags.get(field):
+            audio.tags[atom] = [tags[field]]
+
+    if cover:
+        image_format = MP4Cover.FORMAT_PNG if _cover_mime(cover) == 'image/png' else MP4Cover.FORMAT_JPEG
+        audio.tags['covr'] = [MP4Cover(cover, imageformat=image_format)]
+
+    # mutagen resizes the moov/udta atoms and fixes chunk offsets in place
+    audio.save()
+
+
+def _write_flac(file_path: str, tags: Dict[str, str], cover: Optional[bytes]):
+    """Write Vorbis comments and picture block in place"""
+    from mutagen.flac import FLAC, Picture
+
+    audio = FLAC(file_path)
+
+    comments = {
+        'title': 'title',
+        'artist': 'artist',
+        'album': 'album',
+        'genre': 'genre',
+        'year': 'date',
+    }
+    for field, key in comments.items():
+        if tags.get(field):
+            audio[key] = tags[field]
+
+    if cover:
+        picture = Picture()
+        picture.type = 3
+        picture.mime = _cover_mime(cover)
+        picture.desc = 'Cover'
+        picture.data = cover
+        audio.clear_pictures()
+        audio.add_picture(picture)
+
+    # Metadata blocks are rewritten into the existing PADDING block when they fit
+    audio.save()
+
+
+_WRITERS = {
+    FORMAT_MP3: _write_mp3,
+    FORMAT_MP4: _write_mp4,
+    FORMAT_FLAC: _write_flac,
+}
+
+
+def write_tags(file_path: str, tags: Dict[str, str], cover: Optional[bytes] = None) -> str:
+    """Write tags and cover art into the file in place and return its format"""
+    audio_format = detect_format(file_path)
+    if audio_format not in _WRITERS:
+        raise ValueError(f"Unsupported format for metadata writing: {file_path}")
+
+    _WRITERS[audio_format](file_path, tags, cover)
+    return audio_format
+
+
+def tags_fingerprint(tags: Dict[str, str], cover: Optional[bytes] = None) -> str:
+    """Stable short hash of a tag set, used as part of the cache key"""
+    digest = hashlib.sha1()
+    for field in TAG_FIELDS:
+        digest.update(field.encode())
+        digest.update(b'\0')
+        digest.update((tags.get(field) or '').encode('utf-8'))
+        digest.update(b'\0')
+    if cover:
+        digest.update(hashlib.sha1(cover).digest())
+    return digest.hexdigest()[:16]
+
+
+class TaggedFileCache:
+    """LRU cache of retagged files on disk, keyed by file_unique_id and tag fingerprint"""
+
+    def __init__(self, directory: str, max_entries: int = 64):
+        self.directory = directory
+        self.max_entries = max_entries
+        self._entries: "OrderedDict[str, str]" = OrderedDict()
+        os.makedirs(directory, exist_ok=True)
+
+    @staticmethod
+    def make_key(file_unique_id: str, fingerprint: str) -> str:
+        """Build a cache key"""
+        return f"{file_unique_id}_{fingerprint}"
+
+    def path_for(self, key: str, extension: str = '') -> str:
+        """Path where the tagged file for a key is stored"""
+        return os.path.join(self.directory, key + extension)
+
+    def get(self, key: str) -> Optional[str]:
+        """Return the cached file path or None"""
+        path = self._entries.get(key)
+        if path is None:
+            return None
+        if not os.path.exists(path):
+            del self._entries[key]
+            return None
+        self._entries.move_to_end(key)
+        return path
+
+    def put(self, key: str, path: str):
+        """Store a tagged file, evicting the least recently used ones"""
+        self._entries[key] = path
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            _, old_path = self._entries.popitem(last=False)
+            try:
+                os.unlink(old_path)
+            except OSError:
+                pass
+
+
+class MetadataWriter:
+    """Writes tags off the event loop and caches the results"""
+
+    def __init__(self, cache_dir: str, max_cached_files: int = 64):
+        self.cache = TaggedFileCache(cache_dir, max_cached_files)
+        self._flights = SingleFlight()
+
+    async def write_async(self, file_path: str, tags: Dict[str, str], cover: Optional[bytes] = None) -> str:
+        """Write tags in a worker thread so large files don't block the bot"""
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(None, write_tags, file_path, tags, cover)
+
+    def cache_key(self, file_unique_id: str, tags: Dict[str, str], cover: Optional[bytes] = None) -> str:
+        """Key identifying the tagged rendition of a file"""
+        return self.cache.make_key(file_unique_id, tags_fingerprint(tags, cover))
+
+    async def get_or_create(self, file_unique_id: str, tags: Dict[str, str], cover: Optional[bytes], download) -> str:
+        """
+        Return the path of a tagged copy of the file, creating it if needed
+
+        `download` is a coroutine function taking a destination path; it is
+        only called on a cache miss.
+        """
+        key = self.cache_key(file_unique_id, tags, cover)
+        # Concurrent requests for the same rendition share one download and write
+        return await self._flights.run(key, lambda: self._create(key, file_unique_id, tags, cover, download))
+
+    async def _create(self, key: str, file_unique_id: str, tags: Dict[str, str], cover: Optional[bytes],
+                      download) -> str:
+        cached = self.cache.get(key)
+        if cached:
+            return cached
+
+        # Each attempt works on its own file: an abandoned attempt's download or
+        # tagging thread can still be writing while the next attempt starts
+        path = self.cache.path_for(key, f'.{os.urandom(4).hex()}.part')
+        try:
+            await download(path)
+            audio_format = await self.write_async(path, tags, cover)
+            final_path = self.cache.path_for(key, FORMAT_EXTENSIONS[audio_format])
+            os.replace(path, final_path)
+        except BaseException:
+            try:
+                os.unlink(path)
+            except OSError:
+                pass
+            raise
+
+        self.cache.put(key, final_path)
+        logger.info(f"Wrote {audio_format} tags for {file_unique_id}")
+        return final_path
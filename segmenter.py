@@ -0,0 +1,273 @@
+"""
+Segmented Recognition for Shazam Telegram Bot
+Identifies every song in a long recording (DJ sets, mixes) by recognizing short windows across it
+
+The file is never decoded as a whole. Each window is cut straight from
+the file's bytes into a small temporary file: MP3 and ADTS AAC streams
+are cut at the next frame sync, WAV at a sample boundary with a fresh
+header. Byte offsets are interpolated from the duration, which is exact
+for constant bitrate and close enough for VBR at these window sizes. A
+few windows are recognized in parallel, results come back in order, and
+consecutive windows that match the same song are merged into one
+tracklist entry.
+"""
+
+import asyncio
+import logging
+import os
+import struct
+import tempfile
+from collections import deque
+from typing import AsyncIterator, Awaitable, Callable, Dict, List, NamedTuple, Optional, Tuple
+
+from media_ingest import adts_frame_length, id3_size, is_mp3_frame
+
+logger = logging.getLogger(__name__)
+
+FORMAT_MP3 = 'mp3'
+FORMAT_AAC = 'aac'
+FORMAT_WAV = 'wav'
+
+SEGMENT_EXTENSIONS = {
+    FORMAT_MP3: '.mp3',
+    FORMAT_AAC: '.aac',
+    FORMAT_WAV: '.wav',
+}
+
+# Bytes searched for a frame sync after a cut point
+SYNC_SEARCH_BYTES = 16 * 1024
+COPY_CHUNK_BYTES = 64 * 1024
+# Trailing windows shorter than this are too short to recognize
+MIN_SEGMENT_SECONDS = 3.0
+
+
+class AudioLayout(NamedTuple):
+    """Where the audio data lies in a file and how long it plays"""
+    format: str
+    data_start: int
+    data_end: int
+    duration: float
+    # WAV only: the original fmt chunk and the sample frame size
+    fmt_chunk: bytes = b''
+    block_align: int = 1
+
+
+class Segment(NamedTuple):
+    """One recognition window, in seconds from the start of the file"""
+    index: int
+    start: float
+    end: float
+
+
+def _find_sync(buffer: bytes, audio_format: str) -> int:
+    """Offset of the first frame header in buffer, or -1"""
+    position = buffer.find(b'\xff')
+    while 0 <= position < len(buffer) - 7:
+        if audio_format == FORMAT_AAC:
+            length = adts_frame_length(buffer[position:position + 7])
+            # Require the following frame too, ADTS syncs are easy to fake
+            if length and (position + length + 2 > len(buffer)
+                           or adts_frame_length(buffer[position + length:position + length + 7])):
+                return position
+        elif is_mp3_frame(buffer[position:position + 4]):
+            return position
+        position = buffer.find(b'\xff', position + 1)
+    return -1
+
+
+def _probe_wav(f, file_size: int) -> Optional[AudioLayout]:
+    """Find the fmt and data chunks of a RIFF/WAVE file"""
+    f.seek(12)
+    fmt_chunk = None
+    while True:
+        chunk_header = f.read(8)
+        if len(chunk_header) < 8:
+            return None
+        chunk_id, chunk_size = struct.unpack('<4sI', chunk_header)
+        if chunk_id == b'fmt ':
+            fmt_chunk = f.read(chunk_size)
+            if chunk_size % 2:
+                f.seek(1, os.SEEK_CUR)
+        elif chunk_id == b'data':
+            if not fmt_chunk or len(fmt_chunk) < 16:
+                return None
+            _, _, _, byte_rate, block_align = struct.unpack('<HHIIH', fmt_chunk[:14])
+            data_start = f.tell()
+            data_end = min(file_size, data_start + chunk_size)
+            if not byte_rate or not block_align:
+                return None
+            return AudioLayout(FORMAT_WAV, data_start, data_end, (data_end - data_start) / byte_rate,
+                               fmt_chunk, block_align)
+        else:
+            f.seek(chunk_size + (chunk_size % 2), os.SEEK_CUR)
+
+
+def probe_layout(file_path: str) -> Optional[AudioLayout]:
+    """Layout of a file that can be cut without decoding, or None for other formats"""
+    file_size = os.path.getsize(file_path)
+    with open(file_path, 'rb') as f:
+        header = f.read(10)
+        if header[:4] == b'RIFF':
+            f.seek(8)
+            if f.read(4) == b'WAVE':
+                return _probe_wav(f, file_size)
+            return None
+
+        data_start = id3_size(header)
+        f.seek(data_start)
+        buffer = f.read(SYNC_SEARCH_BYTES)
+
+    if adts_frame_length(buffer[:7]):
+        audio_format = FORMAT_AAC
+    elif is_mp3_frame(buffer[:4]):
+        audio_format = FORMAT_MP3
+    else:
+        return None
+
+    # mutagen reads only headers (and the Xing/VBRI table) to get the duration
+    try:
+        if audio_format == FORMAT_MP3:
+            from mutagen.mp3 import MP3
+            duration = MP3(file_path).info.length
+        else:
+            from mutagen.aac import AAC
+            duration = AAC(file_path).info.length
+    except Exception as e:
+        logger.warning(f"Could not read duration of {file_path}: {e}")
+        return None
+    if not duration:
+        return None
+    return AudioLayout(audio_format, data_start, file_size, duration)
+
+
+def plan_segments(duration: float, window: float, step: float) -> List[Segment]:
+    """Windows of `window` seconds every `step` seconds across the recording"""
+    segments = []
+    start = 0.0
+    while start < duration:
+        end = min(start + window, duration)
+        if end - start >= MIN_SEGMENT_SECONDS or not segments:
+            segments.append(Segment(len(segments), start, end))
+        start += step
+    return segments
+
+
+def _byte_offset(layout: AudioLayout, seconds: float) -> int:
+    """Approximate byte position of a time in the audio data"""
+    fraction = min(1.0, max(0.0, seconds / layout.duration))
+    return layout.data_start + int(fraction * (layout.data_end - layout.data_start))
+
+
+def write_segment(file_path: str, layout: AudioLayout, start: float, end: float, target_path: str):
+    """Copy the bytes for [start, end) into a standalone file, in small chunks"""
+    byte_start = _byte_offset(layout, start)
+    byte_end = _byte_offset(layout, end)
+
+    with open(file_path, 'rb') as src, open(target_path, 'wb') as dst:
+        if layout.format == FORMAT_WAV:
+            byte_start -= (byte_start - layout.data_start) % layout.block_align
+            byte_end -= (byte_end - layout.data_start) % layout.block_align
+            data_size = max(0, byte_end - byte_start)
+            dst.write(b'RIFF' + struct.pack('<I', 4 + 8 + len(layout.fmt_chunk) + 8 + data_size) + b'WAVE')
+            dst.write(b'fmt ' + struct.pack('<I', len(layout.fmt_chunk)) + layout.fmt_chunk)
+            dst.write(b'data' + struct.pack('<I', data_size))
+        else:
+            # Start on a frame boundary so the cut decodes cleanly
+            src.seek(byte_start)
+            sync = _find_sync(src.read(SYNC_SEARCH_BYTES), layout.format)
+            if sync > 0:
+                byte_start += sync
+
+        src.seek(byte_start)
+        remaining = byte_end - byte_start
+        while remaining > 0:
+            chunk = src.read(min(COPY_CHUNK_BYTES, remaining))
+            if not chunk:
+                break
+            dst.write(chunk)
+            remaining -= len(chunk)
+
+
+async def recognize_segments(file_path: str, layout: AudioLayout, segments: List[Segment],
+                             recognize: Callable[[str], Awaitable[Optional[Dict]]],
+                             workers: int, temp_dir: str) -> AsyncIterator[Tuple[Segment, Optional[Dict]]]:
+    """Recognize segments with up to `workers` in flight and yield (segment, result) in order
+
+    At most `workers` segment files exist at a time. Closing or cancelling
+    the iteration cancels the recognitions still running.
+    """
+    loop = asyncio.get_running_loop()
+    extension = SEGMENT_EXTENSIONS[layout.format]
+
+    async def run(segment: Segment) -> Optional[Dict]:
+        fd, segment_path = tempfile.mkstemp(suffix=extension, prefix='segment_', dir=temp_dir)
+        os.close(fd)
+        try:
+            await loop.run_in_executor(None, write_segment, file_path, layout,
+                                       segment.start, segment.end, segment_path)
+            return await recognize(segment_path)
+        finally:
+            try:
+                os.unlink(segment_path)
+            except OSError:
+                pass
+
+    upcoming = iter(segments)
+    in_flight: deque = deque()
+
+    def schedule():
+        segment = next(upcoming, None)
+        if segment is not None:
+            in_flight.append((segment, asyncio.create_task(run(segment))))
+
+    for _ in range(workers):
+        schedule()
+    try:
+        while in_flight:
+            segment, task = in_flight.popleft()
+            try:
+                result = await task
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.warning(f"Segment {segment.index} at {segment.start:.0f}s failed: {e}")
+                result = None
+            schedule()
+            yield segment, result
+    finally:
+        for _, task in in_flight:
+            task.cancel()
+        await asyncio.gather(*(task for _, task in in_flight), return_exceptions=True)
+
+
+def format_timestamp(seconds: float) -> str:
+    """H:MM:SS or M:SS"""
+    seconds = int(seconds)
+    hours, rest = divmod(seconds, 3600)
+    minutes, secs = divmod(rest, 60)
+    return f"{hours}:{minutes:02d}:{secs:02d}" if hours else f"{minutes}:{secs:02d}"
+
+
+class Tracklist:
+    """Timestamped songs, with consecutive matches of the same song merged"""
+
+    def __init__(self):
+        self.entries: List[Dict] = []
+
+    def add(self, start: float, track: Optional[Dict]) -> bool:
+        """Add a window's match; returns True if it started a new entry"""
+        if not track:
+            # A miss between two windows of the same song doesn't split it
+            return False
+        key = track.get('key') or (track.get('title'), track.get('subtitle'))
+        if self.entries and self.entries[-1]['key'] == key:
+            return False
+        self.entries.append({'key': key, 'start': start, 'track': track})
+        return True
+
+    def lines(self) -> List[str]:
+        """One "timestamp artist - title" line per entry"""
+        return [
+            f"{format_timestamp(entry['start'])} {entry['track'].get('subtitle', '?')} - {entry['track'].get('title', '?')}"
+            for entry in self.entries
+        ]
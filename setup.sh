@@ -85,12 +85,15 @@ create_requirements_file() {
     print_info "Creating requirements.txt file..."
     
     cat > requirements.txt << 'EOF'
-python-telegram-bot>=20.0
+python-telegram-bot>=20.5
 shazamio>=0.8.0
 mutagen>=1.46.0
 aiohttp>=3.8.0
 asyncio>=3.4.3
 python-dotenv>=0.19.0
+msgpack>=1.0.0
+opuslib>=3.0.1
+Pillow>=9.0.0
 EOF
     
     print_success "requirements.txt created successfully"
@@ -119,6 +122,8 @@ WorkingDirectory=$current_dir
 ExecStart=/usr/bin/python3 $current_dir/shazam_bot.py
 Restart=always
 RestartSec=10
+KillSignal=SIGTERM
+TimeoutStopSec=60
 Environment=PYTHONPATH=$current_dir
 
 [Install]
@@ -499,22 +504,22 @@ main() {
         fi
         
         # Set boolean values
-        ENABLE_DOWNLOAD="true"
-        AUTO_DETECT_LANGUAGE="true"
+        ENABLE_DOWNLOAD="True"
+        AUTO_DETECT_LANGUAGE="True"
         MAX_REQUESTS_PER_MINUTE="10"
         REQUEST_COOLDOWN="5"
         MAX_CONCURRENT_RECOGNITIONS="5"
-        LOG_LEVEL="'INFO'"
-        LOG_FILE="'shazam_bot.log'"
-        DEBUG_MODE="false"
-        ENABLE_INLINE_MODE="true"
-        ENABLE_SONG_EDITING="true"
-        ENABLE_METADATA_WRITING="false"
-        ENABLE_SPOTIFY_INTEGRATION="true"
-        ENABLE_USER_BLACKLIST="false"
-        ENABLE_GROUP_WHITELIST="false"
-        ENABLE_ADMIN_NOTIFICATIONS="true"
-        DEVELOPMENT_MODE="false"
+        LOG_LEVEL="INFO"
+        LOG_FILE="shazam_bot.log"
+        DEBUG_MODE="False"
+        ENABLE_INLINE_MODE="True"
+        ENABLE_SONG_EDITING="True"
+        ENABLE_METADATA_WRITING="False"
+        ENABLE_SPOTIFY_INTEGRATION="True"
+        ENABLE_USER_BLACKLIST="False"
+        ENABLE_GROUP_WHITELIST="False"
+        ENABLE_ADMIN_NOTIFICATIONS="True"
+        DEVELOPMENT_MODE="False"
         
     else
         echo ""
@@ -529,24 +534,24 @@ main() {
         TEMP_DOWNLOAD_PATH="/tmp/shazam_bot"
         DEFAULT_LANGUAGE="fa"
         MAX_FILE_SIZE=$((20 * 1024 * 1024))
-        ENABLE_DOWNLOAD="true"
+        ENABLE_DOWNLOAD="True"
         RECOGNITION_TIMEOUT="30"
         MAX_RECOGNITION_ATTEMPTS="3"
-        AUTO_DETECT_LANGUAGE="true"
+        AUTO_DETECT_LANGUAGE="True"
         MAX_REQUESTS_PER_MINUTE="10"
         REQUEST_COOLDOWN="5"
         MAX_CONCURRENT_RECOGNITIONS="5"
-        LOG_LEVEL="'INFO'"
-        LOG_FILE="'shazam_bot.log'"
-        DEBUG_MODE="false"
-        ENABLE_INLINE_MODE="true"
-        ENABLE_SONG_EDITING="true"
-        ENABLE_METADATA_WRITING="false"
-        ENABLE_SPOTIFY_INTEGRATION="true"
-        ENABLE_USER_BLACKLIST="false"
-        ENABLE_GROUP_WHITELIST="false"
-        ENABLE_ADMIN_NOTIFICATIONS="true"
-        DEVELOPMENT_MODE="false"
+        LOG_LEVEL="INFO"
+        LOG_FILE="shazam_bot.log"
+        DEBUG_MODE="False"
+        ENABLE_INLINE_MODE="True"
+        ENABLE_SONG_EDITING="True"
+        ENABLE_METADATA_WRITING="False"
+        ENABLE_SPOTIFY_INTEGRATION="True"
+        ENABLE_USER_BLACKLIST="False"
+        ENABLE_GROUP_WHITELIST="False"
+        ENABLE_ADMIN_NOTIFICATIONS="True"
+        DEVELOPMENT_MODE="False"
     fi
     
     # Create temporary directory
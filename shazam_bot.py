@@ -5,25 +5,27 @@ A Telegram bot for music recognition using ShazamIO library
 Features: Music identification, language selection, inline search, song editing
 """
 
+import time
+
+# Measured from here so the startup log line includes import time
+STARTED_AT = time.perf_counter()
+
 import asyncio
+import importlib
 import logging
 import os
 import tempfile
+import threading
 from typing import Dict, Optional, List
-from datetime import datetime
 
 from telegram import (
     Update,
     InlineKeyboardButton,
     InlineKeyboardMarkup,
-    InlineQueryResultAudio,
     InlineQueryResultArticle,
     InputTextMessageContent,
     BotCommand,
     Message,
-    Audio,
-    Voice,
-    Document,
 )
 from telegram.ext import (
     Application,
@@ -31,48 +33,31 @@ from telegram.ext import (
     MessageHandler,
     CallbackQueryHandler,
     InlineQueryHandler,
+    TypeHandler,
     ContextTypes,
     filters,
-    ConversationHandler,
-    CommandHandler,
-    MessageHandler,
-    CallbackQueryHandler,
 )
 from telegram.constants import ParseMode
 
-from shazamio import Shazam, Serialize
-import mutagen
-from mutagen.id3 import ID3, TIT2, TPE1, TALB, TCON
-from mutagen.mp3 import MP3
-from mutagen.mp4 import MP4
-from mutagen.flac import FLAC
-
-# Configuration - EDIT THESE VALUES
-# =================================
-# Telegram Bot Token - Get from @BotFather
-TELEGRAM_BOT_TOKEN = "YOUR_TELEGRAM_BOT_TOKEN_HERE"  # <-- EDIT THIS: Your Telegram bot token
-
-# Bot Settings
-BOT_USERNAME = "ShazamMusicBot"  # <-- EDIT THIS: Your bot username without @
-BOT_NAME = "Shazam Music Bot"   # <-- EDIT THIS: Your bot display name
-
-# Admin Settings (Optional)
-ADMIN_USER_IDS = []  # <-- EDIT THIS: List of admin user IDs for bot management (e.g., [123456789, 987654321])
-
-# Message Settings
-MAX_FILE_SIZE = 20 * 1024 * 1024  # 20MB max file size
-SUPPORTED_AUDIO_FORMATS = ['.mp3', '.m4a', '.ogg', '.flac', '.wav', '.opus']
-
-# Language Settings
-DEFAULT_LANGUAGE = 'fa'  # <-- EDIT THIS: Default language ('fa' for Persian, 'en' for English)
+# shazamio and mutagen are imported on first use (or by warm_up) to keep startup fast
 
-# Download Settings
-TEMP_DOWNLOAD_PATH = "/tmp/shazam_bot"  # <-- EDIT THIS: Temporary file storage path
-ENABLE_DOWNLOAD = True  # <-- EDIT THIS: Enable/disable file downloads
+from metadata_writer import MetadataWriter, TAG_FIELDS
+from cover_art import CoverArtService
+from file_id_registry import FileIdRegistry
+from lifecycle import LifecycleManager, ShuttingDown
+from callback_router import CallbackRouter, pack
+from history_store import HistoryStore
+from analytics import Analytics, format_rate, start_dashboard
+from logging_setup import setup_logging, request_id_var
+from config import BotSettings, ConfigError, ConfigWatcher, load_settings
+from limits import RateLimiter, ResizableSemaphore
+from deadlines import Deadline, DeadlineExceeded, LatencyTracker, STATUS_EDIT_TIMEOUT
+from update_processor import LaneUpdateProcessor, LANE_INTERACTIVE, LANE_TEXT, LANE_RECOGNITION
+from segmenter import AudioLayout, Tracklist, plan_segments, probe_layout, recognize_segments
+from tiered_cache import MISS, create_cache
+from media_ingest import CONTAINER_EXTENSIONS, converted_path, detect_container, prepare_audio
 
-# Recognition Settings
-RECOGNITION_TIMEOUT = 30  # <-- EDIT THIS: Timeout for song recognition in seconds
-MAX_RECOGNITION_ATTEMPTS = 3  # <-- EDIT THIS: Maximum recognition attempts
+# Settings are read from bot_config.py and the environment (see config.py)
 
 # Message Templates
 WELCOME_MESSAGE = {
@@ -125,6 +110,7 @@ BUTTONS = {
         'cancel': "❌ لغو",
         'save': "💾 ذخیره",
         'search_again': "🔍 جستجوی مجدد",
+        'stop': "⏹ توقف",
     },
     'en': {
         'persian': "🇮🇷 Persian",
@@ -134,6 +120,7 @@ BUTTONS = {
         'cancel': "❌ Cancel",
         'save': "💾 Save",
         'search_again': "🔍 Search Again",
+        'stop': "⏹ Stop",
     }
 }
 
@@ -144,9 +131,16 @@ RECOGNITION_MESSAGES = {
         'success': "✅ آهنگ با موفقیت شناسایی شد!",
         'failed': "❌ متأسفانه نتوانستم آهنگ را شناسایی کنم.",
         'no_file': "❌ لطفاً یک فایل صوتی معتبر ارسال کنید.",
-        'file_too_large': f"❌ حجم فایل بیش از حد مجاز است (حداکثر {MAX_FILE_SIZE//1024//1024}MB).",
+        'file_too_large': "❌ حجم فایل بیش از حد مجاز است (حداکثر {max_mb}MB).",
         'unsupported_format': "❌ فرمت فایل پشتیبانی نمی‌شود.",
         'timeout': "❌ زمان شناسایی به پایان رسید. لطفاً دوباره تلاش کنید.",
+        'restarting': "🔄 ربات در حال راه‌اندازی مجدد است. لطفاً چند لحظه دیگر فایل را دوباره ارسال کنید.",
+        'send_audio': "🎵 یک فایل صوتی دیگر برای شناسایی ارسال کنید.",
+        'tracklist_progress': "🎧 در حال شناسایی آهنگ‌های این میکس ({percent}%)...",
+        'tracklist_done': "🎧 فهرست آهنگ‌ها:",
+        'tracklist_stopped': "⏹ متوقف شد. آهنگ‌های شناسایی‌شده تا این لحظه:",
+        'tracklist_empty': "❌ هیچ آهنگی در این فایل شناسایی نشد.",
+        'rate_limited': "⏳ درخواست‌های شما زیاد است. لطفاً {seconds} ثانیه دیگر دوباره تلاش کنید.",
     },
     'en': {
         'processing': "⏳ Processing audio file...",
@@ -154,9 +148,16 @@ RECOGNITION_MESSAGES = {
         'success': "✅ Song successfully identified!",
         'failed': "❌ Sorry, I couldn't identify the song.",
         'no_file': "❌ Please send a valid audio file.",
-        'file_too_large': f"❌ File size exceeds limit (max {MAX_FILE_SIZE//1024//1024}MB).",
+        'file_too_large': "❌ File size exceeds limit (max {max_mb}MB).",
         'unsupported_format': "❌ File format not supported.",
         'timeout': "❌ Recognition timeout. Please try again.",
+        'restarting': "🔄 The bot is restarting. Please send the file again in a moment.",
+        'send_audio': "🎵 Send me another audio file to identify.",
+        'tracklist_progress': "🎧 Identifying the songs in this mix ({percent}%)...",
+        'tracklist_done': "🎧 Tracklist:",
+        'tracklist_stopped': "⏹ Stopped. Songs identified so far:",
+        'tracklist_empty': "❌ No songs were identified in this recording.",
+        'rate_limited': "⏳ Too many requests. Please try again in {seconds} seconds.",
     }
 }
 
@@ -169,6 +170,11 @@ EDIT_MESSAGES = {
         'year': "سال انتشار را وارد کنید:",
         'success': "✅ اطلاعات آهنگ با موفقیت ویرایش شد!",
         'cancel': "❌ ویرایش لغو شد.",
+        'session_expired': "❌ جلسه منقضی شده است. لطفاً فایل صوتی را دوباره ارسال کنید.",
+        'menu': "✏️ **ویرایش اطلاعات آهنگ**\n\nکدام اطلاعات را می‌خواهید ویرایش کنید؟",
+        'saving': "⏳ در حال ذخیره اطلاعات در فایل...",
+        'save_failed': "❌ ذخیره اطلاعات در فایل ممکن نشد.",
+        'save_unavailable': "❌ فایل اصلی برای ذخیره اطلاعات در دسترس نیست.",
     },
     'en': {
         'title': "Enter song title:",
@@ -178,31 +184,218 @@ EDIT_MESSAGES = {
         'year': "Enter release year:",
         'success': "✅ Song information successfully edited!",
         'cancel': "❌ Editing cancelled.",
+        'session_expired': "❌ Session expired. Please send the audio file again.",
+        'menu': "✏️ **Edit Song Information**\n\nWhich information would you like to edit?",
+        'saving': "⏳ Saving information to the file...",
+        'save_failed': "❌ Couldn't save the information to the file.",
+        'save_unavailable': "❌ The original file is not available for saving.",
+    }
+}
+
+HISTORY_MESSAGES = {
+    'fa': {
+        'title': "📜 **آهنگ‌هایی که شناسایی کرده‌اید:**",
+        'empty': "📜 هنوز هیچ آهنگی شناسایی نکرده‌اید.",
+        'older': "⬅️ قدیمی‌تر",
+        'newest': "🔝 جدیدترین",
+        'not_found': "❌ این مورد در تاریخچه پیدا نشد.",
+    },
+    'en': {
+        'title': "📜 **Songs you have identified:**",
+        'empty': "📜 You haven't identified any songs yet.",
+        'older': "⬅️ Older",
+        'newest': "🔝 Newest",
+        'not_found': "❌ This entry was not found in your history.",
     }
 }
 
 # Conversation states for editing
 EDIT_TITLE, EDIT_ARTIST, EDIT_ALBUM, EDIT_GENRE, EDIT_YEAR = range(5)
 
+# Edit state machine: no state (idle / menu shown) -> one of the EDIT_* states
+# when a field button is pressed -> back to no state once the text arrives,
+# or on back/cancel
+EDIT_FIELD_STATES = {
+    'title': EDIT_TITLE,
+    'artist': EDIT_ARTIST,
+    'album': EDIT_ALBUM,
+    'genre': EDIT_GENRE,
+    'year': EDIT_YEAR,
+}
+EDIT_STATE_FIELDS = {state: field for field, state in EDIT_FIELD_STATES.items()}
+
+# Callback actions, packed into callback_data by callback_router.pack
+CB_LANGUAGE = 'lang'
+CB_EDIT = 'edit'
+CB_EDIT_FIELD = 'field'
+CB_EDIT_BACK = 'back'
+CB_EDIT_CANCEL = 'cancel'
+CB_EDIT_AGAIN = 'again'
+CB_EDIT_SAVE = 'save'
+CB_SEARCH_AGAIN = 'search'
+CB_HISTORY_PAGE = 'hpage'
+CB_HISTORY_ENTRY = 'hist'
+CB_TRACKLIST_STOP = 'stop'
+
+# Actions that download, retag or re-send a file; they run in the recognition lane
+BULK_CALLBACKS = {CB_EDIT_SAVE, CB_HISTORY_ENTRY}
+
+# Minimum seconds between tracklist progress edits (Telegram rate limits edits)
+TRACKLIST_UPDATE_INTERVAL = 3.0
+# Telegram's message length limit, minus room for the header
+TRACKLIST_MAX_CHARS = 3900
+
+# Placeholder values shown when a field is missing; never written into files
+DEFAULT_SONG_VALUES = {
+    'title': 'Unknown',
+    'artist': 'Unknown Artist',
+    'album': 'Unknown Album',
+    'year': 'Unknown Year',
+    'genre': 'Unknown Genre',
+}
+
+
+class RecognitionFailed(Exception):
+    """Recognition errored, as opposed to finding no match"""
+
+
 class ShazamBot:
-    def __init__(self):
-        self.shazam = Shazam()
+    def __init__(self, settings: BotSettings):
+        self.config = settings
+        
+        # Setup logging: handlers only enqueue, a background thread writes
+        self.log_listener = setup_logging(
+            level=settings.effective_log_level,
+            log_file=self.config.log_file,
+            max_bytes=self.config.log_max_bytes,
+            backup_count=self.config.log_backup_count
+        )
+        self.logger = logging.getLogger(__name__)
+        
+        self._shazam = None
         self.user_languages: Dict[int, str] = {}
         self.user_sessions: Dict[int, Dict] = {}
         
+        # All inline keyboard callbacks go through one router
+        self.callback_router = CallbackRouter()
+        self.setup_callback_routes()
+        
         # Create temp directory if it doesn't exist
-        os.makedirs(TEMP_DOWNLOAD_PATH, exist_ok=True)
+        os.makedirs(self.config.temp_download_path, exist_ok=True)
         
-        # Setup logging
-        logging.basicConfig(
-            format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
-            level=logging.INFO
+        # Retagged files are cached by file_unique_id next to the downloads
+        self.metadata_writer = MetadataWriter(os.path.join(self.config.temp_download_path, 'tagged'))
+        self.cover_art = CoverArtService(
+            os.path.join(self.config.temp_download_path, 'covers'),
+            max_bytes=self.config.cover_art_cache_bytes
         )
-        self.logger = logging.getLogger(__name__)
+        self.file_ids = FileIdRegistry(self.config.file_id_registry_file)
+        
+        # Every identified song is kept so users can look it up again for free
+        self.history = HistoryStore(self.config.history_db_file)
+        
+        # Usage aggregates for /stats and the admin dashboard
+        self.analytics = Analytics()
+        self.dashboard_runner = None
+        
+        # Graceful shutdown: drain in-flight work and flush state before exiting
+        self.lifecycle = LifecycleManager(
+            [self.config.temp_download_path, self.metadata_writer.cache.directory],
+            stale_temp_age=self.config.stale_temp_file_age,
+            drain_timeout=self.config.shutdown_drain_timeout
+        )
+        self.lifecycle.on_flush(self.file_ids.save)
+        self.lifecycle.on_flush(self.cover_art.save_index)
+        self.lifecycle.on_flush(self.cover_art.close)
+        self.lifecycle.on_flush(self.history.close)
+        
+        # Per-user request limits and a cap on concurrent recognitions
+        self.rate_limiter = RateLimiter(settings.max_requests_per_minute, settings.request_cooldown)
+        self.recognition_slots = ResizableSemaphore(settings.max_concurrent_recognitions)
+        
+        # Observed stage latencies; per-request stage timeouts adapt to them
+        self.latency = LatencyTracker()
+        
+        # Running tracklist recognitions by (chat_id, message_id), so the Stop button can cancel them
+        self.tracklist_jobs: Dict[tuple, tuple] = {}
+        
+        # Updates run concurrently in priority lanes: buttons and inline first, audio last
+        self.update_processor = LaneUpdateProcessor(self.lane_limits(settings), self.callback_lane)
+        
+        # Edits to bot_config.py or .env are applied while running
+        self.config_watcher = ConfigWatcher(settings)
+        self.config_watcher.subscribe(self.apply_config)
+        self.lifecycle.on_flush(self.config_watcher.stop)
+        
+        # Recognitions, searches and languages, shared with other bot processes through L2
+        self.cache = create_cache(
+            self.config.cache_backend,
+            self.config.cache_sqlite_file,
+            self.config.cache_redis_url,
+            self.config.cache_l1_entries
+        )
+        self.lifecycle.on_flush(self.cache.close)
+
+    @property
+    def shazam(self):
+        """Shazam client, created on first use"""
+        if self._shazam is None:
+            from shazamio import Shazam
+            self._shazam = Shazam()
+        return self._shazam
+
+    async def warm_up(self):
+        """Import heavy modules and build the Shazam client in the background"""
+        started = time.perf_counter()
+        modules = ['shazamio']
+        if self.config.enable_metadata_writing:
+            modules += ['mutagen.id3', 'mutagen.mp4', 'mutagen.flac']
+        
+        loop = asyncio.get_running_loop()
+        try:
+            for module in modules:
+                # Imports run in a thread so updates keep flowing meanwhile
+                await loop.run_in_executor(None, importlib.import_module, module)
+            self.shazam
+        except Exception as e:
+            self.logger.warning(f"Warm-up failed, modules will load on first use: {e}")
+            return
+        self.logger.info(f"Warm-up finished in {time.perf_counter() - started:.2f}s")
+
+    @staticmethod
+    def lane_limits(settings: BotSettings) -> Dict[str, int]:
+        """Per-lane concurrency limits from settings"""
+        return {
+            LANE_INTERACTIVE: settings.lane_limit_interactive,
+            LANE_TEXT: settings.lane_limit_text,
+            LANE_RECOGNITION: settings.lane_limit_recognition,
+        }
+
+    def callback_lane(self, data: Optional[str]) -> Optional[str]:
+        """Recognition lane for buttons that download or re-send files"""
+        parsed = self.callback_router.parse(data)
+        if parsed and parsed[0] in BULK_CALLBACKS:
+            return LANE_RECOGNITION
+        return None
+
+    def apply_config(self, old: BotSettings, new: BotSettings):
+        """Apply reloaded settings to the running components"""
+        self.config = new
+        self.rate_limiter.configure(new.max_requests_per_minute, new.request_cooldown)
+        self.recognition_slots.resize(new.max_concurrent_recognitions)
+        self.update_processor.resize(self.lane_limits(new))
+        self.cover_art.resize(new.cover_art_cache_bytes)
+        self.lifecycle.drain_timeout = new.shutdown_drain_timeout
+        self.lifecycle.stale_temp_age = new.stale_temp_file_age
+        logging.getLogger().setLevel(new.effective_log_level)
 
     def get_user_language(self, user_id: int) -> str:
         """Get user's preferred language"""
-        return self.user_languages.get(user_id, DEFAULT_LANGUAGE)
+        # load_user_language puts the shared value in L1 before handlers run
+        lang = self.cache.peek(f"lang:{user_id}")
+        if isinstance(lang, str):
+            return lang
+        return self.user_languages.get(user_id, self.config.default_language)
 
     def get_message(self, user_id: int, message_dict: Dict) -> str:
         """Get localized message for user"""
@@ -221,14 +414,14 @@ class ShazamBot:
         # Create language selection keyboard
         keyboard = [
             [
-                InlineKeyboardButton("🇮🇷 فارسی", callback_data="lang_fa"),
-                InlineKeyboardButton("🇺🇸 English", callback_data="lang_en")
+                InlineKeyboardButton("🇮🇷 فارسی", callback_data=pack(CB_LANGUAGE, 'fa')),
+                InlineKeyboardButton("🇺🇸 English", callback_data=pack(CB_LANGUAGE, 'en'))
             ]
         ]
         reply_markup = InlineKeyboardMarkup(keyboard)
         
         welcome_text = WELCOME_MESSAGE.get(self.get_user_language(user_id), WELCOME_MESSAGE['en'])
-        welcome_text = welcome_text.format(BOT_USERNAME)
+        welcome_text = welcome_text.format(self.config.bot_username)
         
         await update.message.reply_text(
             welcome_text,
@@ -245,7 +438,7 @@ class ShazamBot:
             'fa': """**راهنمای استفاده از ربات:**
 
 🎵 **شناسایی آهنگ:**
-- یک فایل صوتی ارسال کنید
+- یک فایل صوتی، پیام صوتی یا پیام ویدیویی دایره‌ای ارسال کنید
 - ربات به صورت خودکار آهنگ را شناسایی می‌کند
 
 🌐 **جستجوی در گروه‌ها:**
@@ -256,6 +449,9 @@ class ShazamBot:
 - پس از شناسایی آهنگ، دکمه "ویرایش اطلاعات" را بزنید
 - اطلاعات آهنگ را ویرایش کنید
 
+📜 **تاریخچه:**
+- دستور `/history` آهنگ‌هایی که قبلاً شناسایی شده‌اند را نشان می‌دهد
+
 🌍 **تغییر زبان:**
 - دستور `/start` را ارسال کنید
 - زبان مورد نظر را انتخاب کنید""",
@@ -263,7 +459,7 @@ class ShazamBot:
             'en': """**Bot Usage Guide:**
 
 🎵 **Song Recognition:**
-- Send an audio file
+- Send an audio file, voice message or video note
 - Bot will automatically identify the song
 
 🌐 **Search in Groups:**
@@ -274,29 +470,34 @@ class ShazamBot:
 - After song identification, click "Edit Song Info"
 - Edit the song information
 
+📜 **History:**
+- Send `/history` to see the songs you identified before
+
 🌍 **Change Language:**
 - Send `/start` command
 - Select your preferred language"""
         }
         
         help_text = help_text.get(lang, help_text['en'])
-        help_text = help_text.format(BOT_USERNAME)
+        help_text = help_text.format(self.config.bot_username)
         
         await update.message.reply_text(
             help_text,
             parse_mode=ParseMode.MARKDOWN
         )
 
-    async def language_callback(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
+    async def language_callback(self, update: Update, context: ContextTypes.DEFAULT_TYPE, lang_code: str):
         """Handle language selection callback"""
         query = update.callback_query
         await query.answer()
         
         user_id = query.from_user.id
-        lang_code = query.data.split('_')[1]
+        if lang_code not in WELCOME_MESSAGE:
+            return
         
-        # Save user language preference
+        # Save user language preference, for this and every other bot process
         self.user_languages[user_id] = lang_code
+        await self.cache.set(f"lang:{user_id}", lang_code)
         
         # Send confirmation message
         confirm_text = {
@@ -314,7 +515,7 @@ class ShazamBot:
         lang = self.get_user_language(user_id)
         
         # Check if message has audio
-        audio = update.message.audio or update.message.voice or update.message.document
+        audio = update.message.audio or update.message.voice or update.message.video_note or update.message.document
         
         if not audio:
             msg_text = self.get_message(user_id, RECOGNITION_MESSAGES)['no_file']
@@ -322,16 +523,34 @@ class ShazamBot:
             return
         
         # Check file size
-        if audio.file_size > MAX_FILE_SIZE:
-            msg_text = self.get_message(user_id, RECOGNITION_MESSAGES)['file_too_large']
+        if (audio.file_size or 0) > self.config.max_file_size:
+            msg_text = self.get_message(user_id, RECOGNITION_MESSAGES)['file_too_large'].format(
+                max_mb=self.config.max_file_size // 1024 // 1024
+            )
             await update.message.reply_text(msg_text)
             return
         
-        # Check file format
-        file_name = getattr(audio, 'file_name', '') or audio.file_path or ''
-        if not any(file_name.lower().endswith(ext) for ext in SUPPORTED_AUDIO_FORMATS):
-            msg_text = self.get_message(user_id, RECOGNITION_MESSAGES)['unsupported_format']
-            await update.message.reply_text(msg_text)
+        # Registering the task and checking for shutdown happen together in
+        # track(), so drain() either waits for this request or it is refused
+        try:
+            async with self.lifecycle.track():
+                await self.process_audio_file(update, context, audio, user_id, lang)
+        except ShuttingDown:
+            # Polling has stopped, but updates fetched before that still arrive here.
+            # Telegram already counts them as delivered, so the file is dropped and
+            # the user is asked to send it again once the bot is back
+            await update.message.reply_text(
+                self.get_message(user_id, RECOGNITION_MESSAGES)['restarting']
+            )
+
+    async def process_audio_file(self, update: Update, context: ContextTypes.DEFAULT_TYPE, audio,
+                                 user_id: int, lang: str):
+        """Rate limit, download, convert and recognize one audio file (tracked as in-flight work)"""
+        wait = self.rate_limiter.check(user_id)
+        if wait:
+            await update.message.reply_text(
+                self.get_message(user_id, RECOGNITION_MESSAGES)['rate_limited'].format(seconds=int(wait) + 1)
+            )
             return
         
         # Send processing message
@@ -339,139 +558,373 @@ class ShazamBot:
             self.get_message(user_id, RECOGNITION_MESSAGES)['processing']
         )
         
+        temp_file_path = None
+        audio_path = None
+        ingest_path = None
+        # Set once the request is over, so a conversion still running cleans up after itself
+        ingest_abandoned = threading.Event()
+        # One budget for the whole request, shared by every stage below
+        deadline = Deadline(self.config.request_timeout, self.latency)
         try:
-            # Download file
-            file = await context.bot.get_file(audio.file_id)
+            # Files recognized before, by any bot process, skip the download and Shazam
+            cache_key = f"recognition:{audio.file_unique_id}"
+            track_data = await self.cache.get(cache_key)
             
-            # Create temporary file
-            with tempfile.NamedTemporaryFile(
-                delete=False, 
-                suffix=os.path.splitext(file_name)[1] or '.mp3',
-                dir=TEMP_DOWNLOAD_PATH
-            ) as temp_file:
-                await file.download_to_drive(temp_file.name)
-                temp_file_path = temp_file.name
+            if track_data is MISS:
+                # Download file; download time is tracked per megabyte
+                file = await deadline.run('get_file', context.bot.get_file(audio.file_id))
+                size_mb = max(1.0, (audio.file_size or 0) / (1024 * 1024))
+                
+                # Create temporary file
+                with tempfile.NamedTemporaryFile(
+                    delete=False, 
+                    suffix='.download',
+                    dir=self.config.temp_download_path
+                ) as temp_file:
+                    temp_file_path = temp_file.name
+                    await deadline.run('download', file.download_to_drive(temp_file_path), scale=size_mb)
+                
+                # Check file format from its first bytes; voice and video notes have no usable name
+                loop = asyncio.get_running_loop()
+                container = await loop.run_in_executor(None, detect_container, temp_file_path)
+                if CONTAINER_EXTENSIONS.get(container) not in self.config.supported_audio_formats:
+                    await self.edit_status(
+                        processing_msg,
+                        self.get_message(user_id, RECOGNITION_MESSAGES)['unsupported_format']
+                    )
+                    return
+                renamed_path = os.path.splitext(temp_file_path)[0] + CONTAINER_EXTENSIONS[container]
+                os.replace(temp_file_path, renamed_path)
+                temp_file_path = renamed_path
+                
+                # Opus is decoded and video notes drop their video, in-process
+                ingest_path = converted_path(temp_file_path, container)
+                audio_path = await deadline.run(
+                    'ingest',
+                    loop.run_in_executor(None, prepare_audio, temp_file_path, container, ingest_abandoned),
+                    scale=size_mb
+                )
+                
+                # Long recordings (DJ sets, mixes) get a tracklist instead of a single song
+                duration = getattr(audio, 'duration', None)
+                if self.config.enable_segmented_mode and (duration is None or duration >= self.config.segmented_min_duration):
+                    layout = await loop.run_in_executor(None, probe_layout, audio_path)
+                    if layout and layout.duration >= self.config.segmented_min_duration:
+                        await self.recognize_tracklist(processing_msg, user_id, lang, audio_path, layout)
+                        return
+                
+                # Update message to recognizing
+                await self.edit_status(
+                    processing_msg,
+                    self.get_message(user_id, RECOGNITION_MESSAGES)['recognizing'],
+                    deadline
+                )
+                
+                # Recognize song; concurrent requests for the same file share one call
+                track_data = await self.cache.get_or_load(
+                    cache_key,
+                    lambda: self.recognize_track(audio_path, deadline),
+                    ttl=self.config.recognition_cache_ttl,
+                    negative_ttl=self.config.negative_cache_ttl
+                )
             
-            # Update message to recognizing
-            await processing_msg.edit_text(
-                self.get_message(user_id, RECOGNITION_MESSAGES)['recognizing']
+            track_data = track_data or {}
+            self.analytics.record_recognition(
+                bool(track_data),
+                lang,
+                track_data.get('key'),
+                f"{track_data.get('title', DEFAULT_SONG_VALUES['title'])} - {track_data.get('subtitle', DEFAULT_SONG_VALUES['artist'])}"
             )
             
-            # Recognize song
-            result = await self.recognize_song_with_timeout(temp_file_path)
-            
-            # Clean up temp file
-            os.unlink(temp_file_path)
-            
-            if result:
-                await self.send_song_result(update, result, user_id)
+            if track_data:
+                await self.send_song_result(update, {'track': track_data}, user_id)
             else:
-                await processing_msg.edit_text(
+                await self.edit_status(
+                    processing_msg,
                     self.get_message(user_id, RECOGNITION_MESSAGES)['failed']
                 )
                 
+        except DeadlineExceeded as e:
+            # The stage was cancelled when its time ran out
+            self.logger.warning(f"{e} ({self.config.request_timeout}s budget)")
+            self.analytics.record_recognition(False, lang)
+            await self.edit_status(
+                processing_msg,
+                self.get_message(user_id, RECOGNITION_MESSAGES)['timeout']
+            )
+        except asyncio.CancelledError:
+            # Shutdown drain deadline passed before recognition finished
+            await self.edit_status(
+                processing_msg,
+                self.get_message(user_id, RECOGNITION_MESSAGES)['restarting']
+            )
+            raise
+        except RecognitionFailed:
+            # Already logged; not cached, so the next attempt tries Shazam again
+            self.analytics.record_recognition(False, lang)
+            await self.edit_status(
+                processing_msg,
+                self.get_message(user_id, RECOGNITION_MESSAGES)['failed']
+            )
         except Exception as e:
             self.logger.error(f"Error processing audio file: {e}")
-            await processing_msg.edit_text(
+            await self.edit_status(
+                processing_msg,
                 self.get_message(user_id, RECOGNITION_MESSAGES)['failed']
             )
+        finally:
+            # Clean up temp files
+            ingest_abandoned.set()
+            for path in {temp_file_path, audio_path, ingest_path}:
+                if path and os.path.exists(path):
+                    os.unlink(path)
 
-    async def recognize_song_with_timeout(self, file_path: str) -> Optional[Dict]:
-        """Recognize song with timeout"""
+    async def edit_status(self, message: Message, text: str, deadline: Optional[Deadline] = None,
+                          reply_markup: Optional[InlineKeyboardMarkup] = None):
+        """Edit a progress message; a failed status update never fails the request"""
         try:
-            # Use asyncio.wait_for to add timeout
-            result = await asyncio.wait_for(
-                self.shazam.recognize(file_path),
-                timeout=RECOGNITION_TIMEOUT
-            )
-            return result
-        except asyncio.TimeoutError:
-            return None
+            if deadline:
+                await deadline.run('status_edit', message.edit_text(text, reply_markup=reply_markup))
+            else:
+                await asyncio.wait_for(message.edit_text(text, reply_markup=reply_markup), STATUS_EDIT_TIMEOUT)
+        except DeadlineExceeded:
+            # The next stage sees the spent budget and ends the request
+            pass
+        except Exception as e:
+            self.logger.warning(f"Could not update status message: {e}")
+
+    async def recognize_song_with_timeout(self, file_path: str, deadline: Optional[Deadline] = None) -> Optional[Dict]:
+        """Recognize song within RECOGNITION_TIMEOUT and the request's deadline
+
+        Raises DeadlineExceeded if time runs out; other errors return None.
+        """
+        deadline = deadline or Deadline(self.config.recognition_timeout, self.latency)
+        try:
+            # At most MAX_CONCURRENT_RECOGNITIONS run at once; the rest wait their turn
+            await deadline.run('queue', self.recognition_slots.acquire(), adaptive=False)
+            try:
+                return await deadline.run(
+                    'recognize',
+                    self.shazam.recognize(file_path),
+                    cap=self.config.recognition_timeout
+                )
+            finally:
+                self.recognition_slots.release()
+        except DeadlineExceeded:
+            raise
         except Exception as e:
             self.logger.error(f"Recognition error: {e}")
             return None
 
-    async def send_song_result(self, update: Update, result: Dict, user_id: int):
-        """Send song recognition result"""
+    async def recognize_track(self, file_path: str, deadline: Optional[Deadline] = None) -> Optional[Dict]:
+        """Matched track, or None if Shazam found nothing
+
+        Raises RecognitionFailed on errors so they are not cached as "no match".
+        """
+        result = await self.recognize_song_with_timeout(file_path, deadline)
+        if result is None:
+            raise RecognitionFailed(file_path)
+        return result.get('track') or None
+
+    async def recognize_segment(self, file_path: str) -> Optional[Dict]:
+        """Recognize one tracklist window; running out of time just means no match"""
         try:
-            # Serialize the result
-            track_data = result.get('track', {})
-            if not track_data:
-                await update.message.reply_text(
-                    self.get_message(user_id, RECOGNITION_MESSAGES)['failed']
-                )
-                return
-            
-            # Extract song information
-            title = track_data.get('title', 'Unknown')
-            artist = track_data.get('subtitle', 'Unknown Artist')
-            album = track_data.get('sections', [{}])[0].get('metadata', [{}])[0].get('text', 'Unknown Album')
-            year = track_data.get('sections', [{}])[0].get('metadata', [{}])[1].get('text', 'Unknown Year')
-            genre = track_data.get('genres', {}).get('primary', 'Unknown Genre')
-            
-            # Get Spotify URL if available
-            spotify_url = None
-            for hub in track_data.get('hub', {}).get('actions', []):
-                if hub.get('type') == 'spotify' and hub.get('uri'):
-                    spotify_url = hub.get('uri')
-                    break
-            
-            # Create result message
-            result_text = {
-                'fa': f"""🎵 **آهنگ شناسایی شد!**
+            return await self.recognize_song_with_timeout(file_path)
+        except DeadlineExceeded:
+            return None
+
+    @staticmethod
+    def render_tracklist(header: str, lines: List[str]) -> str:
+        """Tracklist message text, dropping the oldest lines if it gets too long"""
+        body = '\n'.join(lines)
+        if len(body) > TRACKLIST_MAX_CHARS:
+            body = '…\n' + body[-TRACKLIST_MAX_CHARS:].split('\n', 1)[-1]
+        return f"{header}\n\n{body}" if body else header
+
+    async def recognize_tracklist(self, processing_msg: Message, user_id: int, lang: str,
+                                  file_path: str, layout: AudioLayout):
+        """Identify every song in a long recording, streaming the tracklist into the status message"""
+        messages = self.get_message(user_id, RECOGNITION_MESSAGES)
+        stop_markup = InlineKeyboardMarkup([[
+            InlineKeyboardButton(self.get_buttons(user_id)['stop'], callback_data=pack(CB_TRACKLIST_STOP))
+        ]])
+        segments = plan_segments(layout.duration, self.config.segment_window, self.config.segment_step)
+        tracklist = Tracklist()
+        loop = asyncio.get_running_loop()
+        
+        await self.edit_status(processing_msg, messages['tracklist_progress'].format(percent=0), reply_markup=stop_markup)
+        
+        async def run() -> bool:
+            """Returns False if stopped before the end"""
+            results = recognize_segments(
+                file_path, layout, segments, self.recognize_segment,
+                self.config.segment_workers, self.config.temp_download_path
+            )
+            last_edit = loop.time()
+            try:
+                async for segment, result in results:
+                    if tracklist.add(segment.start, (result or {}).get('track')):
+                        try:
+                            song = self.extract_song_data(tracklist.entries[-1]['track'])
+                            self.history.record(user_id, song.get('track_id'), song)
+                        except Exception as e:
+                            # A malformed track still stays in the tracklist
+                            self.logger.warning(f"Could not record tracklist entry in history: {e}")
+                    
+                    if loop.time() - last_edit >= TRACKLIST_UPDATE_INTERVAL:
+                        last_edit = loop.time()
+                        percent = 100 * (segment.index + 1) // len(segments)
+                        await self.edit_status(
+                            processing_msg,
+                            self.render_tracklist(messages['tracklist_progress'].format(percent=percent), tracklist.lines()),
+                            reply_markup=stop_markup
+                        )
+                return True
+            except asyncio.CancelledError:
+                # Stop button or shutdown: keep what was found so far
+                return False
+            finally:
+                # Cancels the segment recognitions still running
+                await results.aclose()
+        
+        job = asyncio.create_task(run())
+        job_key = (processing_msg.chat_id, processing_msg.message_id)
+        self.tracklist_jobs[job_key] = (user_id, job)
+        try:
+            finished = await job
+        finally:
+            self.tracklist_jobs.pop(job_key, None)
+        
+        self.analytics.record_recognition(bool(tracklist.entries), lang)
+        if finished and not tracklist.entries:
+            await self.edit_status(processing_msg, messages['tracklist_empty'])
+            return
+        header = messages['tracklist_done'] if finished else messages['tracklist_stopped']
+        await self.edit_status(processing_msg, self.render_tracklist(header, tracklist.lines()))
+
+    async def tracklist_stop_callback(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
+        """Stop a running tracklist recognition; only the user who started it can"""
+        query = update.callback_query
+        await query.answer()
+        
+        job = self.tracklist_jobs.get((query.message.chat_id, query.message.message_id))
+        if job and job[0] == query.from_user.id:
+            job[1].cancel()
+
+    def extract_song_data(self, track_data: Dict) -> Dict:
+        """Pull the displayed song information out of a Shazam track"""
+        # Get Spotify URL if available
+        spotify_url = None
+        for hub in (track_data.get('hub') or {}).get('actions') or []:
+            if hub.get('type') == 'spotify' and hub.get('uri'):
+                spotify_url = hub.get('uri')
+                break
+        
+        # Album and year are the first two metadata rows of the first section,
+        # when Shazam sends them at all
+        sections = track_data.get('sections') or [{}]
+        metadata = sections[0].get('metadata') or []
+        album = metadata[0].get('text') if len(metadata) > 0 else None
+        year = metadata[1].get('text') if len(metadata) > 1 else None
+        
+        return {
+            'track_id': track_data.get('key'),
+            'title': track_data.get('title', DEFAULT_SONG_VALUES['title']),
+            'artist': track_data.get('subtitle', DEFAULT_SONG_VALUES['artist']),
+            'album': album or DEFAULT_SONG_VALUES['album'],
+            'year': year or DEFAULT_SONG_VALUES['year'],
+            'genre': (track_data.get('genres') or {}).get('primary', DEFAULT_SONG_VALUES['genre']),
+            'cover_url': (track_data.get('images') or {}).get('coverart'),
+            'spotify_url': spotify_url,
+        }
+
+    def get_song_result_text(self, user_id: int, song_data: Dict) -> str:
+        """Localized result card for an identified song"""
+        title = song_data.get('title', DEFAULT_SONG_VALUES['title'])
+        artist = song_data.get('artist', DEFAULT_SONG_VALUES['artist'])
+        album = song_data.get('album', DEFAULT_SONG_VALUES['album'])
+        year = song_data.get('year', DEFAULT_SONG_VALUES['year'])
+        genre = song_data.get('genre', DEFAULT_SONG_VALUES['genre'])
+        
+        result_text = {
+            'fa': f"""🎵 **آهنگ شناسایی شد!**
 
 🎼 **عنوان:** {title}
 🎤 **هنرمند:** {artist}
 💿 **آلبوم:** {album}
 📅 **سال:** {year}
 🎭 **ژانر:** {genre}""",
-                
-                'en': f"""🎵 **Song Identified!**
+            
+            'en': f"""🎵 **Song Identified!**
 
 🎼 **Title:** {title}
 🎤 **Artist:** {artist}
 💿 **Album:** {album}
 📅 **Year:** {year}
 🎭 **Genre:** {genre}"""
-            }
-            
-            lang = self.get_user_language(user_id)
-            message = result_text.get(lang, result_text['en'])
-            
-            # Create keyboard with edit button
-            buttons = self.get_buttons(user_id)
-            keyboard = [
-                [
-                    InlineKeyboardButton(buttons['edit_info'], callback_data=f"edit_{update.message.message_id}")
-                ]
+        }
+        
+        lang = self.get_user_language(user_id)
+        return result_text.get(lang, result_text['en'])
+
+    async def reply_song_result(self, message: Message, user_id: int, song_data: Dict, session_id: str):
+        """Reply with a song result card and make it the user's editable session
+
+        session_id identifies this card: the id of the audio message for a
+        recognition, or "h<entry id>" for a card opened from /history.
+        """
+        # Create keyboard with edit button
+        buttons = self.get_buttons(user_id)
+        keyboard = [
+            [
+                InlineKeyboardButton(buttons['edit_info'], callback_data=pack(CB_EDIT, session_id))
             ]
+        ]
+        
+        if song_data.get('spotify_url'):
+            keyboard.append([
+                InlineKeyboardButton("🎵 Spotify", url=song_data['spotify_url'])
+            ])
+        
+        reply_markup = InlineKeyboardMarkup(keyboard)
+        
+        # Store song data for editing
+        self.user_sessions[user_id] = {
+            'session_id': session_id,
+            'song_data': song_data
+        }
+        
+        await self.reply_with_cover(
+            message,
+            song_data.get('cover_url'),
+            self.get_song_result_text(user_id, song_data),
+            reply_markup
+        )
+
+    async def send_song_result(self, update: Update, result: Dict, user_id: int):
+        """Send song recognition result"""
+        try:
+            # Serialize the result
+            track_data = result.get('track', {})
+            if not track_data:
+                await update.message.reply_text(
+                    self.get_message(user_id, RECOGNITION_MESSAGES)['failed']
+                )
+                return
             
-            if spotify_url:
-                keyboard.append([
-                    InlineKeyboardButton("🎵 Spotify", url=spotify_url)
-                ])
-            
-            reply_markup = InlineKeyboardMarkup(keyboard)
+            # Extract song information, plus the source file for metadata writing
+            song_data = self.extract_song_data(track_data)
+            source = update.message.audio or update.message.document
+            song_data.update({
+                'file_id': source.file_id if source else None,
+                'file_unique_id': source.file_unique_id if source else None,
+                'file_name': getattr(source, 'file_name', None) if source else None,
+            })
             
-            # Store song data for editing
-            self.user_sessions[user_id] = {
-                'message_id': update.message.message_id,
-                'song_data': {
-                    'title': title,
-                    'artist': artist,
-                    'album': album,
-                    'year': year,
-                    'genre': genre,
-                    'file_id': update.message.audio.file_id if update.message.audio else None,
-                    'file_path': update.message.audio.file_path if update.message.audio else None
-                }
-            }
+            # Queued and written in batches; never delays the reply
+            self.history.record(user_id, song_data.get('track_id'), dict(song_data))
             
-            await update.message.reply_text(
-                message,
-                reply_markup=reply_markup,
-                parse_mode=ParseMode.MARKDOWN
-            )
+            await self.reply_song_result(update.message, user_id, song_data, str(update.message.message_id))
             
         except Exception as e:
             self.logger.error(f"Error sending song result: {e}")
@@ -479,104 +932,299 @@ class ShazamBot:
                 self.get_message(user_id, RECOGNITION_MESSAGES)['failed']
             )
 
-    async def edit_callback(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
-        """Handle edit song info callback"""
+    async def stats_command(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
+        """Handle /stats command (admins only)"""
+        user_id = update.effective_user.id
+        if user_id not in self.config.admin_user_ids:
+            return
+        
+        stats = self.analytics.snapshot()
+        top_songs = '\n'.join(
+            f"{rank}. {label} ({count})"
+            for rank, (label, count) in enumerate(stats['top_tracks'], 1)
+        ) or '-'
+        languages = ', '.join(f"{lang}: {count}" for lang, count in sorted(stats['languages'].items())) or '-'
+        hourly = stats['hourly_volume']
+        lanes = ', '.join(
+            f"{lane} {values['active']}/{values['limit']} (+{values['waiting']})"
+            for lane, values in self.update_processor.stats().items()
+        )
+        latency = ', '.join(
+            f"{stage} {values['p50']:.1f}/{values['p95']:.1f}s"
+            for stage, values in sorted(self.latency.snapshot().items())
+        ) or '-'
+        
+        stats_text = f"""📊 Bot statistics
+
+Recognitions: {stats['total_attempts']} ({stats['total_successes']} identified)
+Success rate: {format_rate(stats['success_rate_1h'])} last hour, {format_rate(stats['success_rate_24h'])} last 24h
+Volume: {hourly[-1]} this hour, {sum(hourly)} last 24h
+Languages: {languages}
+Latency p50/p95: {latency}
+Lanes active/limit: {lanes}
+
+Top songs:
+{top_songs}"""
+        
+        await update.message.reply_text(stats_text)
+
+    async def get_history_page(self, user_id: int, before_id: Optional[int] = None):
+        """Text and keyboard for one page of the user's history"""
+        history_messages = self.get_message(user_id, HISTORY_MESSAGES)
+        entries, next_cursor = await self.history.page(user_id, before_id, self.config.history_page_size)
+        if not entries:
+            return history_messages['empty'], None
+        
+        keyboard = []
+        for entry in entries:
+            song = entry['song']
+            label = f"🎵 {song.get('title', DEFAULT_SONG_VALUES['title'])} - {song.get('artist', DEFAULT_SONG_VALUES['artist'])}"
+            keyboard.append([InlineKeyboardButton(label[:64], callback_data=pack(CB_HISTORY_ENTRY, entry['id']))])
+        
+        navigation = []
+        if before_id is not None:
+            navigation.append(InlineKeyboardButton(history_messages['newest'], callback_data=pack(CB_HISTORY_PAGE, 0)))
+        if next_cursor is not None:
+            navigation.append(InlineKeyboardButton(history_messages['older'], callback_data=pack(CB_HISTORY_PAGE, next_cursor)))
+        if navigation:
+            keyboard.append(navigation)
+        
+        return history_messages['title'], InlineKeyboardMarkup(keyboard)
+
+    async def history_command(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
+        """Handle /history command"""
+        user_id = update.effective_user.id
+        text, reply_markup = await self.get_history_page(user_id)
+        
+        await update.message.reply_text(
+            text,
+            reply_markup=reply_markup,
+            parse_mode=ParseMode.MARKDOWN
+        )
+
+    async def history_page_callback(self, update: Update, context: ContextTypes.DEFAULT_TYPE, cursor: str):
+        """Handle history paging buttons; cursor 0 means the newest page"""
         query = update.callback_query
         await query.answer()
         
+        if not cursor.isdigit():
+            return
+        
+        user_id = query.from_user.id
+        text, reply_markup = await self.get_history_page(user_id, int(cursor) or None)
+        await self.edit_query_message(query, text, reply_markup=reply_markup, parse_mode=ParseMode.MARKDOWN)
+
+    async def history_entry_callback(self, update: Update, context: ContextTypes.DEFAULT_TYPE, entry_id: str):
+        """Re-send a song from history without contacting Shazam"""
+        query = update.callback_query
         user_id = query.from_user.id
-        message_id = int(query.data.split('_')[1])
         
-        # Get song data from session
-        session = self.user_sessions.get(user_id, {})
-        if session.get('message_id') != message_id:
-            await query.edit_message_text("❌ Session expired. Please send the audio file again.")
+        entry = await self.history.get(user_id, int(entry_id)) if entry_id.isdigit() else None
+        if not entry:
+            await query.answer(self.get_message(user_id, HISTORY_MESSAGES)['not_found'], show_alert=True)
             return
         
-        # Create edit menu
-        lang = self.get_user_language(user_id)
-        buttons = self.get_buttons(user_id)
+        await query.answer()
+        # Keyed on the entry, not the /history list message every card is sent from
+        await self.reply_song_result(query.message, user_id, entry['song'], f"h{entry['id']}")
+
+    async def reply_with_cover(self, message: Message, cover_url: Optional[str], text: str,
+                               reply_markup: Optional[InlineKeyboardMarkup] = None) -> Message:
+        """Reply with the cover art captioned with text, or with plain text when there is no art"""
+        if self.config.enable_cover_art and cover_url:
+            try:
+                # Art that was uploaded before is sent by file_id without touching the disk
+                key = self.cover_art.content_key(cover_url, self.config.cover_thumbnail_size)
+                thumb_path = None
+                if not self.file_ids.get(key):
+                    thumb_path = await self.cover_art.get_thumbnail(cover_url, self.config.cover_thumbnail_size)
+                    key = self.cover_art.content_key(cover_url, self.config.cover_thumbnail_size)
+                
+                if self.file_ids.get(key) or thumb_path:
+                    async def send(photo):
+                        return await message.reply_photo(
+                            photo=photo,
+                            caption=text,
+                            reply_markup=reply_markup,
+                            parse_mode=ParseMode.MARKDOWN
+                        )
+                    
+                    async def open_upload():
+                        path = thumb_path or await self.cover_art.get_thumbnail(cover_url, self.config.cover_thumbnail_size)
+                        return open(path, 'rb')
+                    
+                    return await self.file_ids.send(key, send, open_upload)
+            except Exception as e:
+                self.logger.warning(f"Sending cover art failed, falling back to text: {e}")
         
+        return await message.reply_text(
+            text,
+            reply_markup=reply_markup,
+            parse_mode=ParseMode.MARKDOWN
+        )
+
+    async def edit_query_message(self, query, text: str, reply_markup: Optional[InlineKeyboardMarkup] = None,
+                                 parse_mode: Optional[str] = None):
+        """Edit the message behind a callback query, whether it is text or a captioned photo"""
+        if query.message and query.message.photo:
+            await query.edit_message_caption(caption=text, reply_markup=reply_markup, parse_mode=parse_mode)
+        else:
+            await query.edit_message_text(text=text, reply_markup=reply_markup, parse_mode=parse_mode)
+
+    def get_edit_state(self, context: ContextTypes.DEFAULT_TYPE) -> Optional[int]:
+        """Current EDIT_* state of the user's edit conversation, or None"""
+        return context.user_data.get('edit_state')
+
+    def set_edit_state(self, context: ContextTypes.DEFAULT_TYPE, state: Optional[int]):
+        """Move the user's edit conversation to a new state"""
+        if state is not None and state not in EDIT_STATE_FIELDS:
+            raise ValueError(f"Unknown edit state: {state}")
+        context.user_data['edit_state'] = state
+
+    def get_edit_menu_markup(self, user_id: int) -> InlineKeyboardMarkup:
+        """Keyboard listing the editable fields"""
+        buttons = self.get_buttons(user_id)
         keyboard = [
-            [InlineKeyboardButton("🎼 Title", callback_data="edit_field_title")],
-            [InlineKeyboardButton("🎤 Artist", callback_data="edit_field_artist")],
-            [InlineKeyboardButton("💿 Album", callback_data="edit_field_album")],
-            [InlineKeyboardButton("🎭 Genre", callback_data="edit_field_genre")],
-            [InlineKeyboardButton("📅 Year", callback_data="edit_field_year")],
-            [InlineKeyboardButton(buttons['back'], callback_data="edit_back")],
-            [InlineKeyboardButton(buttons['cancel'], callback_data="edit_cancel")]
+            [InlineKeyboardButton("🎼 Title", callback_data=pack(CB_EDIT_FIELD, 'title'))],
+            [InlineKeyboardButton("🎤 Artist", callback_data=pack(CB_EDIT_FIELD, 'artist'))],
+            [InlineKeyboardButton("💿 Album", callback_data=pack(CB_EDIT_FIELD, 'album'))],
+            [InlineKeyboardButton("🎭 Genre", callback_data=pack(CB_EDIT_FIELD, 'genre'))],
+            [InlineKeyboardButton("📅 Year", callback_data=pack(CB_EDIT_FIELD, 'year'))],
+            [InlineKeyboardButton(buttons['back'], callback_data=pack(CB_EDIT_BACK))],
+            [InlineKeyboardButton(buttons['cancel'], callback_data=pack(CB_EDIT_CANCEL))]
         ]
+        return InlineKeyboardMarkup(keyboard)
+
+    async def show_edit_menu(self, query, context: ContextTypes.DEFAULT_TYPE, user_id: int):
+        """Show the field selection menu on the callback's message"""
+        self.set_edit_state(context, None)
+        await self.edit_query_message(
+            query,
+            text=self.get_message(user_id, EDIT_MESSAGES)['menu'],
+            reply_markup=self.get_edit_menu_markup(user_id),
+            parse_mode=ParseMode.MARKDOWN
+        )
+
+    async def edit_callback(self, update: Update, context: ContextTypes.DEFAULT_TYPE, session_id: str):
+        """Handle edit song info callback"""
+        query = update.callback_query
+        await query.answer()
         
-        reply_markup = InlineKeyboardMarkup(keyboard)
+        user_id = query.from_user.id
         
-        edit_text = {
-            'fa': "✏️ **ویرایش اطلاعات آهنگ**\n\nکدام اطلاعات را می‌خواهید ویرایش کنید؟",
-            'en': "✏️ **Edit Song Information**\n\nWhich information would you like to edit?"
-        }
+        # Only the latest result card can be edited
+        session = self.user_sessions.get(user_id, {})
+        if session.get('session_id') != session_id:
+            await self.edit_query_message(query, self.get_message(user_id, EDIT_MESSAGES)['session_expired'])
+            return
         
-        await query.edit_message_text(
-            text=edit_text.get(lang, edit_text['en']),
-            reply_markup=reply_markup,
-            parse_mode=ParseMode.MARKDOWN
-        )
+        await self.show_edit_menu(query, context, user_id)
 
-    async def edit_field_callback(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
+    async def edit_again_callback(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
+        """Handle edit button under the updated song info"""
+        query = update.callback_query
+        await query.answer()
+        
+        user_id = query.from_user.id
+        if 'song_data' not in self.user_sessions.get(user_id, {}):
+            await self.edit_query_message(query, self.get_message(user_id, EDIT_MESSAGES)['session_expired'])
+            return
+        
+        await self.show_edit_menu(query, context, user_id)
+
+    async def edit_field_callback(self, update: Update, context: ContextTypes.DEFAULT_TYPE, field: str):
         """Handle edit field selection callback"""
         query = update.callback_query
         await query.answer()
         
         user_id = query.from_user.id
-        field = query.data.split('_')[2]
+        if field not in EDIT_FIELD_STATES:
+            return
+        if 'song_data' not in self.user_sessions.get(user_id, {}):
+            await self.edit_query_message(query, self.get_message(user_id, EDIT_MESSAGES)['session_expired'])
+            return
         
-        # Store the field being edited
-        if user_id not in self.user_sessions:
-            self.user_sessions[user_id] = {}
-        self.user_sessions[user_id]['editing_field'] = field
+        # Wait for the new value as the next text message
+        self.set_edit_state(context, EDIT_FIELD_STATES[field])
         
-        # Send prompt for the field
-        lang = self.get_user_language(user_id)
-        prompt_text = EDIT_MESSAGES.get(lang, EDIT_MESSAGES['en']).get(field, "Enter value:")
+        edit_messages = self.get_message(user_id, EDIT_MESSAGES)
+        buttons = self.get_buttons(user_id)
+        reply_markup = InlineKeyboardMarkup([
+            [InlineKeyboardButton(buttons['back'], callback_data=pack(CB_EDIT_AGAIN))],
+            [InlineKeyboardButton(buttons['cancel'], callback_data=pack(CB_EDIT_CANCEL))]
+        ])
         
-        await query.edit_message_text(text=prompt_text)
+        await self.edit_query_message(query, text=edit_messages[field], reply_markup=reply_markup)
+
+    async def edit_back_callback(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
+        """Handle back button in the edit menu: show the song info again"""
+        query = update.callback_query
+        await query.answer()
         
-        # Set conversation state
-        context.user_data['edit_state'] = field
+        user_id = query.from_user.id
+        self.set_edit_state(context, None)
+        
+        song_data = self.user_sessions.get(user_id, {}).get('song_data')
+        if not song_data:
+            await self.edit_query_message(query, self.get_message(user_id, EDIT_MESSAGES)['session_expired'])
+            return
         
-        return field
+        await self.edit_query_message(
+            query,
+            text=self.get_song_info_text(user_id, song_data),
+            reply_markup=self.get_song_info_markup(user_id, song_data),
+            parse_mode=ParseMode.MARKDOWN
+        )
+
+    async def edit_cancel_callback(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
+        """Handle cancel button: leave the edit conversation"""
+        query = update.callback_query
+        await query.answer()
+        
+        user_id = query.from_user.id
+        self.set_edit_state(context, None)
+        await self.edit_query_message(query, self.get_message(user_id, EDIT_MESSAGES)['cancel'])
+
+    async def search_again_callback(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
+        """Handle search again button: ask for a new audio file"""
+        query = update.callback_query
+        await query.answer()
+        
+        user_id = query.from_user.id
+        self.set_edit_state(context, None)
+        await query.message.reply_text(self.get_message(user_id, RECOGNITION_MESSAGES)['send_audio'])
 
     async def handle_edit_input(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
         """Handle text input for editing"""
         user_id = update.effective_user.id
-        lang = self.get_user_language(user_id)
         
-        # Get the field being edited
-        field = context.user_data.get('edit_state')
+        # Text only matters while waiting for a field value
+        field = EDIT_STATE_FIELDS.get(self.get_edit_state(context))
         if not field:
             return
         
-        # Get the new value
-        new_value = update.message.text.strip()
+        session = self.user_sessions.get(user_id, {})
+        if 'song_data' not in session:
+            self.set_edit_state(context, None)
+            await update.message.reply_text(self.get_message(user_id, EDIT_MESSAGES)['session_expired'])
+            return
         
         # Update the song data
-        session = self.user_sessions.get(user_id, {})
-        if 'song_data' in session:
-            session['song_data'][field] = new_value
+        new_value = update.message.text.strip()
+        session['song_data'][field] = new_value
         
         # Send confirmation
         success_text = self.get_message(user_id, EDIT_MESSAGES)['success']
         await update.message.reply_text(success_text)
         
         # Clear conversation state
-        context.user_data['edit_state'] = None
+        self.set_edit_state(context, None)
         
         # Show updated song info
         await self.show_updated_song_info(update, user_id)
 
-    async def show_updated_song_info(self, update: Update, user_id: int):
-        """Show updated song information"""
-        session = self.user_sessions.get(user_id, {})
-        song_data = session.get('song_data', {})
-        
+    def get_song_info_text(self, user_id: int, song_data: Dict) -> str:
+        """Localized text listing the (possibly edited) song information"""
         lang = self.get_user_language(user_id)
         
         info_text = {
@@ -597,20 +1245,92 @@ class ShazamBot:
 🎭 **Genre:** {song_data.get('genre', 'Unknown Genre')}"""
         }
         
+        return info_text.get(lang, info_text['en'])
+
+    def get_song_info_markup(self, user_id: int, song_data: Dict) -> InlineKeyboardMarkup:
+        """Keyboard shown under the song information"""
         buttons = self.get_buttons(user_id)
         keyboard = [
-            [InlineKeyboardButton(buttons['edit_info'], callback_data="edit_again")],
-            [InlineKeyboardButton(buttons['search_again'], callback_data="search_again")]
+            [InlineKeyboardButton(buttons['edit_info'], callback_data=pack(CB_EDIT_AGAIN))],
+            [InlineKeyboardButton(buttons['search_again'], callback_data=pack(CB_SEARCH_AGAIN))]
         ]
         
-        reply_markup = InlineKeyboardMarkup(keyboard)
+        if self.config.enable_metadata_writing and song_data.get('file_id'):
+            keyboard.insert(0, [InlineKeyboardButton(buttons['save'], callback_data=pack(CB_EDIT_SAVE))])
+        
+        return InlineKeyboardMarkup(keyboard)
+
+    async def show_updated_song_info(self, update: Update, user_id: int):
+        """Show updated song information"""
+        session = self.user_sessions.get(user_id, {})
+        song_data = session.get('song_data', {})
         
         await update.message.reply_text(
-            info_text.get(lang, info_text['en']),
-            reply_markup=reply_markup,
+            self.get_song_info_text(user_id, song_data),
+            reply_markup=self.get_song_info_markup(user_id, song_data),
             parse_mode=ParseMode.MARKDOWN
         )
 
+    async def save_callback(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
+        """Handle save button: write edited tags into the file and send it back"""
+        query = update.callback_query
+        await query.answer()
+        
+        user_id = query.from_user.id
+        await self.send_tagged_audio(query.message, context, user_id)
+
+    async def send_tagged_audio(self, message: Message, context: ContextTypes.DEFAULT_TYPE, user_id: int):
+        """Write the session's song data into the original file and send it as audio"""
+        edit_messages = self.get_message(user_id, EDIT_MESSAGES)
+        session = self.user_sessions.get(user_id, {})
+        song_data = session.get('song_data', {})
+        
+        if not self.config.enable_metadata_writing or not song_data.get('file_id'):
+            await message.reply_text(edit_messages['save_unavailable'])
+            return
+        
+        # Only write real values, never the display placeholders
+        tags = {
+            field: str(song_data[field])
+            for field in TAG_FIELDS
+            if song_data.get(field) and song_data[field] != DEFAULT_SONG_VALUES.get(field)
+        }
+        
+        status_msg = await message.reply_text(edit_messages['saving'])
+        
+        async def download(path: str):
+            file = await context.bot.get_file(song_data['file_id'])
+            await file.download_to_drive(path)
+        
+        try:
+            cover = await self.cover_art.get_bytes(song_data.get('cover_url'))
+            file_unique_id = song_data.get('file_unique_id') or song_data['file_id']
+            
+            # A file already sent with these exact tags is resent by file_id,
+            # skipping the download, the tag write and the upload
+            key = 'audio:' + self.metadata_writer.cache_key(file_unique_id, tags, cover)
+            
+            async def send(audio):
+                file_name = song_data.get('file_name') or 'audio'
+                extension = os.path.splitext(audio.name)[1] if hasattr(audio, 'name') else ''
+                return await message.reply_audio(
+                    audio=audio,
+                    title=tags.get('title'),
+                    performer=tags.get('artist'),
+                    filename=os.path.splitext(file_name)[0] + extension
+                )
+            
+            async def open_upload():
+                tagged_path = await self.metadata_writer.get_or_create(file_unique_id, tags, cover, download)
+                return open(tagged_path, 'rb')
+            
+            await self.file_ids.send(key, send, open_upload)
+            await status_msg.delete()
+            
+        except Exception as e:
+            self.logger.error(f"Error writing metadata: {e}")
+            await status_msg.edit_text(edit_messages['save_failed'])
+
     async def inline_query(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
         """Handle inline queries"""
         query = update.inline_query
@@ -623,13 +1343,17 @@ class ShazamBot:
         search_query = query.query.strip()
         
         try:
-            # Search for tracks
-            results = await self.shazam.search_track(query=search_query, limit=10)
+            # Search for tracks; the same query from any user or bot process is answered from the cache
+            hits = await self.cache.get_or_load(
+                f"search:{' '.join(search_query.lower().split())}",
+                lambda: self.search_tracks(search_query),
+                ttl=self.config.search_cache_ttl,
+                negative_ttl=self.config.negative_cache_ttl
+            )
             
             inline_results = []
             
-            for track in results.get('tracks', {}).get('hits', [])[:5]:
-                track_data = track.get('track', {})
+            for track_data in hits or []:
                 title = track_data.get('title', 'Unknown')
                 artist = track_data.get('subtitle', 'Unknown Artist')
                 
@@ -639,7 +1363,7 @@ class ShazamBot:
                     title=f"{title} - {artist}",
                     description=f"🎵 {title} by {artist}",
                     input_message_content=InputTextMessageContent(
-                        message_text=f"🎵 **{title}**\n🎤 {artist}\n\nFound via @{BOT_USERNAME}",
+                        message_text=f"🎵 **{title}**\n🎤 {artist}\n\nFound via @{self.config.bot_username}",
                         parse_mode=ParseMode.MARKDOWN
                     ),
                     thumb_url=track_data.get('images', {}).get('coverart', ''),
@@ -683,11 +1407,37 @@ class ShazamBot:
             )
             await query.answer([result], cache_time=300)
 
+    async def search_tracks(self, search_query: str) -> Optional[List[Dict]]:
+        """Top search hits, trimmed to the fields inline results use; None if nothing matched"""
+        results = await self.shazam.search_track(query=search_query, limit=10)
+        hits = []
+        for track in results.get('tracks', {}).get('hits', [])[:5]:
+            track_data = track.get('track', {})
+            hit = {field: track_data[field] for field in ('id', 'title', 'subtitle') if field in track_data}
+            coverart = track_data.get('images', {}).get('coverart')
+            if coverart:
+                hit['images'] = {'coverart': coverart}
+            hits.append(hit)
+        return hits or None
+
+    async def load_user_language(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
+        """Bring the user's language from the shared cache into L1 for get_user_language"""
+        if update.effective_user:
+            await self.cache.get(f"lang:{update.effective_user.id}")
+
+    async def assign_request_id(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
+        """Tag all log records produced while handling this update with its id"""
+        request_id_var.set(str(update.update_id))
+
     async def error_handler(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
         """Handle errors"""
-        self.logger.error(f"Update {update} caused error {context.error}")
+        update_id = update.update_id if isinstance(update, Update) else None
+        self.logger.error(
+            f"Update {update_id} caused error: {context.error!r}",
+            exc_info=(type(context.error), context.error, context.error.__traceback__)
+        )
         
-        if update and update.effective_message:
+        if isinstance(update, Update) and update.effective_message:
             try:
                 await update.effective_message.reply_text(
                     "❌ An error occurred. Please try again later."
@@ -695,19 +1445,49 @@ class ShazamBot:
             except Exception:
                 pass
 
+    def setup_callback_routes(self):
+        """Register callback actions and aliases for buttons sent by older versions"""
+        router = self.callback_router
+        router.route(CB_LANGUAGE, self.language_callback, nargs=1)
+        router.route(CB_EDIT, self.edit_callback, nargs=1)
+        router.route(CB_EDIT_FIELD, self.edit_field_callback, nargs=1)
+        router.route(CB_EDIT_BACK, self.edit_back_callback)
+        router.route(CB_EDIT_CANCEL, self.edit_cancel_callback)
+        router.route(CB_EDIT_AGAIN, self.edit_again_callback)
+        router.route(CB_EDIT_SAVE, self.save_callback)
+        router.route(CB_SEARCH_AGAIN, self.search_again_callback)
+        router.route(CB_HISTORY_PAGE, self.history_page_callback, nargs=1)
+        router.route(CB_HISTORY_ENTRY, self.history_entry_callback, nargs=1)
+        router.route(CB_TRACKLIST_STOP, self.tracklist_stop_callback)
+        
+        # Unversioned callback_data used before the router existed
+        router.alias('edit_back', CB_EDIT_BACK)
+        router.alias('edit_cancel', CB_EDIT_CANCEL)
+        router.alias('edit_again', CB_EDIT_AGAIN)
+        router.alias('edit_save', CB_EDIT_SAVE)
+        router.alias('search_again', CB_SEARCH_AGAIN)
+        router.alias_prefix('lang_', CB_LANGUAGE)
+        router.alias_prefix('edit_field_', CB_EDIT_FIELD)
+        router.alias_prefix('edit_', CB_EDIT)
+
     def setup_handlers(self, application: Application):
         """Setup all handlers"""
+        # Runs first for every update, in the same context as the handlers below
+        application.add_handler(TypeHandler(Update, self.assign_request_id), group=-2)
+        application.add_handler(TypeHandler(Update, self.load_user_language), group=-1)
+        
         # Command handlers
         application.add_handler(CommandHandler("start", self.start_command))
         application.add_handler(CommandHandler("help", self.help_command))
+        application.add_handler(CommandHandler("history", self.history_command))
+        application.add_handler(CommandHandler("stats", self.stats_command))
         
-        # Callback handlers
-        application.add_handler(CallbackQueryHandler(self.language_callback, pattern="^lang_"))
-        application.add_handler(CallbackQueryHandler(self.edit_callback, pattern="^edit_"))
-        application.add_handler(CallbackQueryHandler(self.edit_field_callback, pattern="^edit_field_"))
+        # Callback handler: every button press goes through the router
+        application.add_handler(CallbackQueryHandler(self.callback_router.dispatch))
         
         # Message handlers
-        application.add_handler(MessageHandler(filters.AUDIO | filters.VOICE | filters.Document.AUDIO, self.handle_audio_file))
+        # Every update already runs in its own task in the recognition lane (see LaneUpdateProcessor)
+        application.add_handler(MessageHandler(filters.AUDIO | filters.VOICE | filters.VIDEO_NOTE | filters.Document.AUDIO, self.handle_audio_file))
         application.add_handler(MessageHandler(filters.TEXT & ~filters.COMMAND, self.handle_edit_input))
         
         # Inline query handler
@@ -716,10 +1496,46 @@ class ShazamBot:
         # Error handler
         application.add_error_handler(self.error_handler)
 
+    async def post_init(self, application: Application):
+        """Prepare the process before polling starts"""
+        self.lifecycle.sweep_stale_temp_files()
+        self.lifecycle.install_signal_handlers(application)
+        await self.history.start()
+        await self.cache.start()
+        
+        if self.config.enable_config_reload:
+            self.config_watcher.start()
+        
+        # Off the critical path: polling starts without waiting for this
+        if self.config.enable_warmup:
+            application.create_task(self.warm_up())
+        
+        if self.config.admin_dashboard_port:
+            try:
+                self.dashboard_runner = await start_dashboard(self.analytics, self.config.admin_dashboard_host, self.config.admin_dashboard_port)
+                self.lifecycle.on_flush(self.dashboard_runner.cleanup)
+            except OSError as e:
+                self.logger.error(f"Could not start admin dashboard: {e}")
+        
+        self.logger.info(f"Ready in {time.perf_counter() - STARTED_AT:.2f}s")
+
+    async def post_shutdown(self, application: Application):
+        """Flush state once the application has stopped"""
+        await self.lifecycle.flush()
+        self.logger.info("Shazam Telegram Bot stopped")
+        self.log_listener.stop()
+
     def run(self):
         """Run the bot"""
         # Create application
-        application = Application.builder().token(TELEGRAM_BOT_TOKEN).build()
+        application = (
+            Application.builder()
+            .token(self.config.telegram_bot_token)
+            .concurrent_updates(self.update_processor)
+            .post_init(self.post_init)
+            .post_shutdown(self.post_shutdown)
+            .build()
+        )
         
         # Setup handlers
         self.setup_handlers(application)
@@ -727,16 +1543,22 @@ class ShazamBot:
         # Set bot commands
         commands = [
             BotCommand("start", "Start the bot / انتخاب زبان"),
-            BotCommand("help", "Show help / نمایش راهنما")
+            BotCommand("help", "Show help / نمایش راهنما"),
+            BotCommand("history", "My songs / آهنگ‌های من")
         ]
         
-        # Start the bot
+        # Start the bot; updates queued while the bot was down are processed,
+        # and SIGTERM/SIGINT are handled by the lifecycle manager
         self.logger.info("Starting Shazam Telegram Bot...")
-        application.run_polling(drop_pending_updates=True)
+        application.run_polling(drop_pending_updates=False, stop_signals=None)
 
 def main():
     """Main function"""
-    bot = ShazamBot()
+    try:
+        settings = load_settings()
+    except ConfigError as e:
+        raise SystemExit(f"Invalid configuration: {e}")
+    bot = ShazamBot(settings)
     bot.run()
 
 if __name__ == "__main__":
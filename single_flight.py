@@ -0,0 +1,56 @@
+"""
+Single-Flight Calls for Shazam Telegram Bot
+Runs one call per key at a time and shares its result with concurrent callers
+
+Used wherever several updates can ask for the same expensive thing at
+once (a tagged file, a cover download, a recognition). The first caller
+runs the call and the others wait for its result. If it fails, they get
+the same exception. If the first caller is cancelled, the call is
+abandoned and the next waiter starts it again, so one user leaving never
+cancels anyone else's request.
+"""
+
+import asyncio
+from typing import Any, Awaitable, Callable, Dict, Hashable
+
+
+class SingleFlight:
+    """Deduplicates concurrent calls by key"""
+
+    def __init__(self):
+        self._pending: Dict[Hashable, asyncio.Future] = {}
+
+    def __contains__(self, key: Hashable) -> bool:
+        return key in self._pending
+
+    async def run(self, key: Hashable, factory: Callable[[], Awaitable[Any]]) -> Any:
+        """Result of factory(), shared with every concurrent caller for the same key"""
+        while True:
+            pending = self._pending.get(key)
+            if pending is None:
+                break
+            try:
+                return await asyncio.shield(pending)
+            except asyncio.CancelledError:
+                if not pending.cancelled():
+                    # This caller was cancelled, not the one running the call
+                    raise
+                # The caller running it was cancelled; take over
+
+        future = asyncio.get_running_loop().create_future()
+        self._pending[key] = future
+        try:
+            result = await factory()
+        except asyncio.CancelledError:
+            future.cancel()
+            raise
+        except BaseException as e:
+            future.set_exception(e)
+            # Mark the exception as retrieved when nobody else is waiting
+            future.exception()
+            raise
+        else:
+            future.set_result(result)
+            return result
+        finally:
+            del self._pending[key]
@@ -0,0 +1,432 @@
+"""
+Two-Tier Cache for Shazam Telegram Bot
+In-process LRU in front of a cache shared by every bot process
+
+L1 is a small LRU dict in each process. L2 is shared: a SQLite file in
+WAL mode for processes on one machine, or any server speaking the Redis
+protocol. Values are stored as msgpack. "Nothing found" results are
+cached too (with their own, shorter TTL) so repeated misses don't hit
+Shazam again. Stampedes are prevented at both levels: within a process
+concurrent loads of a key share one call, and across processes a short
+lease in L2 lets one process load while the others wait for its result.
+L2 errors are logged and treated as misses; the cache never fails a request.
+Every Redis command has a short timeout, and after a failure the server
+is left alone for a growing backoff, so a hung or unreachable L2 costs
+at most one timeout instead of stalling every update.
+"""
+
+import asyncio
+import logging
+import socket
+import sqlite3
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Awaitable, Callable, Optional, Tuple
+from urllib.parse import urlparse
+
+import msgpack
+
+from single_flight import SingleFlight
+
+logger = logging.getLogger(__name__)
+
+# Returned by get() when a key is not cached at all (None means a cached "no result")
+MISS = object()
+
+# How long another process may hold a load lease, and how long we wait on it
+LEASE_SECONDS = 30.0
+LEASE_WAIT_SECONDS = 5.0
+LEASE_POLL_SECONDS = 0.1
+
+# With a shared L2, L1 copies are re-read after this long so changes made
+# by other processes (e.g. a user's language) show up
+L1_MAX_TTL = 60.0
+
+# Redis connect and per-command timeouts, and the backoff after a failure
+# (doubling per consecutive failure up to the maximum)
+REDIS_TIMEOUT_SECONDS = 1.0
+REDIS_BACKOFF_SECONDS = 1.0
+REDIS_MAX_BACKOFF_SECONDS = 30.0
+
+
+class CacheUnavailable(ConnectionError):
+    """L2 failed or is being skipped until its backoff ends; already logged by the backend"""
+
+
+def pack(value: Any) -> bytes:
+    """Serialize a value; None is stored as a negative entry"""
+    return msgpack.packb([0] if value is None else [1, value], use_bin_type=True)
+
+
+def unpack(data: bytes) -> Any:
+    """Inverse of pack()"""
+    entry = msgpack.unpackb(data, raw=False, strict_map_key=False)
+    return entry[1] if entry[0] else None
+
+
+class SQLiteBackend:
+    """Shared cache in a SQLite file; safe for several processes on one host"""
+
+    SCHEMA = """
+    CREATE TABLE IF NOT EXISTS cache (
+        key TEXT PRIMARY KEY,
+        value BLOB NOT NULL,
+        expires_at REAL
+    );
+    """
+
+    def __init__(self, db_path: str, purge_every: int = 1000):
+        self.db_path = db_path
+        self.purge_every = purge_every
+        self._writes = 0
+        # One worker thread owns the connection, so all SQL is serialized
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='cache')
+        self._conn: Optional[sqlite3.Connection] = None
+
+    async def _run(self, func, *args):
+        """Run a database function on the worker thread"""
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._executor, func, *args)
+
+    def _open(self):
+        self._conn = sqlite3.connect(self.db_path, check_same_thread=False)
+        self._conn.execute('PRAGMA journal_mode=WAL')
+        self._conn.execute('PRAGMA synchronous=NORMAL')
+        # Other processes may hold the write lock briefly
+        self._conn.execute('PRAGMA busy_timeout=5000')
+        self._conn.executescript(self.SCHEMA)
+        self._conn.commit()
+
+    def _get(self, key: str) -> Optional[bytes]:
+        row = self._conn.execute(
+            'SELECT value FROM cache WHERE key = ? AND (expires_at IS NULL OR expires_at > ?)',
+            (key, time.time())
+        ).fetchone()
+        return row[0] if row else None
+
+    def _set(self, key: str, value: bytes, ttl: Optional[float]):
+        now = time.time()
+        with self._conn:
+            self._conn.execute(
+                'INSERT OR REPLACE INTO cache (key, value, expires_at) VALUES (?, ?, ?)',
+                (key, value, now + ttl if ttl else None)
+            )
+        self._writes += 1
+        if self._writes % self.purge_every == 0:
+            with self._conn:
+                self._conn.execute('DELETE FROM cache WHERE expires_at <= ?', (now,))
+
+    def _add(self, key: str, value: bytes, ttl: float) -> bool:
+        now = time.time()
+        with self._conn:
+            self._conn.execute('DELETE FROM cache WHERE key = ? AND expires_at <= ?', (key, now))
+            cursor = self._conn.execute(
+                'INSERT OR IGNORE INTO cache (key, value, expires_at) VALUES (?, ?, ?)',
+                (key, value, now + ttl)
+            )
+        return cursor.rowcount == 1
+
+    def _delete(self, key: str):
+        with self._conn:
+            self._conn.execute('DELETE FROM cache WHERE key = ?', (key,))
+
+    async def start(self):
+        await self._run(self._open)
+
+    async def get(self, key: str) -> Optional[bytes]:
+        return await self._run(self._get, key)
+
+    async def set(self, key: str, value: bytes, ttl: Optional[float] = None):
+        await self._run(self._set, key, value, ttl)
+
+    async def add(self, key: str, value: bytes, ttl: float) -> bool:
+        """Set only if the key is absent; returns whether it was set"""
+        return await self._run(self._add, key, value, ttl)
+
+    async def delete(self, key: str):
+        await self._run(self._delete, key)
+
+    async def close(self):
+        if self._conn:
+            await self._run(self._conn.close)
+            self._conn = None
+        self._executor.shutdown(wait=True)
+
+
+class RedisBackend:
+    """Minimal client for a server speaking the Redis protocol (RESP2)
+
+    Only GET, SET (with PX/NX) and DEL are used, so Redis, Valkey, KeyDB or
+    any local stand-in implementing those works. Commands are sent one at
+    a time over a single connection that is re-opened after errors.
+    Connecting and each command are bounded by `timeout`; after a failure
+    commands raise CacheUnavailable until the backoff has passed.
+    """
+
+    def __init__(self, url: str, timeout: float = REDIS_TIMEOUT_SECONDS):
+        parsed = urlparse(url)
+        self.host = parsed.hostname or '127.0.0.1'
+        self.port = parsed.port or 6379
+        self.password = parsed.password
+        self.db = int(parsed.path.lstrip('/') or 0)
+        self.timeout = timeout
+        self._failures = 0
+        self._retry_at = 0.0
+        self._reader: Optional[asyncio.StreamReader] = None
+        self._writer: Optional[asyncio.StreamWriter] = None
+        self._lock: Optional[asyncio.Lock] = None
+
+    @staticmethod
+    def _encode(*args) -> bytes:
+        parts = [b'*%d\r\n' % len(args)]
+        for arg in args:
+            if not isinstance(arg, bytes):
+                arg = str(arg).encode('utf-8')
+            parts.append(b'$%d\r\n%s\r\n' % (len(arg), arg))
+        return b''.join(parts)
+
+    async def _read_reply(self):
+        line = await self._reader.readline()
+        if not line.endswith(b'\r\n'):
+            raise ConnectionError("Connection closed by cache server")
+        kind, payload = line[:1], line[1:-2]
+        if kind == b'+':
+            return payload.decode()
+        if kind == b'-':
+            raise RuntimeError(f"Cache server error: {payload.decode()}")
+        if kind == b':':
+            return int(payload)
+        if kind == b'$':
+            length = int(payload)
+            if length < 0:
+                return None
+            return (await self._reader.readexactly(length + 2))[:-2]
+        if kind == b'*':
+            length = int(payload)
+            if length < 0:
+                return None
+            return [await self._read_reply() for _ in range(length)]
+        raise ConnectionError(f"Unexpected reply from cache server: {line!r}")
+
+    async def _connect(self):
+        self._reader, self._writer = await asyncio.open_connection(self.host, self.port)
+        sock = self._writer.get_extra_info('socket')
+        if sock is not None:
+            sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        if self.password:
+            await self._send('AUTH', self.password)
+        if self.db:
+            await self._send('SELECT', self.db)
+
+    async def _send(self, *args):
+        self._writer.write(self._encode(*args))
+        await self._writer.drain()
+        return await self._read_reply()
+
+    def _disconnect(self):
+        if self._writer:
+            self._writer.close()
+        self._reader = self._writer = None
+
+    def _check_backoff(self):
+        if self._failures and time.monotonic() < self._retry_at:
+            raise CacheUnavailable("Cache server skipped after a recent failure")
+
+    def _failed(self, error: BaseException):
+        """Drop the connection and skip the server for a while"""
+        self._disconnect()
+        self._failures += 1
+        backoff = min(REDIS_MAX_BACKOFF_SECONDS, REDIS_BACKOFF_SECONDS * 2 ** (self._failures - 1))
+        self._retry_at = time.monotonic() + backoff
+        logger.warning(f"Cache server {self.host}:{self.port} failed ({error!r}), skipping it for {backoff:.0f}s")
+
+    async def command(self, *args):
+        """Send one command and return its reply"""
+        # Fail fast instead of queueing behind a command that is timing out
+        self._check_backoff()
+        async with self._lock:
+            self._check_backoff()
+            try:
+                if self._writer is None or self._writer.is_closing():
+                    await asyncio.wait_for(self._connect(), self.timeout)
+                reply = await asyncio.wait_for(self._send(*args), self.timeout)
+            except (ConnectionError, OSError, asyncio.IncompleteReadError, asyncio.TimeoutError) as e:
+                # The reply may still be in flight; don't let the next command read it
+                self._failed(e)
+                raise CacheUnavailable(f"Cache server failed: {e!r}") from e
+            except asyncio.CancelledError:
+                self._disconnect()
+                raise
+            self._failures = 0
+            return reply
+
+    async def start(self):
+        self._lock = asyncio.Lock()
+
+    async def get(self, key: str) -> Optional[bytes]:
+        return await self.command('GET', key)
+
+    async def set(self, key: str, value: bytes, ttl: Optional[float] = None):
+        if ttl:
+            await self.command('SET', key, value, 'PX', int(ttl * 1000))
+        else:
+            await self.command('SET', key, value)
+
+    async def add(self, key: str, value: bytes, ttl: float) -> bool:
+        """Set only if the key is absent; returns whether it was set"""
+        return await self.command('SET', key, value, 'NX', 'PX', int(ttl * 1000)) == 'OK'
+
+    async def delete(self, key: str):
+        await self.command('DEL', key)
+
+    async def close(self):
+        if self._writer:
+            self._writer.close()
+            try:
+                await self._writer.wait_closed()
+            except Exception:
+                pass
+        self._reader = self._writer = None
+
+
+def _log_l2_error(action: str, error: Exception):
+    """Log an L2 failure unless the backend already reported it"""
+    if not isinstance(error, CacheUnavailable):
+        logger.warning(f"Shared cache {action} failed: {error}")
+
+
+class TieredCache:
+    """L1 LRU per process, optional shared L2 backend"""
+
+    def __init__(self, backend=None, l1_entries: int = 2048, namespace: str = 'shazambot'):
+        self.backend = backend
+        self.l1_entries = l1_entries
+        self.namespace = namespace
+        # key -> (expires_at or None, value)
+        self._l1: "OrderedDict[str, Tuple[Optional[float], Any]]" = OrderedDict()
+        self._flights = SingleFlight()
+
+    async def start(self):
+        if self.backend:
+            await self.backend.start()
+
+    async def close(self):
+        if self.backend:
+            await self.backend.close()
+
+    def _l2_key(self, key: str) -> str:
+        return f"{self.namespace}:{key}"
+
+    def _l1_put(self, key: str, value: Any, ttl: Optional[float]):
+        if self.backend:
+            ttl = min(ttl, L1_MAX_TTL) if ttl else L1_MAX_TTL
+        self._l1[key] = (time.monotonic() + ttl if ttl else None, value)
+        self._l1.move_to_end(key)
+        while len(self._l1) > self.l1_entries:
+            self._l1.popitem(last=False)
+
+    def peek(self, key: str) -> Any:
+        """L1 lookup only; never waits"""
+        entry = self._l1.get(key)
+        if entry is None:
+            return MISS
+        expires_at, value = entry
+        if expires_at is not None and expires_at <= time.monotonic():
+            del self._l1[key]
+            return MISS
+        self._l1.move_to_end(key)
+        return value
+
+    async def _l2_get(self, key: str) -> Any:
+        if not self.backend:
+            return MISS
+        try:
+            data = await self.backend.get(self._l2_key(key))
+        except Exception as e:
+            _log_l2_error('read', e)
+            return MISS
+        return MISS if data is None else unpack(data)
+
+    async def get(self, key: str) -> Any:
+        """Cached value, None for a cached negative result, or MISS"""
+        value = self.peek(key)
+        if value is not MISS:
+            return value
+        value = await self._l2_get(key)
+        if value is not MISS:
+            self._l1_put(key, value, None)
+        return value
+
+    async def set(self, key: str, value: Any, ttl: Optional[float] = None):
+        """Cache a value (None caches a negative result); ttl None means no expiry"""
+        self._l1_put(key, value, ttl)
+        if self.backend:
+            try:
+                await self.backend.set(self._l2_key(key), pack(value), ttl)
+            except Exception as e:
+                _log_l2_error('write', e)
+
+    async def _wait_for_other_process(self, key: str) -> Any:
+        """Poll L2 while another process holds the load lease"""
+        loop = asyncio.get_running_loop()
+        give_up_at = loop.time() + LEASE_WAIT_SECONDS
+        while loop.time() < give_up_at:
+            await asyncio.sleep(LEASE_POLL_SECONDS)
+            value = await self._l2_get(key)
+            if value is not MISS:
+                return value
+        return MISS
+
+    async def _load(self, key: str, loader: Callable[[], Awaitable[Any]], ttl: Optional[float],
+                    negative_ttl: Optional[float]) -> Any:
+        lease_key = self._l2_key(key + ':lease')
+        leased = False
+        if self.backend:
+            try:
+                leased = await self.backend.add(lease_key, b'1', LEASE_SECONDS)
+            except Exception as e:
+                _log_l2_error('lease', e)
+                leased = True
+            if not leased:
+                value = await self._wait_for_other_process(key)
+                if value is not MISS:
+                    self._l1_put(key, value, ttl if value is not None else negative_ttl)
+                    return value
+
+        try:
+            value = await loader()
+            if value is not None:
+                await self.set(key, value, ttl)
+            elif negative_ttl:
+                await self.set(key, None, negative_ttl)
+            return value
+        finally:
+            if leased and self.backend:
+                try:
+                    await self.backend.delete(lease_key)
+                except Exception:
+                    pass
+
+    async def get_or_load(self, key: str, loader: Callable[[], Awaitable[Any]], ttl: Optional[float] = None,
+                          negative_ttl: Optional[float] = None) -> Any:
+        """Cached value, or the loader's result cached for next time
+
+        A loader returning None is a negative result, cached for negative_ttl
+        if given. Loader exceptions propagate and nothing is cached.
+        """
+        value = await self.get(key)
+        if value is not MISS:
+            return value
+
+        # Concurrent loads of a key in this process share one call
+        return await self._flights.run(key, lambda: self._load(key, loader, ttl, negative_ttl))
+
+
+def create_cache(backend: str, sqlite_file: str, redis_url: str, l1_entries: int) -> TieredCache:
+    """TieredCache for the configured backend ('sqlite', 'redis' or 'memory')"""
+    if backend == 'sqlite':
+        return TieredCache(SQLiteBackend(sqlite_file), l1_entries)
+    if backend == 'redis':
+        return TieredCache(RedisBackend(redis_url), l1_entries)
+    return TieredCache(None, l1_entries)
@@ -0,0 +1,111 @@
+"""
+Priority Update Processor for Shazam Telegram Bot
+Processes updates concurrently in separate lanes so bulk work can't delay interactive answers
+
+Every update is put in a lane by type: inline queries and button presses
+("interactive"), then text messages and commands ("text"), then audio
+and everything else ("recognition"). Buttons that start heavy work (a
+download and retag, a re-sent file) can be moved to the recognition lane
+so they don't hold interactive slots. Each lane has its own concurrency
+limit, so a burst of audio files fills only the recognition lane. A lane
+also holds back while a higher-priority lane has updates waiting for a
+slot, so under load interactive updates are started first.
+"""
+
+import asyncio
+import logging
+from typing import Any, Awaitable, Callable, Dict, Optional
+
+from telegram import Update
+from telegram.ext import BaseUpdateProcessor
+
+from limits import ResizableSemaphore
+
+logger = logging.getLogger(__name__)
+
+LANE_INTERACTIVE = 'interactive'
+LANE_TEXT = 'text'
+LANE_RECOGNITION = 'recognition'
+
+# Highest priority first
+LANES = (LANE_INTERACTIVE, LANE_TEXT, LANE_RECOGNITION)
+
+# Lane for a button's callback_data, or None to keep it interactive
+CallbackLaneFunc = Callable[[Optional[str]], Optional[str]]
+
+# Hard ceiling on concurrently processed updates across all lanes
+MAX_CONCURRENT_UPDATES = 1024
+
+
+def lane_for(update: object, callback_lane: Optional[CallbackLaneFunc] = None) -> str:
+    """Lane an update is processed in"""
+    if not isinstance(update, Update):
+        return LANE_TEXT
+    if update.callback_query and callback_lane:
+        lane = callback_lane(update.callback_query.data)
+        if lane:
+            return lane
+    if update.inline_query or update.chosen_inline_result or update.callback_query:
+        return LANE_INTERACTIVE
+    message = update.message or update.edited_message
+    if message and message.text:
+        return LANE_TEXT
+    return LANE_RECOGNITION
+
+
+class LaneUpdateProcessor(BaseUpdateProcessor):
+    """Update processor with a concurrency limit and priority per lane"""
+
+    def __init__(self, limits: Dict[str, int], callback_lane: Optional[CallbackLaneFunc] = None):
+        super().__init__(MAX_CONCURRENT_UPDATES)
+        self.callback_lane = callback_lane
+        self.lanes = {lane: ResizableSemaphore(limits[lane]) for lane in LANES}
+        self._changed: Optional[asyncio.Condition] = None
+
+    def resize(self, limits: Dict[str, int]):
+        """Change lane limits while running"""
+        for lane, limit in limits.items():
+            self.lanes[lane].resize(limit)
+
+    def _higher_waiting(self, lane: str) -> bool:
+        """Whether a higher-priority lane has updates waiting for a slot"""
+        for higher in LANES[:LANES.index(lane)]:
+            if self.lanes[higher].waiting:
+                return True
+        return False
+
+    async def _notify(self):
+        """Wake lanes that are holding back for higher-priority work"""
+        async with self._changed:
+            self._changed.notify_all()
+
+    async def do_process_update(self, update: object, coroutine: Awaitable[Any]):
+        lane = lane_for(update, self.callback_lane)
+        slots = self.lanes[lane]
+        started = False
+        try:
+            if self._higher_waiting(lane):
+                async with self._changed:
+                    await self._changed.wait_for(lambda: not self._higher_waiting(lane))
+
+            async with slots:
+                started = True
+                await coroutine
+        finally:
+            if not started and asyncio.iscoroutine(coroutine):
+                # Cancelled while queued: the handlers never ran
+                coroutine.close()
+            await self._notify()
+
+    async def initialize(self):
+        self._changed = asyncio.Condition()
+
+    async def shutdown(self):
+        """Nothing to release; in-flight updates are drained by the lifecycle manager"""
+
+    def stats(self) -> Dict[str, Dict[str, int]]:
+        """Active and waiting updates per lane"""
+        return {
+            lane: {'active': slots.in_use, 'waiting': slots.waiting, 'limit': slots.limit}
+            for lane, slots in self.lanes.items()
+        }